@@ -0,0 +1,100 @@
+"""
+Batched Grad-CAM shared by train_pipeline.py (CLI) and infer_server.py.
+
+One forward pass over all images keeps the target layer's activations; backward
+pass k then fills the k-th requested target of every image at once (grad_outputs
+is one-hot per row). Only the layers after the target layer are recorded, so
+N images x K targets cost 1 forward and K cheap backward passes instead of N*K
+full forward/backward passes. Needs torch, numpy and Pillow; pytorch-grad-cam is
+only used for the colour overlay.
+"""
+
+import base64
+from io import BytesIO
+from typing import Any, List, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from PIL import Image
+
+
+def gradcam_target_layer(model: nn.Module) -> nn.Module:
+    # choose last conv layer
+    if hasattr(model, 'features') and isinstance(model.features, nn.Sequential):
+        return list(model.features.modules())[-1]
+    last_conv = None
+    for m in model.modules():
+        if isinstance(m, nn.Conv2d):
+            last_conv = m
+    if last_conv is None:
+        raise RuntimeError("Could not find a suitable conv layer for Grad-CAM.")
+    return last_conv
+
+
+def batched_gradcam(model: nn.Module, target_layer: nn.Module, images: torch.Tensor,
+                    targets: List[List[int]]) -> Tuple[torch.Tensor, List[List[int]], List[List[np.ndarray]]]:
+    """targets[n] lists class indices for image n (empty = its top-1 prediction).
+    Returns logits, the resolved targets and heatmaps[n][k] in [0, 1] at the input size."""
+    acts: List[torch.Tensor] = []
+
+    def keep_activation(module, inputs, output):
+        act = output.detach().requires_grad_()
+        acts.append(act)
+        return act
+
+    # With parameters frozen, autograd records nothing until the target layer's
+    # output, which is the only tensor that needs a gradient.
+    requires_grad = [p.requires_grad for p in model.parameters()]
+    model.requires_grad_(False)
+    handle = target_layer.register_forward_hook(keep_activation)
+    try:
+        with torch.enable_grad():
+            logits = model(images)
+            act = acts[0]
+            targets = [list(t) or [int(logits[n].argmax())] for n, t in enumerate(targets)]
+            passes = max(len(t) for t in targets)
+            cams: List[List[Any]] = [[None] * len(t) for t in targets]
+            for k in range(passes):
+                rows = [n for n, t in enumerate(targets) if k < len(t)]
+                grad_out = torch.zeros_like(logits)
+                grad_out[rows, [targets[n][k] for n in rows]] = 1.0
+                grads, = torch.autograd.grad(logits, act, grad_outputs=grad_out, retain_graph=k < passes - 1)
+                with torch.no_grad():
+                    cam = F.relu((grads.mean(dim=(2, 3), keepdim=True) * act).sum(dim=1, keepdim=True))
+                    cam = F.interpolate(cam, size=images.shape[-2:], mode='bilinear', align_corners=False)[:, 0]
+                    lo = cam.amin(dim=(1, 2), keepdim=True)
+                    hi = cam.amax(dim=(1, 2), keepdim=True)
+                    cam = ((cam - lo) / (hi - lo + 1e-7)).cpu().numpy()
+                for n in rows:
+                    cams[n][k] = cam[n]
+    finally:
+        handle.remove()
+        for p, flag in zip(model.parameters(), requires_grad):
+            p.requires_grad_(flag)
+    return logits.detach(), targets, cams
+
+
+def center_crop_view(pil: Image.Image, img_size: int, resize_ratio: float) -> Image.Image:
+    """The resize (shorter side) + center crop the model input went through."""
+    short = int(img_size * resize_ratio)
+    w, h = pil.size
+    if w <= h:
+        size = (short, int(short * h / w))
+    else:
+        size = (int(short * w / h), short)
+    img = pil.resize(size, Image.BILINEAR)
+    left = int(round((size[0] - img_size) / 2.0))
+    top = int(round((size[1] - img_size) / 2.0))
+    return img.crop((left, top, left + img_size, top + img_size))
+
+
+def gradcam_overlay_uri(pil: Image.Image, cam: np.ndarray, img_size: int, resize_ratio: float, alpha: float = 0.45) -> str:
+    from pytorch_grad_cam.utils.image import show_cam_on_image
+    disp_np = np.array(center_crop_view(pil, img_size, resize_ratio)).astype(np.float32) / 255.0
+    cam_image = show_cam_on_image(disp_np, cam, use_rgb=True, image_weight=(1.0 - alpha))
+    buf = BytesIO()
+    Image.fromarray(cam_image).save(buf, format='PNG')
+    data = base64.b64encode(buf.getvalue()).decode('utf-8')
+    return f"data:image/png;base64,{data}"
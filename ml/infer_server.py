@@ -1,28 +1,45 @@
+import time
+
+# Cold-start accounting starts before the heavy imports below.
+PROCESS_START = time.perf_counter()
+
 import os
 import io
 import json
 import base64
-from typing import Optional, Dict, Any, Union, TypedDict
+import ctypes
+import uuid
+import queue
+import shutil
+import sqlite3
+import asyncio
+import threading
+import importlib.util
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List, Tuple, Union, TypedDict
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from starlette.websockets import WebSocketState
 from pydantic import BaseModel
 from PIL import Image
 import numpy as np
 import torch
 import torch.nn as nn
-from torchvision import transforms
 
-# Optional: Grad-CAM (for explainability)
-try:
-    from pytorch_grad_cam import GradCAM
-    from pytorch_grad_cam.utils.image import show_cam_on_image
-    HAS_GRADCAM = True
-except Exception:
-    HAS_GRADCAM = False
+from gradcam_engine import batched_gradcam, gradcam_overlay_uri, gradcam_target_layer
+
+# Optional: Grad-CAM (for explainability). Only probed here; the package (and
+# torchvision's model builders) are imported on the first Grad-CAM request.
+HAS_GRADCAM = importlib.util.find_spec('pytorch_grad_cam') is not None
 
 from pathlib import Path
 
+IMPORT_MS = 1000.0 * (time.perf_counter() - PROCESS_START)
+
 ROOT = Path(__file__).resolve().parents[1]
 RUNS = ROOT / 'ml' / 'runs'
 
@@ -32,6 +49,25 @@ PADDY_EXPORT = RUNS / 'classifier_paddy' / 'export'
 PADDY_CKPT = RUNS / 'classifier_paddy' / 'best.pth'
 SEV_EXPORT = RUNS / 'severity_regression' / 'export' / 'severity_regression.ts.pt'
 
+# Reduced-precision CPU inference. Each model key runs in one of:
+#   fp32           - default, unchanged TorchScript module
+#   bf16_autocast  - fp32 weights, matmul/conv under torch.autocast('cpu', bfloat16)
+#   bf16 / fp16    - module and inputs converted to the reduced dtype
+# AGRI_PRECISION sets the default for all keys, AGRI_PRECISION_MODELS overrides
+# per key ("plantvillage=bf16_autocast,paddy=fp32"). Every non-fp32 choice is
+# checked against fp32 at startup and falls back if top-1 agreement is too low.
+PRECISIONS = ('fp32', 'bf16_autocast', 'bf16', 'fp16')
+PRECISION_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+DEFAULT_PRECISION = os.environ.get('AGRI_PRECISION', 'fp32')
+PRECISION_OVERRIDES = os.environ.get('AGRI_PRECISION_MODELS', '')
+MIN_TOP1_AGREEMENT = float(os.environ.get('AGRI_PRECISION_MIN_AGREEMENT', '0.98'))
+CALIB_DIR = Path(os.environ.get('AGRI_CALIB_DIR', str(ROOT / 'ml' / 'calibration')))
+CALIB_SAMPLES = int(os.environ.get('AGRI_CALIB_SAMPLES', '32'))
+# fp32-only models are not benchmarked at startup unless this is set.
+PRECISION_BENCH = os.environ.get('AGRI_PRECISION_BENCH', '0') == '1'
+BENCH_BATCH = 8
+BENCH_ITERS = 5
+
 app = FastAPI(title="AgriAssist Inference API")
 app.add_middleware(
     CORSMiddleware,
@@ -41,22 +77,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Preprocessing (match validation transforms used at training time)
+# Preprocessing (match validation transforms used at training time). Exports
+# carry a preprocess.json next to the model; these defaults cover older exports.
 IMG_SIZE = 256
-VAL_TF = transforms.Compose([
-    transforms.Resize(int(IMG_SIZE * 1.15)),
-    transforms.CenterCrop(IMG_SIZE),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+DEFAULT_PREPROCESS: Dict[str, Any] = {
+    "img_size": IMG_SIZE,
+    "resize_ratio": 1.15,
+    "mean": [0.485, 0.456, 0.406],
+    "std": [0.229, 0.224, 0.225],
+}
+
+
+def load_preprocess_meta(export_dir: Path) -> Dict[str, Any]:
+    meta = dict(DEFAULT_PREPROCESS)
+    meta_path = export_dir / 'preprocess.json'
+    if meta_path.exists():
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta.update(json.load(f))
+    return meta
+
+
+@lru_cache(maxsize=None)
+def preprocess_pipeline(img_size: int, resize_ratio: float, mean: Tuple[float, ...], std: Tuple[float, ...]):
+    # One cached pipeline per distinct preprocessing config. torchvision is
+    # imported here rather than at module level; the background model loader
+    # builds the pipelines during warmup so requests never pay for it.
+    from torchvision import transforms
+    return transforms.Compose([
+        transforms.Resize(int(img_size * resize_ratio)),
+        transforms.CenterCrop(img_size),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=list(mean), std=list(std))
+    ])
+
+
+def pipeline_for(meta: Dict[str, Any]):
+    return preprocess_pipeline(int(meta['img_size']), float(meta['resize_ratio']), tuple(meta['mean']), tuple(meta['std']))
 
 # Define type for classifier dictionary
 # The structure is {"model": ScriptModule, "labels": Dict[int, str]}
 class ModelDict(TypedDict):
     model: torch.jit.ScriptModule
     labels: Dict[int, str]
+    precision: str
+    preprocess: Dict[str, Any]
 
 classifiers: Dict[str, ModelDict] = {}
+precision_reports: Dict[str, Dict[str, Any]] = {}
 
 
 def load_torchscript_classifier(export_dir: Path) -> Optional[ModelDict]:
@@ -70,19 +137,184 @@ def load_torchscript_classifier(export_dir: Path) -> Optional[ModelDict]:
         labels = json.load(f)
     # labels keys are string indices: {"0":"Tomato_Late_blight", ...}
     idx_to_label = {int(k): v for k, v in labels.items()}
-    return {"model": model, "labels": idx_to_label}
+    return {"model": model, "labels": idx_to_label, "precision": "fp32", "preprocess": load_preprocess_meta(export_dir)}
+
 
+# -------------------- PRECISION --------------------
+
+def requested_precision(model_key: str) -> str:
+    precision = DEFAULT_PRECISION
+    for item in PRECISION_OVERRIDES.split(','):
+        key, _, value = item.partition('=')
+        if key.strip() == model_key and value.strip():
+            precision = value.strip()
+    if precision not in PRECISIONS:
+        print(f"[WARN] Unknown precision '{precision}' for {model_key}, using fp32. Options: {PRECISIONS}")
+        return 'fp32'
+    return precision
+
+
+def run_model(model: torch.jit.ScriptModule, precision: str, x: torch.Tensor) -> torch.Tensor:
+    """Forward pass in the given precision; always returns fp32 outputs."""
+    with torch.no_grad():
+        if precision == 'bf16_autocast':
+            with torch.autocast('cpu', dtype=torch.bfloat16):
+                out = model(x)
+        elif precision in PRECISION_DTYPES:
+            out = model(x.to(PRECISION_DTYPES[precision]))
+        else:
+            out = model(x)
+    return out.float()
+
+
+def module_size_mb(model: torch.jit.ScriptModule) -> float:
+    n_bytes = sum(t.numel() * t.element_size() for t in model.parameters())
+    n_bytes += sum(t.numel() * t.element_size() for t in model.buffers())
+    return n_bytes / (1024 * 1024)
+
+
+def load_calibration_batch(model_key: str, meta: Dict[str, Any]) -> Optional[torch.Tensor]:
+    calib_dir = CALIB_DIR / model_key
+    if not calib_dir.is_dir():
+        return None
+    tensors: List[torch.Tensor] = []
+    for path in sorted(calib_dir.rglob('*')):
+        if path.suffix.lower() not in ('.jpg', '.jpeg', '.png', '.bmp', '.webp'):
+            continue
+        try:
+            tensors.append(tensor_from_image(Image.open(path).convert('RGB'), meta))
+        except Exception as e:
+            print(f"[WARN] Skipping calibration image {path}: {e}")
+        if len(tensors) >= CALIB_SAMPLES:
+            break
+    return torch.cat(tensors, dim=0) if tensors else None
+
+
+def current_rss_mb() -> Optional[float]:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, IndexError):
+        return None
 
-# Load available classifiers at startup
-if PV_EXPORT.exists():
-    cl = load_torchscript_classifier(PV_EXPORT)
-    if cl:
-        classifiers['plantvillage'] = cl
 
-if PADDY_EXPORT.exists():
-    cl = load_torchscript_classifier(PADDY_EXPORT)
-    if cl:
-        classifiers['paddy'] = cl
+def trim_heap() -> None:
+    # Hand freed pages back to the OS so one benchmark's RSS is not hidden by
+    # heap the previous one left behind (glibc only; a no-op elsewhere).
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class PeakRSS:
+    """Samples the process RSS in a background thread while the block runs (Linux /proc)."""
+
+    def __init__(self, interval_s: float = 0.002):
+        self.interval_s = interval_s
+        self.base: Optional[float] = None
+        self.peak: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'PeakRSS':
+        trim_heap()
+        self.base = self.peak = current_rss_mb()
+        if self.base is not None:
+            self._thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            rss = current_rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            rss = current_rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+
+def benchmark_precision(model: torch.jit.ScriptModule, precision: str, img_size: int) -> Dict[str, Any]:
+    x = torch.randn(BENCH_BATCH, 3, img_size, img_size)
+    with PeakRSS() as mem:
+        run_model(model, precision, x)  # warmup
+        start = time.perf_counter()
+        for _ in range(BENCH_ITERS):
+            run_model(model, precision, x)
+        elapsed = time.perf_counter() - start
+    return {
+        "throughput_ips": BENCH_BATCH * BENCH_ITERS / max(elapsed, 1e-9),
+        "latency_ms": 1000.0 * elapsed / BENCH_ITERS,
+        "param_mb": module_size_mb(model),
+        # Process RSS at its highest during warmup + timed runs, and how far it
+        # rose above the RSS just before them (activations, autocast weight
+        # copies, kernel workspaces). None where /proc is unavailable.
+        "peak_rss_mb": mem.peak,
+        "rss_increase_mb": None if mem.peak is None else mem.peak - mem.base,
+    }
+
+
+def format_bench(name: str, bench: Dict[str, Any]) -> str:
+    rss = "n/a" if bench["peak_rss_mb"] is None else f"+{bench['rss_increase_mb']:.1f} MB RSS (peak {bench['peak_rss_mb']:.0f} MB)"
+    return f"{name} {bench['throughput_ips']:.1f} img/s {bench['param_mb']:.1f} MB params {rss}"
+
+
+def select_precision(model_key: str, entry: ModelDict, model_path: Path) -> ModelDict:
+    """Switch entry to the requested precision if it agrees with fp32 on the calibration set."""
+    precision = requested_precision(model_key)
+    img_size = int(entry['preprocess']['img_size'])
+    report: Dict[str, Any] = {"requested": precision, "selected": "fp32", "threshold": MIN_TOP1_AGREEMENT}
+    precision_reports[model_key] = report
+    if precision == 'fp32':
+        if PRECISION_BENCH:
+            report["fp32"] = benchmark_precision(entry['model'], 'fp32', img_size)
+        return entry
+
+    calib = load_calibration_batch(model_key, entry['preprocess'])
+    if calib is None:
+        # Agreement on random inputs says little about real images; fail closed.
+        print(f"[WARN] No calibration images in {CALIB_DIR / model_key}; keeping {model_key} in fp32 instead of {precision}")
+        report["calibration"] = "missing"
+        if PRECISION_BENCH:
+            report["fp32"] = benchmark_precision(entry['model'], 'fp32', img_size)
+        return entry
+    report["calibration"] = "images"
+
+    try:
+        if precision in PRECISION_DTYPES:
+            candidate = torch.jit.load(str(model_path), map_location='cpu').to(PRECISION_DTYPES[precision]).eval()
+        else:
+            candidate = entry['model']
+        ref_logits = run_model(entry['model'], 'fp32', calib)
+        cand_logits = run_model(candidate, precision, calib)
+    except Exception as e:
+        print(f"[WARN] {precision} not usable for {model_key} ({e}); falling back to fp32")
+        report["error"] = str(e)
+        if PRECISION_BENCH:
+            report["fp32"] = benchmark_precision(entry['model'], 'fp32', img_size)
+        return entry
+
+    agreement = (ref_logits.argmax(dim=1) == cand_logits.argmax(dim=1)).float().mean().item()
+    report["top1_agreement"] = agreement
+    report["max_logit_diff"] = (ref_logits - cand_logits).abs().max().item()
+    report["fp32"] = benchmark_precision(entry['model'], 'fp32', img_size)
+    report[precision] = benchmark_precision(candidate, precision, img_size)
+    print(
+        f"[INFO] {model_key}: {format_bench('fp32', report['fp32'])} | "
+        f"{format_bench(precision, report[precision])} | top-1 agreement {agreement:.3f}"
+    )
+    if agreement < MIN_TOP1_AGREEMENT:
+        print(f"[WARN] {model_key}: {precision} top-1 agreement {agreement:.3f} < {MIN_TOP1_AGREEMENT}; falling back to fp32")
+        return entry
+
+    report["selected"] = precision
+    return {"model": candidate, "labels": entry['labels'], "precision": precision, "preprocess": entry['preprocess']}
 
 
 class ClassifyResponse(BaseModel):
@@ -93,8 +325,8 @@ def read_image_to_pil(data: bytes) -> Image.Image:
     return Image.open(io.BytesIO(data)).convert('RGB')
 
 
-def tensor_from_image(pil: Image.Image) -> torch.Tensor:
-    tensor = VAL_TF(pil)
+def tensor_from_image(pil: Image.Image, meta: Optional[Dict[str, Any]] = None) -> torch.Tensor:
+    tensor = pipeline_for(meta or DEFAULT_PREPROCESS)(pil)
     # Fix: Ensure we're calling unsqueeze on a tensor, not an image
     if isinstance(tensor, torch.Tensor):
         return tensor.unsqueeze(0)
@@ -108,65 +340,328 @@ def softmax_logits(logits: torch.Tensor) -> np.ndarray:
     return sm
 
 
+def top_predictions(probs: np.ndarray, labels: Dict[int, str], topk: int) -> List[Dict[str, Any]]:
+    topk = max(1, min(topk, len(probs)))
+    idxs = np.argsort(probs)[::-1][:topk]
+    return [{"label": labels.get(int(i), str(i)), "confidence": float(probs[i])} for i in idxs]
+
+
+# -------------------- STARTUP --------------------
+
+# Models are loaded, precision-checked and warmed concurrently in a background
+# thread so the server accepts connections immediately. /livez answers as soon
+# as the process is up; /readyz returns 503 until every model has finished and
+# keeps returning 503 if no classifier came up.
+CLASSIFIER_EXPORTS = {
+    'plantvillage': PV_EXPORT,
+    'paddy': PADDY_EXPORT,
+}
+startup_state: Dict[str, Any] = {"ready": False, "loaded": False, "models": {}, "phasesMs": {"import": IMPORT_MS}}
+models_loaded = threading.Event()
+
+
+def load_classifier_key(model_key: str, export_dir: Path) -> Optional[ModelDict]:
+    t0 = time.perf_counter()
+    cl = load_torchscript_classifier(export_dir)
+    if cl is None:
+        startup_state['models'][model_key] = {"status": "missing"}
+        return None
+    startup_state['models'][model_key] = {"status": "loaded", "loadMs": 1000.0 * (time.perf_counter() - t0)}
+    return cl
+
+
+def finish_classifier_key(model_key: str, cl: ModelDict, model_path: Path) -> None:
+    """Precision check and warmup for a loaded classifier, then expose it."""
+    t0 = time.perf_counter()
+    cl = select_precision(model_key, cl, model_path)
+    t1 = time.perf_counter()
+    run_model(cl['model'], cl['precision'], tensor_from_image(Image.new('RGB', (IMG_SIZE, IMG_SIZE)), cl['preprocess']))
+    t2 = time.perf_counter()
+    classifiers[model_key] = cl
+    startup_state['models'][model_key].update({
+        "status": "ready",
+        "precisionCheckMs": 1000.0 * (t1 - t0),
+        "warmupMs": 1000.0 * (t2 - t1),
+        "imgSize": cl['preprocess']['img_size'],
+    })
+
+
+def load_severity_model() -> None:
+    t0 = time.perf_counter()
+    model = torch.jit.load(str(SEV_EXPORT), map_location='cpu').eval()
+    meta = load_preprocess_meta(SEV_EXPORT.parent)
+    t1 = time.perf_counter()
+    with torch.no_grad():
+        model(tensor_from_image(Image.new('RGB', (IMG_SIZE, IMG_SIZE)), meta))
+    t2 = time.perf_counter()
+    app.state.severity_preprocess = meta
+    app.state.severity_model = model
+    startup_state['models']['severity'] = {"status": "ready", "loadMs": 1000.0 * (t1 - t0), "warmupMs": 1000.0 * (t2 - t1)}
+
+
+def load_models() -> None:
+    t0 = time.perf_counter()
+    pipeline_for(DEFAULT_PREPROCESS)
+    startup_state['phasesMs']['transforms'] = 1000.0 * (time.perf_counter() - t0)
+
+    t1 = time.perf_counter()
+    tasks = {key: (load_classifier_key, (key, export_dir)) for key, export_dir in CLASSIFIER_EXPORTS.items() if export_dir.exists()}
+    if SEV_EXPORT.exists():
+        tasks['severity'] = (load_severity_model, ())
+    for key in tasks:
+        startup_state['models'][key] = {"status": "loading"}
+    loaded: Dict[str, ModelDict] = {}
+    with ThreadPoolExecutor(max_workers=max(1, len(tasks))) as pool:
+        futures = {pool.submit(fn, *args): key for key, (fn, args) in tasks.items()}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"[WARN] Failed to load {key}: {e}")
+                startup_state['models'][key] = {"status": "failed", "error": str(e)}
+                continue
+            if result is not None and key in CLASSIFIER_EXPORTS:
+                loaded[key] = result
+    startup_state['phasesMs']['models'] = 1000.0 * (time.perf_counter() - t1)
+
+    # The precision check times forward passes, so it runs one model at a time
+    # once every load has finished rather than competing with them for the CPU.
+    t2 = time.perf_counter()
+    for key, cl in loaded.items():
+        try:
+            finish_classifier_key(key, cl, CLASSIFIER_EXPORTS[key] / 'model.ts.pt')
+        except Exception as e:
+            print(f"[WARN] Failed to prepare {key}: {e}")
+            startup_state['models'][key] = {"status": "failed", "error": str(e)}
+    startup_state['phasesMs']['precision'] = 1000.0 * (time.perf_counter() - t2)
+    startup_state['phasesMs']['total'] = 1000.0 * (time.perf_counter() - PROCESS_START)
+    # Loading is over either way (job workers may proceed), but the server only
+    # reports ready when at least one classifier can actually serve requests.
+    startup_state['loaded'] = True
+    startup_state['ready'] = bool(classifiers)
+    models_loaded.set()
+    phases = ' '.join(f"{k}={v:.0f}ms" for k, v in startup_state['phasesMs'].items())
+    if not classifiers:
+        startup_state['error'] = "No classifier is ready"
+        print(f"[WARN] No classifier is ready; /readyz stays 503 ({phases})")
+        return
+    print(f"[INFO] Ready: {list(classifiers.keys())} ({phases})")
+
+
+@app.on_event("startup")
+def start_model_loading() -> None:
+    threading.Thread(target=load_models, name="model-loader", daemon=True).start()
+
+
+def require_classifier(model_key: str) -> ModelDict:
+    if model_key not in classifiers:
+        if not startup_state['loaded']:
+            raise HTTPException(status_code=503, detail="Models are still loading")
+        raise HTTPException(status_code=400, detail=f"Unknown model_key. Available: {list(classifiers.keys())}")
+    return classifiers[model_key]
+
+
+@app.get("/livez")
+async def livez() -> Dict[str, Any]:
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+async def readyz() -> JSONResponse:
+    """200 once loading finished with at least one classifier ready, 503 otherwise; includes per-phase cold-start timings."""
+    return JSONResponse(status_code=200 if startup_state['ready'] else 503, content=startup_state)
+
+
 @app.get("/health")
 async def health() -> Dict[str, Any]:
     return {
         "status": "ok",
+        "ready": startup_state['ready'],
         "classifiers": list(classifiers.keys()),
         "severity": SEV_EXPORT.exists(),
         "gradcam": HAS_GRADCAM,
+        "precision": {k: v['precision'] for k, v in classifiers.items()},
     }
 
 
+@app.get("/precision")
+async def precision() -> Dict[str, Any]:
+    """Startup calibration results: agreement with fp32, throughput, parameter/buffer size and measured RSS per precision."""
+    return {"minTop1Agreement": MIN_TOP1_AGREEMENT, "models": precision_reports}
+
+
 @app.post("/classify", response_model=ClassifyResponse)
 async def classify(
     model_key: str = Form(..., description="plantvillage or paddy"),
     file: UploadFile = File(...),
     topk: int = Form(5)
 ):
-    if model_key not in classifiers:
-        raise HTTPException(status_code=400, detail=f"Unknown model_key. Available: {list(classifiers.keys())}")
+    model_dict = require_classifier(model_key)
     data = await file.read()
     pil = read_image_to_pil(data)
-    x = tensor_from_image(pil)
+    x = tensor_from_image(pil, model_dict['preprocess'])
 
     # Fix: Properly access the model from the dictionary
-    model_dict = classifiers[model_key]
     model_obj = model_dict['model']
     labels = model_dict['labels']
 
-    with torch.no_grad():
-        logits = model_obj(x)
+    logits = run_model(model_obj, model_dict['precision'], x)
     probs = softmax_logits(logits)
 
-    # top-k
-    topk = max(1, min(topk, len(probs)))
-    idxs = np.argsort(probs)[::-1][:topk]
-    preds = []
-    for i in idxs:
-        preds.append({
-            "label": labels.get(int(i), str(i)),
-            "confidence": float(probs[i])
-        })
+    return {"predictions": top_predictions(probs, labels, topk)}
+
+
+# -------------------- STREAMING --------------------
+
+# Live camera mode: clients push frames over a WebSocket and the server always
+# classifies the most recent one. Frames that arrive while a prediction is
+# running replace each other, so a slow connection never builds a backlog.
+STREAM_WINDOW = int(os.environ.get('AGRI_STREAM_WINDOW', '5'))
+STREAM_WINDOW_MAX = int(os.environ.get('AGRI_STREAM_WINDOW_MAX', '30'))
+STREAM_MAX_FPS = float(os.environ.get('AGRI_STREAM_MAX_FPS', '4'))
+STREAM_MAX_INCOMING_FPS = float(os.environ.get('AGRI_STREAM_MAX_INCOMING_FPS', '30'))
+STREAM_MAX_FRAME_BYTES = int(os.environ.get('AGRI_STREAM_MAX_FRAME_BYTES', str(4 * 1024 * 1024)))
+STREAM_MAX_CONCURRENT = int(os.environ.get('AGRI_STREAM_MAX_CONCURRENT', str(max(1, (os.cpu_count() or 2) // 2))))
+
+# Shared across connections so streams cannot monopolize the inference threads.
+stream_inference_slots = asyncio.Semaphore(STREAM_MAX_CONCURRENT)
+
+
+def decode_stream_frame(message: Dict[str, Any]) -> Optional[bytes]:
+    """Binary frames are raw image bytes; text frames may be base64 or a data URI."""
+    if message.get('bytes') is not None:
+        return message['bytes']
+    text = message.get('text')
+    if not text:
+        return None
+    if text.startswith('data:'):
+        text = text.split(',', 1)[-1]
+    return base64.b64decode(text)
+
+
+def stream_probs(model_dict: ModelDict, data: bytes) -> np.ndarray:
+    x = tensor_from_image(read_image_to_pil(data), model_dict['preprocess'])
+    return softmax_logits(run_model(model_dict['model'], model_dict['precision'], x))
+
+
+@app.websocket("/ws/classify")
+async def classify_stream(websocket: WebSocket, model_key: str, topk: int = 5, window: int = STREAM_WINDOW):
+    if window < 1:
+        await websocket.close(code=1008, reason="window must be at least 1")
+        return
+    try:
+        model_dict = require_classifier(model_key)
+    except HTTPException as e:
+        await websocket.close(code=1013 if e.status_code == 503 else 1008, reason=e.detail)
+        return
+    await websocket.accept()
+
+    labels = model_dict['labels']
+    history: deque = deque(maxlen=min(window, STREAM_WINDOW_MAX))
+    latest: Dict[str, Any] = {"data": None, "seq": 0}
+    stats = {"received": 0, "dropped": 0, "throttled": 0, "processed": 0}
+    new_frame = asyncio.Event()
+
+    async def send(payload: Dict[str, Any]) -> bool:
+        # False once the client is gone: a send racing the disconnect raises
+        # instead of delivering, and that is not a server error.
+        if websocket.client_state != WebSocketState.CONNECTED or websocket.application_state != WebSocketState.CONNECTED:
+            return False
+        try:
+            await websocket.send_json(payload)
+        except (WebSocketDisconnect, RuntimeError, OSError):
+            return False
+        return True
+
+    async def receive_frames() -> None:
+        # Token bucket: at most STREAM_MAX_INCOMING_FPS frames/s are accepted.
+        tokens = STREAM_MAX_INCOMING_FPS
+        last = time.monotonic()
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            now = time.monotonic()
+            tokens = min(STREAM_MAX_INCOMING_FPS, tokens + (now - last) * STREAM_MAX_INCOMING_FPS)
+            last = now
+            stats['received'] += 1
+            if tokens < 1.0:
+                stats['throttled'] += 1
+                continue
+            tokens -= 1.0
+            try:
+                data = decode_stream_frame(message)
+            except ValueError:
+                data = None
+            if not data or len(data) > STREAM_MAX_FRAME_BYTES:
+                if not await send({"error": f"Invalid or oversized frame (max {STREAM_MAX_FRAME_BYTES} bytes)"}):
+                    return
+                continue
+            if new_frame.is_set():
+                stats['dropped'] += 1
+            latest['data'] = data
+            latest['seq'] = stats['received']
+            new_frame.set()
+
+    async def process_frames() -> None:
+        min_interval = 1.0 / STREAM_MAX_FPS if STREAM_MAX_FPS > 0 else 0.0
+        last_run = 0.0
+        while True:
+            await new_frame.wait()
+            delay = min_interval - (time.monotonic() - last_run)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            new_frame.clear()
+            data, seq = latest['data'], latest['seq']
+            last_run = time.monotonic()
+            try:
+                async with stream_inference_slots:
+                    probs = await asyncio.to_thread(stream_probs, model_dict, data)
+            except Exception as e:
+                if not await send({"frame": seq, "error": f"Could not classify frame: {e}"}):
+                    return
+                continue
+            stats['processed'] += 1
+            history.append(probs)
+            smoothed = np.mean(np.stack(history), axis=0)
+            sent = await send({
+                "frame": seq,
+                "predictions": top_predictions(smoothed, labels, topk),
+                "raw": top_predictions(probs, labels, 1),
+                "window": len(history),
+                "latencyMs": 1000.0 * (time.monotonic() - last_run),
+                "stats": dict(stats),
+            })
+            if not sent:
+                return
 
-    return {"predictions": preds}
+    tasks = [asyncio.create_task(receive_frames()), asyncio.create_task(process_frames())]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 # Grad-CAM support using checkpoints (.pth). Rebuild model dynamically.
 # Uses the same approach as in training script.
 
 def build_classifier(backbone: str, num_classes: int) -> nn.Module:
+    # Weights come from the checkpoint, so skip fetching the ImageNet ones.
     from torchvision import models
     backbone = backbone.lower()
     if backbone == 'mobilenet_v2':
-        model = models.mobilenet_v2(weights=models.MobileNet_V2_Weights.DEFAULT)
+        model = models.mobilenet_v2(weights=None)
         in_features = model.classifier[1].in_features
         model.classifier[1] = nn.Linear(in_features, num_classes)
         return model
     elif backbone.startswith('efficientnet_b'):
         eff = getattr(models, backbone, models.efficientnet_b0)
-        weights_enum = getattr(models, f"{backbone}_weights", models.EfficientNet_B0_Weights)
-        model = eff(weights=weights_enum.DEFAULT)
+        model = eff(weights=None)
         in_features = model.classifier[1].in_features
         model.classifier[1] = nn.Linear(in_features, num_classes)
         return model
@@ -174,62 +669,71 @@ def build_classifier(backbone: str, num_classes: int) -> nn.Module:
         raise ValueError(f"Unsupported backbone: {backbone}")
 
 
-def gradcam_from_ckpt(ckpt_path: Path, pil: Image.Image, target_label: Optional[str]) -> str:
+# Rebuilt Grad-CAM models are kept per checkpoint (reloaded when the file
+# changes). The forward hook lives on the shared module, so calls on one model
+# are serialized; each call handles a whole batch of images and targets.
+gradcam_models: Dict[str, Dict[str, Any]] = {}
+gradcam_models_lock = threading.Lock()
+
+
+def load_gradcam_model(ckpt_path: Path) -> Dict[str, Any]:
+    mtime = ckpt_path.stat().st_mtime_ns
+    with gradcam_models_lock:
+        entry = gradcam_models.get(str(ckpt_path))
+        if entry is None or entry['mtime'] != mtime:
+            ckpt = torch.load(str(ckpt_path), map_location='cpu')
+            meta = load_preprocess_meta(ckpt_path.parent / 'export')
+            meta['img_size'] = ckpt.get('img_size', meta['img_size'])
+            model = build_classifier(ckpt['backbone'], num_classes=len(ckpt['class_to_idx']))
+            model.load_state_dict(ckpt['model_state'])
+            model.eval()
+            entry = {
+                "mtime": mtime, "model": model, "layer": gradcam_target_layer(model), "meta": meta,
+                "class_to_idx": ckpt['class_to_idx'], "lock": threading.Lock(),
+            }
+            gradcam_models[str(ckpt_path)] = entry
+    return entry
+
+
+def gradcam_images(ckpt_path: Path, pils: List[Image.Image], target_labels: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """Heatmaps for every image x target label (each image's top-1 when no labels are given)."""
     if not HAS_GRADCAM:
         raise HTTPException(status_code=500, detail="Grad-CAM not available on server (pytorch-grad-cam not installed)")
-    ckpt = torch.load(str(ckpt_path), map_location='cpu')
-    backbone = ckpt['backbone']
-    class_to_idx = ckpt['class_to_idx']
+    entry = load_gradcam_model(ckpt_path)
+    class_to_idx = entry['class_to_idx']
+    unknown = [t for t in target_labels or [] if t not in class_to_idx]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown target_label {unknown}. Available: {list(class_to_idx.keys())}")
+    wanted = [class_to_idx[t] for t in target_labels or []]
+    idx_to_class = {v: k for k, v in class_to_idx.items()}
+    x = torch.cat([tensor_from_image(pil, entry['meta']) for pil in pils], dim=0)
+    with entry['lock']:
+        logits, targets, cams = batched_gradcam(entry['model'], entry['layer'], x, [wanted] * len(pils))
+    probs = torch.softmax(logits, dim=1)
+    return [{
+        "predicted": idx_to_class[int(probs[n].argmax())],
+        "heatmaps": [
+            {"label": idx_to_class[t], "prob": float(probs[n, t]), "dataUri": gradcam_overlay_uri(pils[n], cam, int(entry['meta']['img_size']), float(entry['meta']['resize_ratio']))}
+            for t, cam in zip(targets[n], cams[n])
+        ],
+    } for n in range(len(pils))]
 
-    x = tensor_from_image(pil)
-    model = build_classifier(backbone, num_classes=len(class_to_idx))
-    model.load_state_dict(ckpt['model_state'])
-    model.eval()
 
-    # choose last conv layer
-    target_layer = None
-    if hasattr(model, 'features') and isinstance(model.features, nn.Sequential):
-        target_layer = list(model.features.modules())[-1]
-    else:
-        last_conv = None
-        for m in model.modules():
-            if isinstance(m, nn.Conv2d):
-                last_conv = m
-        target_layer = last_conv
-    if target_layer is None:
-        raise HTTPException(status_code=500, detail="Could not find conv layer for Grad-CAM")
-
-    # Fix: Remove use_cuda parameter which is no longer supported
-    if HAS_GRADCAM:
-        from pytorch_grad_cam import GradCAM
-        from pytorch_grad_cam.utils.image import show_cam_on_image
-        cam = GradCAM(model=model, target_layers=[target_layer])
-        grayscale = cam(input_tensor=x)[0]
-
-        disp = pil.resize((IMG_SIZE, IMG_SIZE))
-        disp_np = np.array(disp).astype(np.float32) / 255.0
-        cam_image = show_cam_on_image(disp_np, grayscale, use_rgb=True, image_weight=0.55)
-        out_img = Image.fromarray(cam_image)
-        buf = io.BytesIO()
-        out_img.save(buf, format='PNG')
-        data = base64.b64encode(buf.getvalue()).decode('utf-8')
-        return f"data:image/png;base64,{data}"
-    else:
-        # Return a default image or raise an exception if Grad-CAM is not available
-        raise HTTPException(status_code=500, detail="Grad-CAM not available on server (pytorch-grad-cam not installed)")
+def gradcam_from_ckpt(ckpt_path: Path, pil: Image.Image, target_label: Optional[str]) -> str:
+    result = gradcam_images(ckpt_path, [pil], [target_label] if target_label else None)
+    return result[0]['heatmaps'][0]['dataUri']
 
 
 class GradCAMResponse(BaseModel):
     dataUri: str
 
 
-@app.post("/gradcam", response_model=GradCAMResponse)
-async def gradcam(
-    model_key: str = Form(..., description="plantvillage or paddy"),
-    file: UploadFile = File(...),
-    target_label: Optional[str] = Form(None)
-):
-    # Pick checkpoint path
+class GradCAMBatchResponse(BaseModel):
+    results: List[Dict[str, Any]]
+    msPerHeatmap: float
+
+
+def gradcam_ckpt_path(model_key: str) -> Path:
     if model_key == 'plantvillage':
         ckpt = PV_CKPT
     elif model_key == 'paddy':
@@ -239,14 +743,45 @@ async def gradcam(
 
     if not ckpt.exists():
         raise HTTPException(status_code=404, detail=f"Checkpoint not found: {ckpt}")
+    return ckpt
 
-    data = await file.read()
-    pil = read_image_to_pil(data)
 
-    uri = gradcam_from_ckpt(ckpt, pil, target_label)
+def gradcam_batch_result(ckpt_path: Path, named_images: List[Tuple[str, bytes]], target_labels: Optional[List[str]]) -> Dict[str, Any]:
+    start = time.perf_counter()
+    results = gradcam_images(ckpt_path, [read_image_to_pil(data) for _, data in named_images], target_labels)
+    n_maps = sum(len(r['heatmaps']) for r in results)
+    for (name, _), res in zip(named_images, results):
+        res['filename'] = name
+    return {"results": results, "msPerHeatmap": 1000.0 * (time.perf_counter() - start) / max(1, n_maps)}
+
+
+@app.post("/gradcam", response_model=GradCAMResponse)
+async def gradcam(
+    model_key: str = Form(..., description="plantvillage or paddy"),
+    file: UploadFile = File(...),
+    target_label: Optional[str] = Form(None)
+):
+    ckpt = gradcam_ckpt_path(model_key)
+
+    data = await file.read()
+    # Decoding and the forward/backward pass block; keep them off the event loop.
+    pil = await asyncio.to_thread(read_image_to_pil, data)
+    uri = await asyncio.to_thread(gradcam_from_ckpt, ckpt, pil, target_label)
     return {"dataUri": uri}
 
 
+@app.post("/gradcam/batch", response_model=GradCAMBatchResponse)
+async def gradcam_batch(
+    model_key: str = Form(..., description="plantvillage or paddy"),
+    files: List[UploadFile] = File(...),
+    target_label: Optional[List[str]] = Form(None, description="Repeat for several labels; every image gets one heatmap per label (default: its top-1)"),
+):
+    ckpt = gradcam_ckpt_path(model_key)
+    named_images = [(f.filename, await f.read()) for f in files]
+    # Grad-CAM is CPU/GPU bound for the whole batch; keep it off the event loop.
+    return await asyncio.to_thread(gradcam_batch_result, ckpt, named_images, target_label)
+
+
 # Severity inference (if exported model exists)
 class SeverityResponse(BaseModel):
     severityPercentage: float
@@ -270,12 +805,13 @@ async def severity(file: UploadFile = File(...)):
     # Lazy-load model
     model = getattr(app.state, 'severity_model', None)
     if model is None:
+        app.state.severity_preprocess = load_preprocess_meta(SEV_EXPORT.parent)
         app.state.severity_model = torch.jit.load(str(SEV_EXPORT), map_location='cpu').eval()
         model = app.state.severity_model
 
     data = await file.read()
     pil = read_image_to_pil(data)
-    x = tensor_from_image(pil)
+    x = tensor_from_image(pil, app.state.severity_preprocess)
 
     with torch.no_grad():
         y = model(x).cpu().numpy()[0][0]
@@ -289,3 +825,283 @@ async def severity(file: UploadFile = File(...)):
         "severityBand": band,
         "confidence": conf,
     }
+
+
+# -------------------- JOBS --------------------
+
+# Asynchronous job API for expensive work (Grad-CAM, large batch uploads).
+# Jobs are persisted in SQLite with their inputs on disk under JOBS_DIR, so
+# queued and interrupted jobs are picked up again after a restart. Higher
+# priority runs first; finished jobs are purged after JOB_TTL seconds.
+JOBS_DIR = Path(os.environ.get('AGRI_JOBS_DIR', str(RUNS / 'jobs')))
+JOB_WORKERS = int(os.environ.get('AGRI_JOB_WORKERS', '2'))
+JOB_TTL = float(os.environ.get('AGRI_JOB_TTL', str(24 * 3600)))
+JOB_PURGE_INTERVAL = 60.0
+JOB_MAX_WAIT = 60.0
+JOB_TERMINAL = ('done', 'failed')
+
+
+class JobStore:
+    def __init__(self, db_path: Path):
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock, self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    priority INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+
+    def create(self, job_id: str, kind: str, params: Dict[str, Any], priority: int) -> None:
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO jobs (id, kind, params, priority, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, kind, json.dumps(params), priority, time.time()),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def mark_running(self, job_id: str) -> None:
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (time.time(), job_id))
+
+    def finish(self, job_id: str, result: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+        status = 'failed' if error else 'done'
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), json.dumps(result) if result is not None else None, error, job_id),
+            )
+
+    def requeue_unfinished(self) -> List[Tuple[int, float, str]]:
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            rows = self.conn.execute("SELECT id, priority, created_at FROM jobs WHERE status = 'queued'").fetchall()
+        return [(-r['priority'], r['created_at'], r['id']) for r in rows]
+
+    def expire(self, ttl: float) -> List[str]:
+        cutoff = time.time() - ttl
+        with self.lock, self.conn:
+            rows = self.conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,)
+            ).fetchall()
+            self.conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?", (cutoff,))
+        return [r['id'] for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            rows = self.conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r['status']: r['n'] for r in rows}
+
+    def timings(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT kind, created_at, started_at, finished_at FROM jobs WHERE status IN ('done', 'failed')"
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+
+job_store: Optional[JobStore] = None
+job_queue: "queue.PriorityQueue[Tuple[int, float, str]]" = queue.PriorityQueue()
+
+
+def job_input_dir(job_id: str) -> Path:
+    return JOBS_DIR / job_id
+
+
+def run_gradcam_job(job_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    pil = Image.open(job_input_dir(job_id) / params['files'][0]).convert('RGB')
+    uri = gradcam_from_ckpt(gradcam_ckpt_path(params['model_key']), pil, params.get('target_label'))
+    return {"dataUri": uri}
+
+
+def run_gradcam_batch_job(job_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    named_images = [(original, (job_input_dir(job_id) / name).read_bytes()) for name, original in zip(params['files'], params['filenames'])]
+    return gradcam_batch_result(gradcam_ckpt_path(params['model_key']), named_images, params.get('target_labels'))
+
+
+def run_classify_job(job_id: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    model_dict = require_classifier(params['model_key'])
+    results = []
+    for name, original in zip(params['files'], params['filenames']):
+        try:
+            probs = stream_probs(model_dict, (job_input_dir(job_id) / name).read_bytes())
+            results.append({"filename": original, "predictions": top_predictions(probs, model_dict['labels'], params['topk'])})
+        except Exception as e:
+            results.append({"filename": original, "error": str(e)})
+    return {"results": results}
+
+
+JOB_RUNNERS = {
+    'gradcam': run_gradcam_job,
+    'gradcam_batch': run_gradcam_batch_job,
+    'classify': run_classify_job,
+}
+
+
+def job_worker() -> None:
+    # Jobs re-queued after a restart must not run against half-loaded models.
+    models_loaded.wait()
+    while True:
+        _, _, job_id = job_queue.get()
+        job = job_store.get(job_id)
+        if job is None or job['status'] != 'queued':
+            continue
+        job_store.mark_running(job_id)
+        result, error = None, None
+        try:
+            result = JOB_RUNNERS[job['kind']](job_id, json.loads(job['params']))
+        except HTTPException as e:
+            error = str(e.detail)
+        except Exception as e:
+            error = str(e)
+        job_store.finish(job_id, result, error)
+        shutil.rmtree(job_input_dir(job_id), ignore_errors=True)
+
+
+def job_janitor() -> None:
+    while True:
+        time.sleep(JOB_PURGE_INTERVAL)
+        for job_id in job_store.expire(JOB_TTL):
+            shutil.rmtree(job_input_dir(job_id), ignore_errors=True)
+
+
+@app.on_event("startup")
+def start_job_workers() -> None:
+    global job_store
+    job_store = JobStore(JOBS_DIR / 'jobs.sqlite3')
+    for item in job_store.requeue_unfinished():
+        job_queue.put(item)
+    for i in range(JOB_WORKERS):
+        threading.Thread(target=job_worker, name=f"job-worker-{i}", daemon=True).start()
+    threading.Thread(target=job_janitor, name="job-janitor", daemon=True).start()
+
+
+class JobSubmitResponse(BaseModel):
+    jobId: str
+    status: str
+
+
+def submit_job(kind: str, params: Dict[str, Any], files: List[UploadFile], priority: int) -> Dict[str, str]:
+    job_id = uuid.uuid4().hex
+    input_dir = job_input_dir(job_id)
+    input_dir.mkdir(parents=True, exist_ok=True)
+    params['files'] = []
+    params['filenames'] = []
+    for i, upload in enumerate(files):
+        name = f"{i:05d}{Path(upload.filename or '').suffix.lower()}"
+        with open(input_dir / name, 'wb') as f:
+            shutil.copyfileobj(upload.file, f)
+        params['files'].append(name)
+        params['filenames'].append(upload.filename)
+    job_store.create(job_id, kind, params, priority)
+    job_queue.put((-priority, time.time(), job_id))
+    return {"jobId": job_id, "status": "queued"}
+
+
+def job_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    view = {
+        "jobId": job['id'],
+        "kind": job['kind'],
+        "status": job['status'],
+        "priority": job['priority'],
+        "createdAt": job['created_at'],
+        "startedAt": job['started_at'],
+        "finishedAt": job['finished_at'],
+    }
+    if job['result'] is not None:
+        view["result"] = json.loads(job['result'])
+    if job['error']:
+        view["error"] = job['error']
+    return view
+
+
+@app.post("/jobs/gradcam", response_model=JobSubmitResponse)
+def submit_gradcam_job(
+    model_key: str = Form(..., description="plantvillage or paddy"),
+    file: UploadFile = File(...),
+    target_label: Optional[str] = Form(None),
+    priority: int = Form(0),
+):
+    gradcam_ckpt_path(model_key)
+    return submit_job('gradcam', {"model_key": model_key, "target_label": target_label}, [file], priority)
+
+
+@app.post("/jobs/gradcam_batch", response_model=JobSubmitResponse)
+def submit_gradcam_batch_job(
+    model_key: str = Form(..., description="plantvillage or paddy"),
+    files: List[UploadFile] = File(...),
+    target_label: Optional[List[str]] = Form(None),
+    priority: int = Form(0),
+):
+    gradcam_ckpt_path(model_key)
+    return submit_job('gradcam_batch', {"model_key": model_key, "target_labels": target_label}, files, priority)
+
+
+@app.post("/jobs/classify", response_model=JobSubmitResponse)
+def submit_classify_job(
+    model_key: str = Form(..., description="plantvillage or paddy"),
+    files: List[UploadFile] = File(...),
+    topk: int = Form(5),
+    priority: int = Form(0),
+):
+    # Only the key is checked here: jobs may be queued while models are still
+    # loading, and job_worker waits for models_loaded before running them.
+    if model_key not in CLASSIFIER_EXPORTS:
+        raise HTTPException(status_code=400, detail=f"Unknown model_key. Available: {list(CLASSIFIER_EXPORTS)}")
+    return submit_job('classify', {"model_key": model_key, "topk": topk}, files, priority)
+
+
+@app.get("/jobs/metrics")
+def job_metrics() -> Dict[str, Any]:
+    """Queue depth, job counts and queue-wait / run-time percentiles per job kind."""
+    per_kind: Dict[str, Dict[str, List[float]]] = {}
+    for row in job_store.timings():
+        if row['started_at'] is None or row['finished_at'] is None:
+            continue
+        bucket = per_kind.setdefault(row['kind'], {"wait": [], "run": []})
+        bucket["wait"].append(1000.0 * (row['started_at'] - row['created_at']))
+        bucket["run"].append(1000.0 * (row['finished_at'] - row['started_at']))
+
+    def summary(values: List[float]) -> Dict[str, float]:
+        arr = np.asarray(values)
+        return {"mean": float(arr.mean()), "p50": float(np.percentile(arr, 50)), "p95": float(np.percentile(arr, 95)), "max": float(arr.max())}
+
+    return {
+        "workers": JOB_WORKERS,
+        "queueDepth": job_queue.qsize(),
+        "counts": job_store.counts(),
+        "kinds": {
+            kind: {"completed": len(b["run"]), "queueWaitMs": summary(b["wait"]), "runMs": summary(b["run"])}
+            for kind, b in per_kind.items()
+        },
+    }
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0.0) -> Dict[str, Any]:
+    """Poll a job; with wait > 0 this long-polls until the job finishes or the wait expires."""
+    deadline = time.monotonic() + min(max(wait, 0.0), JOB_MAX_WAIT)
+    while True:
+        # SQLite lookups block behind the store lock; keep them off the event loop.
+        job = await asyncio.to_thread(job_store.get, job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+        if job['status'] in JOB_TERMINAL or time.monotonic() >= deadline:
+            return job_view(job)
+        await asyncio.sleep(0.2)
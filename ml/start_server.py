@@ -5,16 +5,48 @@ Script to start the AgriAssist inference server
 
 import os
 import sys
+import json
 import subprocess
 import time
+import urllib.request
+import urllib.error
 from pathlib import Path
 
+READY_TIMEOUT = float(os.environ.get('AGRI_READY_TIMEOUT', '300'))
+
 def check_port(port):
     """Check if a port is in use"""
     import socket
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
         return s.connect_ex(('localhost', port)) == 0
 
+def wait_until_ready(process, port, timeout):
+    """Poll /readyz until the server reports ready, the process exits or the timeout expires"""
+    url = f"http://localhost:{port}/readyz"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return None
+        try:
+            with urllib.request.urlopen(url, timeout=2) as resp:
+                return json.loads(resp.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code != 503:
+                return None
+            # Loading finished but no classifier came up: stop waiting
+            try:
+                state = json.loads(e.read().decode('utf-8'))
+            except ValueError:
+                state = {}
+            if state.get('loaded'):
+                for key, info in state.get("models", {}).items():
+                    print(f"   model {key}: {info.get('status')} {info.get('error', '')}")
+                return None
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+    return None
+
 def main():
     # Get the project root directory
     project_root = Path(__file__).resolve().parent.parent
@@ -66,13 +98,19 @@ def main():
         # Start the process
         process = subprocess.Popen(cmd)
         
-        # Wait a bit and check if it started
-        time.sleep(3)
+        # Wait until all models are loaded and warmed
+        started = time.monotonic()
+        state = wait_until_ready(process, 8000, READY_TIMEOUT)
         
-        if check_port(8000):
-            print("✅ Inference server started successfully on port 8000")
+        if state is not None:
+            print(f"✅ Inference server ready on port 8000 after {time.monotonic() - started:.1f}s")
+            for phase, ms in state.get("phasesMs", {}).items():
+                print(f"   {phase}: {ms:.0f} ms")
+            for key, info in state.get("models", {}).items():
+                print(f"   model {key}: {info.get('status')}")
             print("   Access the API at: http://localhost:8000")
             print("   Health check: http://localhost:8000/health")
+            print("   Readiness: http://localhost:8000/readyz")
             print("   Press Ctrl+C to stop the server")
             
             # Keep the process running
@@ -84,7 +122,7 @@ def main():
                 process.wait()
                 print("✅ Inference server stopped")
         else:
-            print("❌ Failed to start inference server")
+            print("❌ Inference server did not become ready")
             process.terminate()
             
     except Exception as e:
@@ -1,22 +1,41 @@
 import os
+import copy
+import csv
 import json
+import hashlib
+import functools
+import math
+import sys
+import time
 import base64
 import random
 import argparse
+import tempfile
+import platform
+import itertools
 from io import BytesIO
-from typing import Tuple, Dict, Any, List
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Tuple, Dict, Any, List, Optional
 
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, random_split, Dataset
+import torch.nn.functional as F
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Dataset, Subset, Sampler
+from torch.utils.data.distributed import DistributedSampler
+from torch.utils.data.dataloader import default_collate
 from torchvision import transforms, datasets, models
 from PIL import Image
 
+from gradcam_engine import batched_gradcam, gradcam_overlay_uri, gradcam_target_layer
+
 try:
     from pytorch_grad_cam import GradCAM
-    from pytorch_grad_cam.utils.image import show_cam_on_image
 except Exception:
     GradCAM = None
 
@@ -24,41 +43,363 @@ SEED = 42
 random.seed(SEED)
 torch.manual_seed(SEED)
 
+# Validation-time preprocessing; written next to every export as preprocess.json
+# so infer_server.py can rebuild the exact pipeline per model.
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+RESIZE_RATIO = 1.15
+
+# Training augmentation distribution, shared by the PIL and batched pipelines.
+AUG_SCALE = (0.8, 1.0)
+AUG_RATIO = (3.0 / 4.0, 4.0 / 3.0)
+AUG_DEGREES = 15.0
+AUG_BRIGHTNESS = 0.2
+AUG_CONTRAST = 0.2
+AUG_SATURATION = 0.2
+AUG_HUE = 0.02
+
 
 # -------------------- UTIL --------------------
 
 def get_device() -> torch.device:
     if torch.cuda.is_available():
+        local_rank = int(os.environ.get('LOCAL_RANK', '0')) if dist_is_initialized() else 0
         try:
-            name = torch.cuda.get_device_name(0)
+            name = torch.cuda.get_device_name(local_rank)
         except Exception:
             name = 'CUDA'
-        print(f"[INFO] Using GPU: {name}")
-        return torch.device('cuda')
-    print("[INFO] Using CPU (CUDA not available)")
+        log(f"[INFO] Using GPU: {name}")
+        return torch.device('cuda', local_rank)
+    log("[INFO] Using CPU (CUDA not available)")
     return torch.device('cpu')
 
 
+# -------------------- DISTRIBUTED --------------------
+# Data-parallel training across processes and hosts. Launch any training task
+# with torchrun, e.g. on one machine:
+#   torchrun --standalone --nproc_per_node 4 ml/train_pipeline.py classifier ...
+# torchrun sets RANK / WORLD_SIZE / LOCAL_RANK / MASTER_ADDR; without them the
+# pipeline runs single-process exactly as before. Each rank trains on its shard
+# of the training split, DistributedDataParallel all-reduces gradients, metrics
+# are summed across ranks and only rank 0 prints, checkpoints and exports.
+
+def dist_is_initialized() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if dist_is_initialized() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if dist_is_initialized() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def log(msg: str):
+    if is_main_process():
+        print(msg)
+
+
+def seed_rank(seed: int = SEED):
+    """Seed python, numpy and torch offset by rank, so ranks (and their loader
+    workers) draw different augmentation streams. DDP broadcasts rank 0's weights."""
+    seed += get_rank()
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def init_distributed(backend: str = 'gloo', threads_per_proc: int = 0) -> bool:
+    if int(os.environ.get('WORLD_SIZE', '1')) <= 1:
+        return False
+    if not dist_is_initialized():
+        dist.init_process_group(backend=backend)
+    seed_rank()
+    # torchrun defaults OMP_NUM_THREADS to 1; split the host's cores between
+    # the local ranks instead so CPU training is not left single-threaded.
+    local_world = int(os.environ.get('LOCAL_WORLD_SIZE', os.environ['WORLD_SIZE']))
+    torch.set_num_threads(threads_per_proc or max(1, (os.cpu_count() or 1) // local_world))
+    log(f"[DIST] backend={backend} world_size={get_world_size()} threads/proc={torch.get_num_threads()}")
+    return True
+
+
+def cleanup_distributed():
+    if dist_is_initialized():
+        dist.barrier()
+        dist.destroy_process_group()
+
+
+def barrier():
+    if dist_is_initialized():
+        dist.barrier()
+
+
+def reduce_sums(*values: float) -> List[float]:
+    """Sum scalar metrics across ranks (no-op when single-process)."""
+    if not dist_is_initialized():
+        return list(values)
+    t = torch.tensor(values, dtype=torch.float64)
+    if dist.get_backend() == 'nccl':
+        t = t.cuda()
+    dist.all_reduce(t)
+    return t.tolist()
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def wrap_ddp(model: nn.Module) -> nn.Module:
+    """Wrap for gradient all-reduce. Call again after changing requires_grad,
+    since DDP only synchronizes parameters that were trainable when wrapped."""
+    if not dist_is_initialized():
+        return model
+    module = unwrap_model(model)
+    device_ids = [module_device(module).index] if module_device(module).type == 'cuda' else None
+    return DistributedDataParallel(module, device_ids=device_ids)
+
+
+def module_device(model: nn.Module) -> torch.device:
+    return next(model.parameters()).device
+
+
+class ShardSampler(Sampler):
+    """Strided, unpadded shard of a dataset for evaluation: every sample is
+    seen exactly once across ranks, so summed metrics are exact."""
+
+    def __init__(self, dataset: Dataset):
+        self.indices = list(range(get_rank(), len(dataset), get_world_size()))
+
+    def __iter__(self):
+        return iter(self.indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+
+# Set from --prefetch_factor / the tuned config (see LOADER TUNING)
+LOADER_SETTINGS: Dict[str, Any] = {'prefetch_factor': 2}
+
+
+def make_loader(dataset: Dataset, batch_size: int, shuffle: bool, num_workers: int, collate_fn=None) -> DataLoader:
+    """DataLoader that shards across ranks when running distributed."""
+    sampler = None
+    if dist_is_initialized():
+        sampler = DistributedSampler(dataset, shuffle=True, seed=SEED) if shuffle else ShardSampler(dataset)
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle and sampler is None,
+        sampler=sampler,
+        num_workers=num_workers,
+        pin_memory=torch.cuda.is_available(),  # pinned pages only help host->GPU copies
+        prefetch_factor=LOADER_SETTINGS['prefetch_factor'] if num_workers > 0 else None,
+        collate_fn=collate_fn,
+    )
+
+
 # -------------------- TRANSFORMS --------------------
 
-def get_classification_transforms(img_size: int) -> Tuple[transforms.Compose, transforms.Compose]:
-    train_tf = transforms.Compose([
-        transforms.RandomResizedCrop(img_size, scale=(0.8, 1.0)),
-        transforms.RandomHorizontalFlip(),
-        transforms.RandomRotation(15),
-        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.02),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-    ])
+def get_classification_transforms(img_size: int, batch_aug: bool = False) -> Tuple[Any, transforms.Compose]:
+    """Train/val transforms. With batch_aug the train transform only resizes to a
+    fixed uint8 square; BatchAugmentCollate does the random augmentation per batch."""
+    if batch_aug:
+        train_tf = PresizeToUint8(int(img_size * RESIZE_RATIO))
+    else:
+        train_tf = transforms.Compose([
+            transforms.RandomResizedCrop(img_size, scale=AUG_SCALE, ratio=AUG_RATIO),
+            transforms.RandomHorizontalFlip(),
+            transforms.RandomRotation(AUG_DEGREES),
+            transforms.ColorJitter(brightness=AUG_BRIGHTNESS, contrast=AUG_CONTRAST, saturation=AUG_SATURATION, hue=AUG_HUE),
+            transforms.ToTensor(),
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
+        ])
     val_tf = transforms.Compose([
-        transforms.Resize(int(img_size * 1.15)),
+        transforms.Resize(int(img_size * RESIZE_RATIO)),
         transforms.CenterCrop(img_size),
         transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
     ])
     return train_tf, val_tf
 
 
+# -------------------- BATCH AUGMENTATION --------------------
+# The PIL pipeline above runs RandomResizedCrop/Rotation/ColorJitter one sample
+# at a time in the DataLoader workers. The batched pipeline splits this in two:
+# workers only decode and resize to a fixed uint8 square (PresizeToUint8), and
+# the training loop runs BatchAugment on each collated batch on the training
+# device (all intra-op threads on CPU). It draws per-sample crop/flip/rotation
+# parameters, applies them with a single affine grid_sample and jitters colour
+# on the whole batch. Crop boxes are sampled in original-image pixels so
+# non-square images keep the same crop distribution as RandomResizedCrop.
+
+class PresizeToUint8:
+    def __init__(self, size: int):
+        self.size = size
+
+    def __call__(self, img: Image.Image) -> Tuple[torch.Tensor, torch.Tensor]:
+        w, h = img.size
+        img = img.resize((self.size, self.size), Image.BILINEAR)
+        x = torch.from_numpy(np.asarray(img, dtype=np.uint8).copy()).permute(2, 0, 1)
+        return x, torch.tensor([h, w], dtype=torch.float32)
+
+
+def _grayscale(x: torch.Tensor) -> torch.Tensor:
+    return (0.2989 * x[:, 0] + 0.587 * x[:, 1] + 0.114 * x[:, 2]).unsqueeze(1)
+
+
+def _blend(a: torch.Tensor, b: torch.Tensor, ratio: torch.Tensor) -> torch.Tensor:
+    return (ratio * a + (1.0 - ratio) * b).clamp(0.0, 1.0)
+
+
+def _adjust_hue(x: torch.Tensor, shift: torch.Tensor) -> torch.Tensor:
+    # RGB -> HSV, rotate hue, HSV -> RGB without per-sector masks; equivalent
+    # to TF.adjust_hue with a different factor per sample.
+    maxc, _ = x.max(dim=1, keepdim=True)
+    minc, _ = x.min(dim=1, keepdim=True)
+    delta = maxc - minc
+    safe = torch.where(delta == 0, torch.ones_like(delta), delta)
+    r, g, b = x[:, 0:1], x[:, 1:2], x[:, 2:3]
+    h = torch.where(maxc == r, (g - b) / safe, torch.where(maxc == g, 2.0 + (b - r) / safe, 4.0 + (r - g) / safe))
+    h = (h + shift.view(-1, 1, 1, 1) * 6.0) % 6.0
+    # f(n) = V - V*S*clamp(min(k, 4 - k), 0, 1) with k = (n + H) mod 6, V*S = delta
+    k = (torch.tensor([5.0, 3.0, 1.0], device=x.device).view(1, 3, 1, 1) + h) % 6.0
+    return maxc - delta * torch.minimum(k, 4.0 - k).clamp_(0.0, 1.0)
+
+
+class BatchAugment:
+    """Vectorized RandomResizedCrop + HorizontalFlip + Rotation + ColorJitter + Normalize."""
+
+    def __init__(self, img_size: int):
+        self.img_size = img_size
+        self.mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1)
+        self.std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1)
+
+    def rand(self, *shape: int, low: float = 0.0, high: float = 1.0, device=None) -> torch.Tensor:
+        return torch.empty(*shape, device=device).uniform_(low, high)
+
+    def crop_boxes(self, sizes: torch.Tensor) -> Tuple[torch.Tensor, ...]:
+        # Same rejection sampling as RandomResizedCrop.get_params: 10 tries, then
+        # fall back to the largest centred box with an in-range aspect ratio.
+        n, dev = sizes.shape[0], sizes.device
+        h, w = sizes[:, 0:1], sizes[:, 1:2]
+        target_area = h * w * self.rand(n, 10, low=AUG_SCALE[0], high=AUG_SCALE[1], device=dev)
+        aspect = torch.exp(self.rand(n, 10, low=math.log(AUG_RATIO[0]), high=math.log(AUG_RATIO[1]), device=dev))
+        cw = torch.sqrt(target_area * aspect).round()
+        ch = torch.sqrt(target_area / aspect).round()
+        ok = (cw > 0) & (ch > 0) & (cw <= w) & (ch <= h)
+        first = ok.to(torch.uint8).argmax(dim=1, keepdim=True)
+        found = ok.any(dim=1)
+        h, w = h.squeeze(1), w.squeeze(1)
+        cw = torch.where(found, cw.gather(1, first).squeeze(1), torch.minimum(w, (h * AUG_RATIO[1]).round()))
+        ch = torch.where(found, ch.gather(1, first).squeeze(1), torch.minimum(h, (w / AUG_RATIO[0]).round()))
+        cx = cw / 2 + self.rand(n, device=dev) * (w - cw)
+        cy = ch / 2 + self.rand(n, device=dev) * (h - ch)
+        return cx, cy, cw, ch
+
+    def geometry(self, images: torch.Tensor, sizes: torch.Tensor) -> torch.Tensor:
+        n, dev = images.shape[0], images.device
+        h, w = sizes[:, 0], sizes[:, 1]
+        cx, cy, cw, ch = self.crop_boxes(sizes)
+        angle = self.rand(n, low=-AUG_DEGREES, high=AUG_DEGREES, device=dev) * math.pi / 180.0
+        flip = torch.where(self.rand(n, device=dev) < 0.5, -1.0, 1.0)
+        cos, sin = angle.cos(), angle.sin()
+        # output pixel -> un-rotated -> un-flipped crop coords (the square output
+        # makes rotation isotropic in normalized coordinates) -> source image.
+        pre = torch.stack([torch.stack([flip * cos, -flip * sin], dim=-1), torch.stack([sin, cos], dim=-1)], dim=-2)
+        scale = torch.stack([cw / w, ch / h], dim=-1).unsqueeze(-1)
+        offset = torch.stack([2.0 * cx / w - 1.0, 2.0 * cy / h - 1.0], dim=-1).unsqueeze(-1)
+        theta = torch.cat([scale * pre, offset], dim=-1)
+        out_size = (n, 3, self.img_size, self.img_size)
+        grid = F.affine_grid(theta, out_size, align_corners=False)
+        out = F.grid_sample(images.float().div_(255.0), grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+        # RandomRotation fills the corners it rotates in with black
+        crop_grid = F.affine_grid(torch.cat([pre, torch.zeros(n, 2, 1, device=dev)], dim=-1), out_size, align_corners=False)
+        inside = (crop_grid.abs() <= 1.0).all(dim=-1).unsqueeze(1)
+        return out * inside
+
+    def color_jitter(self, x: torch.Tensor) -> torch.Tensor:
+        n, dev = x.shape[0], x.device
+
+        def factor(amount: float) -> torch.Tensor:
+            return self.rand(n, 1, 1, 1, low=1.0 - amount, high=1.0 + amount, device=dev)
+
+        brightness, contrast, saturation = factor(AUG_BRIGHTNESS), factor(AUG_CONTRAST), factor(AUG_SATURATION)
+        hue = self.rand(n, low=-AUG_HUE, high=AUG_HUE, device=dev)
+        # ColorJitter applies its four ops in a random order per image: at each
+        # step, every op runs once on the rows that drew it for that step.
+        order = torch.rand(n, 4, device=dev).argsort(dim=1)
+        x = x.clone()
+        for step in range(4):
+            for op in range(4):
+                rows = (order[:, step] == op).nonzero(as_tuple=True)[0]
+                if rows.numel() == 0:
+                    continue
+                xs = x[rows]
+                if op == 0:
+                    xs = (xs * brightness[rows]).clamp(0.0, 1.0)
+                elif op == 1:
+                    xs = _blend(xs, _grayscale(xs).mean(dim=(1, 2, 3), keepdim=True), contrast[rows])
+                elif op == 2:
+                    xs = _blend(xs, _grayscale(xs), saturation[rows])
+                else:
+                    xs = _adjust_hue(xs, hue[rows])
+                x[rows] = xs
+        return x
+
+    def __call__(self, images: torch.Tensor, sizes: torch.Tensor) -> torch.Tensor:
+        x = self.color_jitter(self.geometry(images, sizes))
+        return (x - self.mean.to(x.device)) / self.std.to(x.device)
+
+
+def collate_presized(batch: List[Tuple[Tuple[torch.Tensor, torch.Tensor], Any]]):
+    """collate_fn for samples from PresizeToUint8: ((uint8 images, sizes), targets)."""
+    images = torch.stack([x for (x, _), _ in batch])
+    sizes = torch.stack([hw for (_, hw), _ in batch])
+    return (images, sizes), default_collate([y for _, y in batch])
+
+
+def apply_batch_transform(images, device, batch_transform: Optional[BatchAugment]) -> torch.Tensor:
+    if batch_transform is None:
+        return images.to(device, non_blocking=True)
+    images, sizes = images
+    return batch_transform(images.to(device, non_blocking=True), sizes.to(device))
+
+
+def benchmark_augmentation(data_dir: str, img_size: int = 256, batch_size: int = 32, num_workers: int = 4, batches: int = 20):
+    """Samples/s of the per-sample PIL pipeline vs the batched pipeline on an ImageFolder."""
+    device = get_device()
+    results = {}
+    for name, batch_aug in (('pil', False), ('batched', True)):
+        train_tf, _ = get_classification_transforms(img_size, batch_aug=batch_aug)
+        ds = datasets.ImageFolder(root=data_dir, transform=train_tf)
+        loader = DataLoader(
+            ds, batch_size=batch_size, shuffle=True, num_workers=num_workers,
+            collate_fn=collate_presized if batch_aug else None,
+            generator=torch.Generator().manual_seed(SEED),
+        )
+        batch_transform = BatchAugment(img_size) if batch_aug else None
+        n = 0
+        start = None
+        for i, (images, _) in enumerate(loader):
+            if i == 0:
+                start = time.perf_counter()  # exclude worker startup
+                continue
+            images = apply_batch_transform(images, device, batch_transform)
+            n += images.size(0)
+            if i >= batches:
+                break
+        elapsed = time.perf_counter() - start if start is not None else 0.0
+        results[name] = n / max(elapsed, 1e-9)
+        print(f"[BENCH] {name}: {results[name]:.1f} samples/s ({n} samples, {num_workers} workers)")
+    print(f"[BENCH] batched/pil speedup: {results['batched'] / max(results['pil'], 1e-9):.2f}x")
+    return results
+
+
 # -------------------- MODELS --------------------
 
 def build_classifier(backbone: str, num_classes: int, pretrained: bool = True) -> nn.Module:
@@ -97,15 +438,157 @@ def build_regression_model(backbone: str, pretrained: bool = True) -> nn.Module:
         raise ValueError(f"Unsupported backbone: {backbone}")
 
 
+# -------------------- PROFILING --------------------
+# Always-on, cheap per-epoch counters: time blocked on the DataLoader vs time in
+# the step itself, throughput, starved steps and peak RSS. Loss/accuracy are
+# accumulated on-device so the hot loop never forces a host sync; note that on
+# CUDA the compute figure is therefore host-side time and async kernels may be
+# billed to the next blocking call. An optional torch.profiler window exports a
+# Chrome trace (open in chrome://tracing or https://ui.perfetto.dev).
+
+STARVATION_MS = 1.0  # a ready prefetched batch is a queue pop; longer means workers fell behind
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident set size of this process (DataLoader workers excluded)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+class TrainProfiler:
+    def __init__(self, trace_path: Optional[str] = None, trace_wait: int = 5, trace_steps: int = 10):
+        self.trace_path = trace_path
+        self.trace_wait = trace_wait
+        self.trace_steps = trace_steps
+        self.history: List[Dict[str, Any]] = []
+        self._torch_prof = None
+        self._trace_saved = False
+
+    def start_epoch(self, tag: str):
+        self.tag = tag
+        self.data_wait = 0.0
+        self.compute = 0.0
+        self.steps = 0
+        self.starved = 0
+        self.samples = 0
+        self.start = self.mark = time.perf_counter()
+        if self.trace_path and self._torch_prof is None and is_main_process():
+            # Only the first profiled epoch gets a trace window
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._torch_prof = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=self.trace_wait, warmup=1, active=self.trace_steps, repeat=1),
+                on_trace_ready=self._export_trace,
+                record_shapes=True,
+            )
+            self._torch_prof.start()
+            self._tracing = True
+        else:
+            self._tracing = False
+
+    def _export_trace(self, prof):
+        os.makedirs(os.path.dirname(self.trace_path) or '.', exist_ok=True)
+        prof.export_chrome_trace(self.trace_path)
+        self._trace_saved = True
+        print(f"[INFO] Chrome trace saved: {self.trace_path}")
+
+    def batch_ready(self):
+        now = time.perf_counter()
+        wait = now - self.mark
+        self.data_wait += wait
+        if wait * 1000.0 > STARVATION_MS:
+            self.starved += 1
+        self.mark = now
+
+    def step_done(self, batch_size: int):
+        now = time.perf_counter()
+        self.compute += now - self.mark
+        self.mark = now
+        self.steps += 1
+        self.samples += batch_size
+        if self._tracing:
+            self._torch_prof.step()
+
+    def end_epoch(self) -> Dict[str, Any]:
+        if self._tracing:
+            self._torch_prof.stop()
+            if not self._trace_saved:
+                print(f"[WARN] Epoch had {self.steps} steps, fewer than the trace window ({self.trace_wait}+1+{self.trace_steps}); no trace written")
+        elapsed = time.perf_counter() - self.start
+        world = get_world_size()
+        data_wait, compute, starved, steps, samples = reduce_sums(self.data_wait, self.compute, self.starved, self.steps, self.samples)
+        row = {
+            'tag': self.tag,
+            'elapsed_s': elapsed,
+            'data_wait_s': data_wait / world,
+            'compute_s': compute / world,
+            'samples_per_s': samples / max(elapsed, 1e-9),
+            'steps': int(steps / world),
+            'starved_steps': int(starved),
+            'starved_frac': starved / max(1, steps),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        self.history.append(row)
+        return row
+
+    def add(self, key: str, seconds: float):
+        """Attach non-training time (eval, checkpoint save) to the last epoch row."""
+        if self.history:
+            self.history[-1][key] = self.history[-1].get(key, 0.0) + seconds
+
+    def summary(self, row: Dict[str, Any]) -> str:
+        rss = f" rss={row['peak_rss_mb']:.0f}MB" if row['peak_rss_mb'] is not None else ''
+        return (f"{row['samples_per_s']:.1f} samples/s data_wait={row['data_wait_s']:.2f}s "
+                f"compute={row['compute_s']:.2f}s starved={row['starved_frac']:.0%}{rss}")
+
+    def save(self, path: str):
+        if not is_main_process() or not self.history:
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'starvation_ms': STARVATION_MS, 'world_size': get_world_size(), 'epochs': self.history}, f, indent=2)
+        print(f"[INFO] Training profile saved: {path}")
+
+
+def save_checkpoint(state: Dict[str, Any], path: str, profiler: Optional[TrainProfiler] = None):
+    start = time.perf_counter()
+    torch.save(state, path)
+    if profiler is not None:
+        profiler.add('checkpoint_s', time.perf_counter() - start)
+
+
 # -------------------- TRAIN/VAL LOOPS --------------------
 
-def train_one_epoch(model, loader, criterion, optimizer, scaler, device, epoch, note: str = ""):
+def set_sampler_epoch(loader: DataLoader, epoch: int):
+    # Shuffle from the absolute epoch number, so a resumed run sees the same
+    # shard order as one that never stopped.
+    if isinstance(loader.sampler, DistributedSampler):
+        loader.sampler.set_epoch(epoch)
+
+
+def train_one_epoch(model, loader, criterion, optimizer, scaler, device, epoch, note: str = "", batch_transform: Optional[BatchAugment] = None, profiler: Optional[TrainProfiler] = None):
     model.train()
-    running_loss = 0.0
+    profiler = profiler or TrainProfiler()
+    profiler.start_epoch(f"epoch{epoch+1}{note}")
+    # Running sums stay on the device; read back once per epoch
+    loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+    correct_sum = torch.zeros((), dtype=torch.long, device=device)
+    seen = 0
     total = 0
-    correct = 0
     for images, targets in loader:
-        images = images.to(device, non_blocking=True)
+        profiler.batch_ready()
+        images = apply_batch_transform(images, device, batch_transform)
         targets = targets.to(device, non_blocking=True)
         optimizer.zero_grad(set_to_none=True)
         with torch.cuda.amp.autocast(enabled=torch.cuda.is_available()):
@@ -117,33 +600,37 @@ def train_one_epoch(model, loader, criterion, optimizer, scaler, device, epoch,
         scaler.scale(loss).backward()
         scaler.step(optimizer)
         scaler.update()
-        running_loss += loss.item() * images.size(0)
+        loss_sum += loss.detach() * images.size(0)
+        seen += images.size(0)
         if outputs.ndim == 2 and outputs.shape[1] > 1:
-            _, preds = torch.max(outputs, 1)
             total += targets.size(0)
-            correct += (preds == targets).sum().item()
+            correct_sum += (outputs.detach().argmax(1) == targets).sum()
+        profiler.step_done(images.size(0))
+    stats = profiler.end_epoch()
+    running_loss, seen, total, correct = reduce_sums(loss_sum.item(), seen, total, correct_sum.item())
+    rate = profiler.summary(stats)
     if total > 0:
         acc = correct / max(1, total)
-        print(f"[TRAIN] Epoch {epoch+1} - acc={acc:.4f} loss={running_loss/max(1, len(loader.dataset)):.4f} {note}")
+        log(f"[TRAIN] Epoch {epoch+1} - acc={acc:.4f} loss={running_loss/max(1, seen):.4f} {rate} {note}")
     else:
-        print(f"[TRAIN] Epoch {epoch+1} - loss={running_loss/max(1, len(loader.dataset)):.4f} {note}")
+        log(f"[TRAIN] Epoch {epoch+1} - loss={running_loss/max(1, seen):.4f} {rate} {note}")
 
 
 def eval_classifier(model, loader, criterion, device) -> Tuple[float, float]:
     model.eval()
-    running_loss = 0.0
+    loss_sum = torch.zeros((), dtype=torch.float64, device=device)
+    correct_sum = torch.zeros((), dtype=torch.long, device=device)
     total = 0
-    correct = 0
     with torch.no_grad():
         for images, targets in loader:
             images = images.to(device, non_blocking=True)
             targets = targets.to(device, non_blocking=True)
             outputs = model(images)
             loss = criterion(outputs, targets)
-            running_loss += loss.item() * images.size(0)
-            _, preds = torch.max(outputs, 1)
+            loss_sum += loss * images.size(0)
             total += targets.size(0)
-            correct += (preds == targets).sum().item()
+            correct_sum += (outputs.argmax(1) == targets).sum()
+    running_loss, total, correct = reduce_sums(loss_sum.item(), total, correct_sum.item())
     acc = correct / max(1, total)
     val_loss = running_loss / max(1, total)
     return acc, val_loss
@@ -152,28 +639,41 @@ def eval_classifier(model, loader, criterion, device) -> Tuple[float, float]:
 def eval_regression(model, loader, device) -> Tuple[float, float]:
     model.eval()
     total = 0
-    mae_sum = 0.0
-    mse_sum = 0.0
+    mae_sum = torch.zeros((), dtype=torch.float64, device=device)
+    mse_sum = torch.zeros((), dtype=torch.float64, device=device)
     with torch.no_grad():
         for images, targets in loader:
             images = images.to(device, non_blocking=True)
             targets = targets.to(device, non_blocking=True)
             outputs = model(images)
-            mse = nn.MSELoss()(outputs, targets).item()
-            mae = torch.mean(torch.abs(outputs - targets)).item()
-            n = images.size(0)
-            total += n
-            mae_sum += mae * n
-            mse_sum += mse * n
+            total += images.size(0)
+            mae_sum += torch.abs(outputs - targets).sum()
+            mse_sum += ((outputs - targets) ** 2).sum()
+    mae_sum, mse_sum, total = reduce_sums(mae_sum.item(), mse_sum.item(), total)
     return mae_sum / max(1, total), mse_sum / max(1, total)
 
 
+def write_preprocess_metadata(export_dir: str, backbone: str, img_size: int, task: str):
+    meta = {
+        'task': task,
+        'backbone': backbone,
+        'img_size': img_size,
+        'resize_ratio': RESIZE_RATIO,
+        'mean': IMAGENET_MEAN,
+        'std': IMAGENET_STD,
+    }
+    meta_path = os.path.join(export_dir, 'preprocess.json')
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    print(f"[INFO] Preprocess metadata saved: {meta_path}")
+
+
 def export_torchscript_classifier(ckpt_path: str, export_dir: str):
     ckpt = torch.load(ckpt_path, map_location='cpu')
     backbone = ckpt['backbone']
     class_to_idx = ckpt['class_to_idx']
     img_size = ckpt.get('img_size', 256)
-    model = build_classifier(backbone, num_classes=len(class_to_idx))
+    model = build_classifier(backbone, num_classes=len(class_to_idx), pretrained=False)
     model.load_state_dict(ckpt['model_state'])
     model.eval()
     example = torch.randn(1, 3, img_size, img_size)
@@ -181,13 +681,14 @@ def export_torchscript_classifier(ckpt_path: str, export_dir: str):
     out_path = os.path.join(export_dir, 'model.ts.pt')
     traced.save(out_path)
     print(f"[INFO] TorchScript saved: {out_path}")
+    write_preprocess_metadata(export_dir, backbone, img_size, task='classification')
 
 
 def export_torchscript_regression(ckpt_path: str, export_dir: str):
     ckpt = torch.load(ckpt_path, map_location='cpu')
     backbone = ckpt['backbone']
     img_size = ckpt.get('img_size', 256)
-    model = build_regression_model(backbone)
+    model = build_regression_model(backbone, pretrained=False)
     model.load_state_dict(ckpt['model_state'])
     model.eval()
     example = torch.randn(1, 3, img_size, img_size)
@@ -195,15 +696,926 @@ def export_torchscript_regression(ckpt_path: str, export_dir: str):
     out_path = os.path.join(export_dir, 'severity_regression.ts.pt')
     traced.save(out_path)
     print(f"[INFO] TorchScript saved: {out_path}")
+    write_preprocess_metadata(export_dir, backbone, img_size, task='regression')
+
+
+# -------------------- PROGRESSIVE RESIZING --------------------
+# Early epochs learn coarse features and do not need full resolution: train at
+# smaller sizes with proportionally larger batches, then finish at --img_size.
+# Validation (and therefore checkpoint selection) always runs at --img_size.
+
+def progressive_plan(sizes: List[int], target_size: int, batch_size: int, total_epochs: int, max_batch_size: int) -> List[Tuple[int, int]]:
+    """Per-epoch (img_size, batch_size). Every size gets an equal share of the
+    epochs, the target size also takes the remainder; batch size grows with the
+    pixel savings (rounded to a multiple of 8, capped at max_batch_size)."""
+    sizes = sorted({s for s in sizes if s < target_size}) + [target_size]
+    share = total_epochs // len(sizes)
+    plan: List[Tuple[int, int]] = []
+    for i, size in enumerate(sizes):
+        n = share if i < len(sizes) - 1 else total_epochs - share * (len(sizes) - 1)
+        bs = batch_size
+        if size < target_size:
+            bs = min(max_batch_size, max(batch_size, int(batch_size * (target_size / size) ** 2) // 8 * 8))
+        plan += [(size, bs)] * n
+    return plan
+
+
+class PhasedLoader:
+    """Epoch -> (train loader, batch transform), rebuilt via build(img_size, batch_size)
+    whenever the plan moves to a new phase. A fixed-size run is a one-phase plan."""
+
+    def __init__(self, plan: List[Tuple[int, int]], build):
+        self.plan = plan
+        self.build = build
+        self.current: Optional[Tuple[int, int]] = None
+
+    def __call__(self, epoch: int) -> Tuple[DataLoader, Optional[BatchAugment]]:
+        phase = self.plan[min(epoch, len(self.plan) - 1)]
+        if phase != self.current:
+            self.current = phase
+            self.loader, self.batch_transform = self.build(*phase)
+            if len(set(self.plan)) > 1:
+                log(f"[PHASE] From epoch {epoch+1}: img_size={phase[0]} batch_size={phase[1]}")
+        return self.loader, self.batch_transform
+
+
+def time_to_accuracy(history: List[Dict[str, Any]], target: float) -> Optional[float]:
+    for row in history:
+        if row['val_acc'] >= target:
+            return row['elapsed_s']
+    return None
+
+
+def compare_progressive(train_fn, **kwargs) -> Dict[str, Any]:
+    """Train with the progressive schedule, then at fixed size into
+    <output_dir>/baseline, and report wall-clock time for each to first reach the
+    best val accuracy that both runs achieve."""
+    output_dir = kwargs['output_dir']
+    runs = {}
+    for name, sizes, out in (('progressive', kwargs['progressive_sizes'], output_dir),
+                             ('fixed', None, os.path.join(output_dir, 'baseline'))):
+        seed_rank()
+        log(f"[INFO] Run: {name}")
+        runs[name] = train_fn(**{**kwargs, 'progressive_sizes': sizes, 'output_dir': out})
+    target = min(max(r['val_acc'] for r in h) for h in runs.values())
+    report = {'target_val_acc': target}
+    for name, history in runs.items():
+        report[name] = {
+            'time_to_target_s': time_to_accuracy(history, target),
+            'total_s': history[-1]['elapsed_s'],
+            'best_val_acc': max(r['val_acc'] for r in history),
+            'epochs': history,
+        }
+    t_prog, t_fixed = report['progressive']['time_to_target_s'], report['fixed']['time_to_target_s']
+    report['speedup'] = t_fixed / max(t_prog, 1e-9)
+    log(f"[PROG] val_acc>={target:.4f} reached in {t_prog:.1f}s progressive vs {t_fixed:.1f}s fixed ({report['speedup']:.2f}x)")
+    if is_main_process():
+        path = os.path.join(output_dir, 'progressive_report.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Progressive resizing report saved: {path}")
+    return report
+
+
+# -------------------- RESUME / EARLY STOPPING / BUDGET --------------------
+# last.pth holds everything needed to continue a preempted run exactly where the
+# last finished epoch left off (model, optimizer, scaler, epoch, early-stopping
+# and best-metric state, history and every rank's RNG states); best.pth stays the
+# export source.
+
+def rng_state() -> List[Dict[str, Any]]:
+    """RNG states of all ranks, indexed by rank. Collective: call on every rank."""
+    state = {
+        'python': random.getstate(),
+        'numpy': np.random.get_state(),
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+    if not dist_is_initialized():
+        return [state]
+    states: List[Optional[Dict[str, Any]]] = [None] * get_world_size()
+    dist.all_gather_object(states, state)
+    return states
+
+
+def set_rng_state(state: Dict[str, Any]):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if state.get('cuda') is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def save_training_state(path: str, state: Dict[str, Any], profiler: Optional[TrainProfiler] = None):
+    """Write via a temp file so a kill mid-save never leaves a truncated last.pth.
+    Call on every rank: RNG states are gathered from all of them."""
+    rng = rng_state()
+    if not is_main_process():
+        return
+    tmp = path + '.tmp'
+    save_checkpoint({**state, 'rng': rng}, tmp, profiler)
+    os.replace(tmp, path)
+
+
+def load_training_state(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.isfile(path):
+        log(f"[WARN] --resume: no {path}, starting from scratch")
+        return None
+    state = torch.load(path, map_location='cpu', weights_only=False)  # RNG states are not tensors
+    rng = state['rng'] if isinstance(state['rng'], list) else [state['rng']]
+    if len(rng) == get_world_size():
+        set_rng_state(rng[get_rank()])
+    else:
+        # Saved with a different number of ranks: no exact continuation, but keep
+        # the streams distinct per rank and different from the epochs already run.
+        log(f"[WARN] {path} holds RNG states for {len(rng)} rank(s), running {get_world_size()}; reseeding per rank")
+        seed_rank(SEED + 1000 * state['epoch'])
+    log(f"[INFO] Resuming from {path} after epoch {state['epoch']}")
+    return state
+
+
+class EarlyStopping:
+    """Stop after `patience` epochs without the metric improving by min_delta
+    (mode 'max' for accuracy, 'min' for MAE). patience=0 disables it."""
+
+    def __init__(self, patience: int = 0, mode: str = 'max', min_delta: float = 0.0):
+        self.patience = patience
+        self.sign = 1.0 if mode == 'max' else -1.0
+        self.min_delta = min_delta
+        self.best: Optional[float] = None
+        self.bad_epochs = 0
+
+    def step(self, value: float) -> bool:
+        if self.best is None or self.sign * (value - self.best) > self.min_delta:
+            self.best = value
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {'best': self.best, 'bad_epochs': self.bad_epochs}
+
+    def load_state_dict(self, state: Dict[str, Any]):
+        self.best, self.bad_epochs = state['best'], state['bad_epochs']
+
+
+class TimeBudget:
+    """Wall-clock budget for this invocation: stop before starting an epoch that
+    the slowest recent epoch says would not finish in time. 0 disables it."""
+
+    def __init__(self, seconds: float = 0.0):
+        self.seconds = seconds
+        self.start = time.perf_counter()
+        self.epoch_start = self.start
+        self.epoch_times: List[float] = []
+
+    def epoch_done(self):
+        now = time.perf_counter()
+        self.epoch_times.append(now - self.epoch_start)
+        self.epoch_start = now
+
+    def exhausted(self) -> bool:
+        if self.seconds <= 0 or not self.epoch_times:
+            return False
+        over = time.perf_counter() - self.start + max(self.epoch_times[-3:]) > self.seconds
+        # every rank must agree or the next all-reduce deadlocks
+        (votes,) = reduce_sums(float(over))
+        return votes > 0
+
+
+def parse_duration(value: str) -> float:
+    """Seconds from '5400', '90m', '1.5h' or '2d'."""
+    value = value.strip().lower()
+    scale = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}.get(value[-1:])
+    return float(value[:-1]) * scale if scale else float(value)
+
+
+# -------------------- CLASSIFIER TRAINING --------------------
+# Shared by the ImageFolder and CSV classifiers: head-only warmup with a frozen
+# backbone, then full fine-tuning at lr * 0.1, keeping the best val checkpoint.
+
+def freeze_backbone(model: nn.Module, frozen: bool):
+    for p in model.parameters():
+        p.requires_grad = not frozen
+    if frozen and hasattr(model, 'classifier'):
+        for p in model.classifier.parameters():
+            p.requires_grad = True
+
+
+def fit_classifier(
+    model: nn.Module,
+    train_phases: PhasedLoader,
+    val_loader: DataLoader,
+    device: torch.device,
+    best_path: str,
+    ckpt_meta: Dict[str, Any],
+    lr: float,
+    epochs: int,
+    freeze_epochs: int,
+    profiler: Optional[TrainProfiler] = None,
+    resume: bool = False,
+    patience: int = 0,
+    min_delta: float = 0.0,
+    time_budget: float = 0.0,
+) -> Tuple[float, List[Dict[str, Any]]]:
+    """Returns the best val accuracy and per-epoch history (val_acc, elapsed_s, phase).
+    Saves last.pth next to best_path every epoch; stops early on patience or budget."""
+    profiler = profiler or TrainProfiler()
+    last_path = os.path.join(os.path.dirname(best_path), 'last.pth')
+    criterion = nn.CrossEntropyLoss()
+    scaler = torch.cuda.amp.GradScaler(enabled=torch.cuda.is_available())
+    stopper = EarlyStopping(patience, mode='max', min_delta=min_delta)
+    budget = TimeBudget(time_budget)
+    history: List[Dict[str, Any]] = []
+    best_acc = 0.0
+    start_epoch = 0
+    elapsed_before = 0.0
+
+    state = load_training_state(last_path) if resume else None
+    if state is not None:
+        model.load_state_dict(state['model_state'])
+        scaler.load_state_dict(state['scaler_state'])
+        stopper.load_state_dict(state['early_stopping'])
+        best_acc, start_epoch, history = state['best_acc'], state['epoch'], state['history']
+        elapsed_before = history[-1]['elapsed_s'] if history else 0.0
+    start_time = time.perf_counter() - elapsed_before
+
+    total_epochs = freeze_epochs + epochs
+    stage = None
+    for epoch in range(start_epoch, total_epochs):
+        warmup = epoch < freeze_epochs
+        if ('warmup' if warmup else 'finetune') != stage:
+            # Warmup: frozen backbone, head at lr. Fine-tune: everything at lr * 0.1
+            stage = 'warmup' if warmup else 'finetune'
+            freeze_backbone(model, warmup)
+            train_model = wrap_ddp(model)
+            optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=lr if warmup else lr * 0.1)
+            if state is not None and epoch == start_epoch and state['stage'] == stage:
+                optimizer.load_state_dict(state['optimizer_state'])
+        train_loader, batch_transform = train_phases(epoch)
+        set_sampler_epoch(train_loader, epoch)
+        step = epoch if warmup else epoch - freeze_epochs
+        train_one_epoch(train_model, train_loader, criterion, optimizer, scaler, device, step, note='(head-only)' if warmup else '', batch_transform=batch_transform, profiler=profiler)
+        start = time.perf_counter()
+        val_acc, val_loss = eval_classifier(model, val_loader, criterion, device)
+        profiler.add('eval_s', time.perf_counter() - start)
+        if warmup:
+            log(f"[WARMUP] Epoch {step+1}/{freeze_epochs} - val_acc={val_acc:.4f} val_loss={val_loss:.4f}")
+        else:
+            log(f"[FT] Epoch {step+1}/{epochs} - val_acc={val_acc:.4f} val_loss={val_loss:.4f}")
+        if val_acc > best_acc:
+            best_acc = val_acc
+            if is_main_process():
+                save_checkpoint({'model_state': model.state_dict(), **ckpt_meta}, best_path, profiler)
+                if not warmup:
+                    print(f"[INFO] Saved new best checkpoint: {best_path}")
+        history.append({'epoch': epoch + 1, 'stage': stage, 'img_size': train_phases.current[0], 'batch_size': train_phases.current[1],
+                        'val_acc': val_acc, 'val_loss': val_loss, 'elapsed_s': time.perf_counter() - start_time})
+        # Patience only applies to fine-tuning; the head-only warmup always runs
+        stop = not warmup and stopper.step(val_acc)
+        save_training_state(last_path, {
+            'model_state': model.state_dict(), 'optimizer_state': optimizer.state_dict(), 'scaler_state': scaler.state_dict(),
+            'epoch': epoch + 1, 'stage': stage, 'best_acc': best_acc, 'early_stopping': stopper.state_dict(), 'history': history,
+            **ckpt_meta,
+        }, profiler)
+        budget.epoch_done()
+        if stop:
+            log(f"[INFO] Early stopping: val_acc has not improved for {patience} epochs (best {best_acc:.4f})")
+            break
+        if epoch + 1 < total_epochs and budget.exhausted():
+            log(f"[INFO] Time budget of {time_budget:.0f}s reached after epoch {epoch+1}/{total_epochs}; exporting best (val_acc={best_acc:.4f})")
+            break
+    return best_acc, history
+
+
+def export_classifier_bundle(best_path: str, output_dir: str, idx_to_class: Dict[int, str]):
+    """TorchScript + labels.json + preprocess.json under <output_dir>/export (rank 0 only)."""
+    barrier()
+    if not is_main_process():
+        return
+    export_dir = os.path.join(output_dir, 'export')
+    os.makedirs(export_dir, exist_ok=True)
+    export_torchscript_classifier(best_path, export_dir)
+    labels_path = os.path.join(export_dir, 'labels.json')
+    with open(labels_path, 'w', encoding='utf-8') as f:
+        json.dump({str(i): idx_to_class[i] for i in range(len(idx_to_class))}, f, ensure_ascii=False, indent=2)
+    print(f"[INFO] Export complete: {export_dir}")
+
+
+# -------------------- DATASET INDEX --------------------
+# Every dataset is resolved once into <dataset>.index.json: relative path, label,
+# width/height, byte size, mtime, sha1 and perceptual hash per decodable image,
+# the files that failed to decode, and a stratified train/val assignment that
+# keeps near-duplicate groups (found by `dedup`) on one side. Training loads the
+# index without touching the filesystem; `index` (or --refresh_index) rescans and
+# only decodes files that are new or changed since the last build.
+
+INDEX_VERSION = 2
+INDEX_COLUMNS = ['path', 'label', 'width', 'height', 'bytes', 'mtime_ns', 'sha1', 'split', 'dhash', 'group']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.ppm', '.bmp', '.pgm', '.tif', '.tiff', '.webp')
+
+
+def index_path_for(kind: str, root: str, labels_csv: Optional[str] = None) -> str:
+    if kind == 'imagefolder':
+        return os.path.normpath(root) + '.index.json'
+    return os.path.splitext(labels_csv)[0] + '.index.json'
+
+
+def scan_dataset(kind: str, root: str, labels_csv: Optional[str] = None) -> List[Tuple[str, Any]]:
+    """(path relative to root, label) candidates; nothing is opened or decoded here."""
+    out: List[Tuple[str, Any]] = []
+    if kind == 'imagefolder':
+        for cls in sorted(e.name for e in os.scandir(root) if e.is_dir()):
+            for dirpath, _, files in sorted(os.walk(os.path.join(root, cls), followlinks=True)):
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        out.append((os.path.relpath(os.path.join(dirpath, name), root), cls))
+        return out
+    with open(labels_csv, 'r', encoding='utf-8', newline='') as f:
+        rows = [r for r in csv.reader(f) if any(c.strip() for c in r)]
+    header = [h.strip() for h in rows[0]]
+    if kind == 'csv':
+        # Expect columns containing at least image_id and label
+        try:
+            image_idx, label_idx = header.index('image_id'), header.index('label')
+        except ValueError:
+            raise ValueError("CSV must contain 'image_id' and 'label' columns.")
+    else:
+        try:
+            image_idx, label_idx = header.index('filename'), header.index('severity')
+        except ValueError:
+            # fallback: assume 2 columns filename,severity
+            image_idx, label_idx = 0, 1
+    for row in rows[1:]:
+        if len(row) <= max(image_idx, label_idx):
+            continue
+        image_id, label = row[image_idx].strip(), row[label_idx].strip()
+        if kind == 'csv':
+            # Paddy dataset stores images in label subfolders: <images_dir>/<label>/<image_id>
+            nested = os.path.join(label, image_id)
+            out.append((nested if os.path.isfile(os.path.join(root, nested)) else image_id, label))
+        else:
+            out.append((image_id, float(label)))
+    return out
+
+
+def image_dhash(img: Image.Image) -> str:
+    """64-bit difference hash (hex): sign of horizontal gradients on a 9x8 grayscale
+    thumbnail. Survives re-encoding, resizing and small crops or exposure changes."""
+    px = np.asarray(img.convert('L').resize((9, 8), Image.BOX), dtype=np.int16)
+    return np.packbits(px[:, 1:] > px[:, :-1]).tobytes().hex()
+
+
+def probe_image(path: str) -> List[Any]:
+    """[width, height, bytes, mtime_ns, sha1, dhash]; raises if the file does not fully decode."""
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    with Image.open(BytesIO(data)) as img:
+        img.load()  # full decode catches truncated files, not just bad headers
+        width, height = img.size
+        dhash = image_dhash(img)
+    return [width, height, st.st_size, st.st_mtime_ns, hashlib.sha1(data).hexdigest(), dhash]
+
+
+def stratified_assign(labels: List[Any], val_split: float, rng: random.Random, groups: Optional[List[Any]] = None) -> List[str]:
+    """'train'/'val' per sample with val_split of every label (severity: of every decile).
+    Samples sharing a non-None groups[i] are assigned together, stratified by their first member."""
+    keys = labels
+    if labels and isinstance(labels[0], float):
+        order = sorted(range(len(labels)), key=lambda i: labels[i])
+        keys = [0] * len(labels)
+        for rank, i in enumerate(order):
+            keys[i] = rank * 10 // len(labels)
+    units: Dict[Any, List[int]] = {}
+    for i in range(len(labels)):
+        group = groups[i] if groups is not None else None
+        units.setdefault(i if group is None else ('group', group), []).append(i)
+    strata: Dict[Any, List[List[int]]] = {}
+    for members in units.values():
+        strata.setdefault(keys[members[0]], []).append(members)
+    out = ['train'] * len(labels)
+    for key in sorted(strata, key=str):
+        stratum = strata[key]
+        rng.shuffle(stratum)
+        quota = int(round(sum(len(u) for u in stratum) * val_split))
+        taken = 0
+        for members in stratum:
+            if taken >= quota:
+                break
+            for i in members:
+                out[i] = 'val'
+            taken += len(members)
+    return out
+
+
+class DatasetIndex:
+    def __init__(self, path: str, meta: Dict[str, Any], rows: List[List[Any]], invalid: Dict[str, str]):
+        self.path = path
+        self.meta = meta
+        self.rows = rows
+        self.invalid = invalid
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def root(self) -> str:
+        return self.meta['root']
+
+    def paths(self) -> List[str]:
+        return [os.path.join(self.root, r[0]) for r in self.rows]
+
+    def labels(self) -> List[Any]:
+        return [r[1] for r in self.rows]
+
+    def classes(self) -> List[str]:
+        return sorted({r[1] for r in self.rows})
+
+    def save(self):
+        # Temp file + rename: readers never see a half-written index
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({**self.meta, 'columns': INDEX_COLUMNS, 'rows': self.rows, 'invalid': self.invalid}, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+
+    @classmethod
+    def load(cls, path: str) -> 'DatasetIndex':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') == 1 and data.get('columns') == INDEX_COLUMNS[:8]:
+            # v1 had no perceptual hash / duplicate group; dedup fills them in
+            for r in data['rows']:
+                r += [None, None]
+            data['version'] = INDEX_VERSION
+            data['columns'] = INDEX_COLUMNS
+        if data.get('version') != INDEX_VERSION or data.get('columns') != INDEX_COLUMNS:
+            raise ValueError(f"Unsupported dataset index format: {path} (rebuild with the index task)")
+        rows, invalid = data.pop('rows'), data.pop('invalid')
+        data.pop('columns')
+        return cls(path, data, rows, invalid)
+
+    def assign_split(self, val_split: float, seed: int = SEED) -> Tuple[List[int], List[int]]:
+        """Create or extend the stored stratified, group-aware split. Samples added since
+        it was made are split among themselves; a different val_split/seed re-splits
+        everything. Only training and the index/dedup tasks call this."""
+        split_col = INDEX_COLUMNS.index('split')
+        group_col = INDEX_COLUMNS.index('group')
+        if self.meta.get('split') != {'val_split': val_split, 'seed': seed}:
+            if self.meta.get('split'):
+                print(f"[WARN] Index split was {self.meta['split']}; re-splitting with val_split={val_split} seed={seed} "
+                      "(checkpoints trained on the old split can no longer be evaluated against it)")
+            for r in self.rows:
+                r[split_col] = None
+            self.meta['split'] = {'val_split': val_split, 'seed': seed}
+        todo = [i for i, r in enumerate(self.rows) if r[split_col] is None]
+        if todo:
+            rng = random.Random(f"{seed}:{len(self.rows)}")
+            assignment = stratified_assign([self.rows[i][1] for i in todo], val_split, rng, [self.rows[i][group_col] for i in todo])
+            for i, assigned in zip(todo, assignment):
+                self.rows[i][split_col] = assigned
+            if val_split > 0 and len(self.rows) > 1 and not any(r[split_col] == 'val' for r in self.rows):
+                self.rows[rng.randrange(len(self.rows))][split_col] = 'val'
+            if is_main_process():
+                self.save()
+        return self.split_indices(val_split, seed)
+
+    def split_indices(self, val_split: float, seed: int = SEED) -> Tuple[List[int], List[int]]:
+        """Read-only: the stored split; refuses rather than re-splitting when it was made
+        with another val_split/seed or has unassigned rows."""
+        split_col = INDEX_COLUMNS.index('split')
+        if self.meta.get('split') != {'val_split': val_split, 'seed': seed}:
+            raise ValueError(f"{self.path} holds split {self.meta.get('split')}, not val_split={val_split} seed={seed}; "
+                             "only training or the index task creates splits")
+        if any(r[split_col] is None for r in self.rows):
+            raise ValueError(f"{self.path} has rows without a split (added after it was made); run training or the index task first")
+        train = [i for i, r in enumerate(self.rows) if r[split_col] == 'train']
+        val = [i for i, r in enumerate(self.rows) if r[split_col] == 'val']
+        return train, val
+
+    def split_identity(self) -> Dict[str, Any]:
+        """What a checkpoint records to find its split again: index, parameters and a
+        hash of every row's side."""
+        split_col = INDEX_COLUMNS.index('split')
+        digest = hashlib.sha1()
+        for r in sorted(self.rows, key=lambda r: r[0]):
+            digest.update(f"{r[0]}\t{r[split_col]}\n".encode('utf-8'))
+        return {'index': os.path.abspath(self.path), **self.meta['split'], 'assignment_sha1': digest.hexdigest()}
+
+
+def build_dataset_index(kind: str, root: str, labels_csv: Optional[str] = None, index_path: Optional[str] = None,
+                        check_existing: bool = True, workers: int = 8) -> DatasetIndex:
+    """Scan the source and (re)validate only files that are new, or changed when
+    check_existing is set; rows of files that disappeared are dropped."""
+    index_path = index_path or index_path_for(kind, root, labels_csv)
+    old: Dict[str, List[Any]] = {}
+    meta = {'version': INDEX_VERSION, 'kind': kind, 'root': os.path.abspath(root),
+            'labels_csv': os.path.abspath(labels_csv) if labels_csv else None,
+            'labels_csv_stat': labels_csv_stat(labels_csv), 'split': None}
+    if os.path.isfile(index_path):
+        previous = DatasetIndex.load(index_path)
+        if previous.meta['root'] == meta['root']:  # rows of another root say nothing about these files
+            old = {r[0]: r for r in previous.rows}
+            meta['split'] = previous.meta.get('split')
+
+    start = time.perf_counter()
+    candidates = scan_dataset(kind, root, labels_csv)
+    rows: List[Optional[List[Any]]] = [None] * len(candidates)
+    todo = []
+    for i, (rel, label) in enumerate(candidates):
+        prev = old.get(rel)
+        changed = prev is None
+        if prev is not None and check_existing:
+            try:
+                st = os.stat(os.path.join(root, rel))
+                changed = (st.st_size, st.st_mtime_ns) != (prev[4], prev[5])
+            except OSError:
+                changed = True
+        # A file keeps its train/val side unless its label changed
+        split = prev[7] if prev is not None and prev[1] == label else None
+        if changed:
+            todo.append((i, split))
+        else:
+            rows[i] = [rel, label] + prev[2:7] + [split] + prev[8:]
+
+    invalid: Dict[str, str] = {}
+
+    def probe(i: int):
+        try:
+            return probe_image(os.path.join(root, candidates[i][0])), None
+        except Exception as e:  # missing, unreadable or undecodable
+            return None, f"{type(e).__name__}: {e}"
+
+    # Pillow releases the GIL while decoding, so threads scale here
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for (i, split), (info, err) in zip(todo, pool.map(probe, [i for i, _ in todo])):
+            rel, label = candidates[i]
+            if err:
+                invalid[rel] = err
+            else:
+                rows[i] = [rel, label] + info[:5] + [split, info[5], None]
+
+    index = DatasetIndex(index_path, meta, [r for r in rows if r is not None], invalid)
+    index.save()
+    print(f"[INFO] Dataset index: {len(index)} images ({len(todo)} probed, {len(invalid)} invalid) in {time.perf_counter() - start:.1f}s -> {index_path}")
+    for rel, err in list(invalid.items())[:10]:
+        print(f"[WARN] Skipping {rel}: {err}")
+    return index
+
+
+def labels_csv_stat(labels_csv: Optional[str]) -> Optional[List[int]]:
+    if not labels_csv:
+        return None
+    st = os.stat(labels_csv)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_dataset_index(kind: str, root: str, labels_csv: Optional[str] = None, refresh: bool = False,
+                       val_split: Optional[float] = None) -> DatasetIndex:
+    """Existing index as-is (no filesystem scan) unless refresh or the labels CSV
+    changed; built on first use. Under torchrun only rank 0 builds, refreshes and
+    (with val_split) stores the split; the other ranks load its result."""
+    path = index_path_for(kind, root, labels_csv)
+    if is_main_process():
+        index = None
+        if os.path.isfile(path) and not refresh:
+            index = DatasetIndex.load(path)
+            if index.meta['root'] != os.path.abspath(root):
+                print(f"[WARN] {path} indexes {index.meta['root']}; rebuilding")
+                index = None
+            elif index.meta.get('labels_csv_stat') != labels_csv_stat(labels_csv):
+                print(f"[INFO] {labels_csv} changed since {path} was built; updating")
+                index = None
+        if index is None:
+            index = build_dataset_index(kind, root, labels_csv, path, check_existing=refresh)
+        if val_split is not None:
+            index.assign_split(val_split)
+    barrier()
+    if not is_main_process():
+        index = DatasetIndex.load(path)
+    return index
+
+
+def load_recorded_split(split: Optional[Dict[str, Any]], index_path: Optional[str] = None) -> Tuple[DatasetIndex, List[int], List[int]]:
+    """Read-only: the index and train/val indices a checkpoint was trained with
+    (its 'split' entry). Never builds, re-splits or saves; refuses when the index
+    no longer holds exactly that assignment."""
+    if not split:
+        raise ValueError("Checkpoint has no recorded split (trained before splits were recorded); its validation set cannot be reconstructed")
+    if index_path and os.path.abspath(index_path) != split['index']:
+        raise ValueError(f"Checkpoint was trained on {split['index']}, not {os.path.abspath(index_path)}")
+    index = DatasetIndex.load(split['index'])
+    train_idx, val_idx = index.split_indices(split['val_split'], split['seed'])
+    if index.split_identity() != split:
+        raise ValueError(f"{split['index']} no longer holds the checkpoint's split (rows were added, removed, relabelled or re-split since training)")
+    return index, train_idx, val_idx
+
+
+class IndexedImageFolder(Dataset):
+    """ImageFolder replacement backed by a DatasetIndex (samples/classes/class_to_idx/transform)."""
+
+    def __init__(self, index: DatasetIndex, transform=None):
+        self.index = index
+        self.classes = index.classes()
+        self.class_to_idx = {c: i for i, c in enumerate(self.classes)}
+        self.samples = [(p, self.class_to_idx[label]) for p, label in zip(index.paths(), index.labels())]
+        self.transform = transform
+
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        path, target = self.samples[idx]
+        img = Image.open(path).convert('RGB')
+        if self.transform is not None:
+            img = self.transform(img)
+        return img, target
+
+
+# -------------------- NEAR-DUPLICATES --------------------
+# `dedup` clusters images whose dHash differ in at most max_distance of 64 bits.
+# Candidates come from multi-index hashing: the hash is cut into max_distance + 1
+# chunks and, by pigeonhole, two hashes within that distance agree exactly on at
+# least one chunk, so only images sharing a chunk value are ever compared.
+# Clusters are stored in the index 'group' column (one side of the split per
+# cluster) and one image per cluster and label goes into a cleaned manifest.
+
+def popcount64(x: np.ndarray) -> np.ndarray:
+    if hasattr(np, 'bitwise_count'):  # numpy >= 2.0
+        return np.bitwise_count(x)
+    # SWAR bit count on whole uint64 words (multiplication wraps mod 2^64)
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def hash_missing(index: DatasetIndex, workers: int = 8) -> int:
+    """Fill the dhash column for rows indexed before it existed; returns how many were hashed."""
+    dhash_col = INDEX_COLUMNS.index('dhash')
+    todo = [r for r in index.rows if r[dhash_col] is None]
+
+    def dhash_file(rel: str) -> Optional[str]:
+        try:
+            with Image.open(os.path.join(index.root, rel)) as img:
+                img.draft('RGB', (64, 64))  # JPEG: decode at 1/2..1/8 scale, plenty for a 9x8 hash
+                return image_dhash(img)
+        except Exception as e:
+            print(f"[WARN] Could not hash {rel}: {type(e).__name__}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for r, dhash in zip(todo, pool.map(dhash_file, [r[0] for r in todo])):
+            r[dhash_col] = dhash
+    return len(todo)
+
+
+def connected_components(n: int, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Smallest member index per node for the undirected edges a[i]-b[i]: roots hook
+    onto the smaller root of every edge, then pointer jumping, until nothing moves."""
+    labels = np.arange(n)
+    while True:
+        la, lb = labels[a], labels[b]
+        low = np.minimum(la, lb)
+        new = labels.copy()
+        np.minimum.at(new, la, low)
+        np.minimum.at(new, lb, low)
+        while True:
+            jumped = new[new]
+            if np.array_equal(jumped, new):
+                break
+            new = jumped
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def entropy_blocks(entropy: np.ndarray, m: int) -> List[int]:
+    """m bit masks with about equal total entropy: bits dealt in snake order by entropy."""
+    masks = [0] * m
+    for rank, bit in enumerate(np.argsort(-entropy, kind='stable')):
+        lap, pos = divmod(rank, m)
+        masks[pos if lap % 2 == 0 else m - 1 - pos] |= 1 << int(bit)
+    return masks
+
+
+def hash_tables(hashes: np.ndarray, max_distance: int) -> Tuple[List[int], List[Tuple[int, ...]]]:
+    """Multi-index layout for Hamming search: the 64 bits are cut into m blocks, and
+    two hashes within max_distance bits agree exactly on at least m - max_distance
+    of them, so each table keys on one such combination of blocks. Bits are dealt
+    to blocks by entropy so skewed dHash bits do not leave a block nearly constant.
+    More blocks mean wider keys (fewer candidates) but more tables; m is picked by
+    cost, with the candidate count measured on one table of each layout.
+    Returns the block bit masks and the combinations."""
+    n, d = len(hashes), max_distance
+    p = np.array([float(((hashes >> np.uint64(i)) & np.uint64(1)).mean()) for i in range(64)])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        entropy = np.nan_to_num(-(p * np.log2(p) + (1 - p) * np.log2(1 - p)))
+    best = None
+    for m in range(d + 1, min(64, d + 12) + 1):
+        tables = math.comb(m, d)
+        if tables > 4096:
+            break
+        masks = entropy_blocks(entropy, m)
+        counts = np.unique(hashes & np.uint64(sum(masks[:m - d])), return_counts=True)[1].astype(np.int64)
+        # One table costs about as much as comparing 5n candidate pairs (measured)
+        cost = tables * (5.0 * n + float((counts * (counts - 1) // 2).sum()))
+        if best is None or cost < best[0]:
+            best = (cost, m, masks)
+        elif cost > 2 * best[0]:
+            break
+    _, m, masks = best
+    return masks, list(itertools.combinations(range(m), m - d))
+
+
+def bucket_pairs(keys: np.ndarray):
+    """Yields (i, j) arrays covering every i != j pair with equal keys exactly once:
+    after sorting, offset k pairs each position with the one k further on while
+    both stay in the same run of equal keys."""
+    order = np.argsort(keys, kind='stable')
+    ks = keys[order]
+    starts = np.flatnonzero(np.r_[True, ks[1:] != ks[:-1]])
+    run_end = np.repeat(np.r_[starts[1:], len(ks)], np.diff(np.r_[starts, len(ks)]))
+    pos = np.flatnonzero(run_end - np.arange(len(ks)) > 1)
+    k = 1
+    while len(pos):
+        yield order[pos], order[pos + k]
+        k += 1
+        pos = pos[run_end[pos] - pos > k]
+
+
+def near_duplicate_clusters(hashes: np.ndarray, max_distance: int) -> Tuple[np.ndarray, int]:
+    """Cluster id (smallest member index) per hash, and the number of candidate pairs compared.
+    Identical hashes are collapsed first, so exact copies and blank frames cost nothing extra;
+    candidates come from the multi-index tables of hash_tables."""
+    if not 0 <= max_distance < 64:
+        raise ValueError(f"max_distance must be in 0..63 for a 64-bit hash, got {max_distance}")
+    uniq, inverse = np.unique(hashes, return_inverse=True)
+    edges_a: List[np.ndarray] = []
+    edges_b: List[np.ndarray] = []
+    compared = 0
+    if max_distance > 0 and len(uniq) > 1:
+        masks, tables = hash_tables(uniq, max_distance)
+        for combo in tables:
+            for a, b in bucket_pairs(uniq & np.uint64(sum(masks[i] for i in combo))):
+                compared += len(a)
+                close = popcount64(uniq[a] ^ uniq[b]) <= max_distance
+                edges_a.append(a[close])
+                edges_b.append(b[close])
+    if edges_a:
+        labels = connected_components(len(uniq), np.concatenate(edges_a), np.concatenate(edges_b))
+    else:
+        labels = np.arange(len(uniq))
+    # Back to input order; the smallest input index of each cluster names it
+    first = np.full(len(uniq), len(hashes))
+    np.minimum.at(first, labels[inverse], np.arange(len(hashes)))
+    return first[labels[inverse]], compared
+
+
+def synthetic_dhashes(n: int, max_distance: int, near_fraction: float = 0.02, exact_fraction: float = 0.02,
+                      seed: int = SEED) -> Tuple[np.ndarray, np.ndarray]:
+    """n 64-bit hashes with skewed bits (each bit set with its own probability, like
+    real dHashes) plus planted copies: near ones flip 1..max_distance random bits,
+    exact ones are identical. Returns the hashes and the planted (copy, source) pairs."""
+    rng = np.random.default_rng(seed)
+    n_near, n_exact = int(n * near_fraction), int(n * exact_fraction)
+    n_base = n - n_near - n_exact
+    bit_p = rng.beta(2.0, 2.0, size=64)
+    bits = rng.random((n_base, 64)) < bit_p
+    base = (bits.astype(np.uint64) << np.arange(64, dtype=np.uint64)).sum(axis=1, dtype=np.uint64)
+    src = rng.integers(0, n_base, size=n_near + n_exact)
+    copies = base[src].copy()
+    for i in range(n_near):
+        flips = rng.choice(64, size=rng.integers(1, max_distance + 1), replace=False) if max_distance else []
+        for bit in flips:
+            copies[i] ^= np.uint64(1) << np.uint64(bit)
+    hashes = np.concatenate([base, copies])
+    pairs = np.stack([np.arange(n_base, n), src], axis=1)
+    return hashes, pairs
+
+
+def benchmark_dedup(images: int = 300_000, max_distance: int = 6, near_fraction: float = 0.02, exact_fraction: float = 0.02) -> Dict[str, Any]:
+    """Time near_duplicate_clusters on synthetic hashes and check every planted pair is found."""
+    hashes, pairs = synthetic_dhashes(images, max_distance, near_fraction, exact_fraction)
+    masks, tables = hash_tables(np.unique(hashes), max_distance) if max_distance else ([0], [(0,)])
+    start = time.perf_counter()
+    roots, compared = near_duplicate_clusters(hashes, max_distance)
+    elapsed = time.perf_counter() - start
+    found = int((roots[pairs[:, 0]] == roots[pairs[:, 1]]).sum())
+    result = {
+        'images': images, 'max_distance': max_distance, 'blocks': len(masks), 'tables': len(tables),
+        'seconds': elapsed, 'pairs_compared': compared, 'all_pairs': images * (images - 1) // 2,
+        'planted_pairs': len(pairs), 'planted_found': found, 'popcount': 'bitwise_count' if hasattr(np, 'bitwise_count') else 'swar',
+    }
+    print(f"[BENCH] dedup {images} hashes, max_distance={max_distance}: {elapsed:.2f}s, {len(tables)} tables of "
+          f"{len(masks)} blocks, {compared} pairs compared ({compared / max(1, result['all_pairs']):.2e} of all), "
+          f"planted pairs found {found}/{len(pairs)}")
+    return result
+
+
+def dedup_dataset(
+    kind: str,
+    root: str,
+    labels_csv: Optional[str] = None,
+    max_distance: int = 6,
+    val_split: float = 0.1,
+    workers: int = 8,
+    refresh_index: bool = False,
+) -> Dict[str, Any]:
+    index = load_dataset_index(kind, root, labels_csv, refresh=refresh_index)
+    split_col, dhash_col, group_col = (INDEX_COLUMNS.index(c) for c in ('split', 'dhash', 'group'))
+    start = time.perf_counter()
+    hashed = hash_missing(index, workers)
+    hash_s = time.perf_counter() - start
+
+    rows = [r for r in index.rows if r[dhash_col] is not None]
+    hashes = np.array([int(r[dhash_col], 16) for r in rows], dtype=np.uint64)
+    start = time.perf_counter()
+    roots, compared = near_duplicate_clusters(hashes, max_distance)
+    search_s = time.perf_counter() - start
+    by_root: Dict[int, List[List[Any]]] = {}
+    for r, root_id in zip(rows, roots):
+        by_root.setdefault(int(root_id), []).append(r)
+    clusters = [members for members in by_root.values() if len(members) > 1]
+
+    for r in index.rows:
+        r[group_col] = None
+    straddling = leaked = 0
+    for members in clusters:
+        members.sort(key=lambda r: (-r[2] * r[3], -r[4], r[0]))  # best copy first: pixels, bytes, path
+        for r in members:
+            r[group_col] = members[0][0]
+        sides = [r[split_col] for r in members]
+        side = next((s for s in sides if s is not None), None)  # the kept copy's, if it has one
+        if 'train' in sides and 'val' in sides:
+            straddling += 1
+            leaked += sum(s is not None and s != side for s in sides)
+        for r in members:
+            r[split_col] = side
+    index.save()
+    train_idx, val_idx = index.assign_split(val_split)
+
+    keep = {id(r) for r in rows}
+    conflicts = []
+    for members in clusters:
+        labels = sorted({r[1] for r in members}, key=str)
+        if len(labels) > 1:
+            conflicts.append(members[0][0])
+        for r in members:
+            keep.discard(id(r))
+        for label in labels:
+            keep.add(id(next(r for r in members if r[1] == label)))
+    stem = index.path[:-len('.index.json')]
+    manifest_path = stem + '.clean.csv'
+    with open(manifest_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['filename', 'severity'] if kind == 'severity' else ['image_id', 'label'])
+        for r in index.rows:
+            if id(r) in keep:
+                writer.writerow([r[0], r[1]])
+
+    removed = len(rows) - len(keep)
+    report = {
+        'dataset': index.root,
+        'index': index.path,
+        'max_distance': max_distance,
+        'images': len(index.rows),
+        'hashed': hashed,
+        'hash_s': hash_s,
+        'search_s': search_s,
+        'pairs_compared': compared,
+        'exact_duplicates': len(rows) - len({r[6] for r in rows}),
+        'clusters': len(clusters),
+        'clustered_images': sum(len(m) for m in clusters),
+        'removed': removed,
+        'straddling_clusters_fixed': straddling,
+        'leaked_images_fixed': leaked,
+        'label_conflicts': conflicts,
+        'split': {'train': len(train_idx), 'val': len(val_idx)},
+        'manifest': manifest_path,
+        'groups': [[[r[0], r[1], r[split_col]] for r in members] for members in sorted(clusters, key=len, reverse=True)],
+    }
+    report_path = stem + '.dedup.json'
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Hashed {hashed} images in {hash_s:.1f}s; compared {compared} candidate pairs in {search_s:.1f}s "
+          f"(all pairs would be {len(rows) * (len(rows) - 1) // 2})")
+    print(f"[INFO] {len(clusters)} near-duplicate clusters covering {report['clustered_images']} images "
+          f"({report['exact_duplicates']} exact copies); cleaned manifest keeps {len(keep)}/{len(rows)} -> {manifest_path}")
+    print(f"[INFO] {straddling} clusters straddled train/val ({leaked} leaked images); split is now group-aware: "
+          f"{len(train_idx)} train / {len(val_idx)} val")
+    if conflicts:
+        print(f"[WARN] {len(conflicts)} clusters mix labels (kept one image per label), e.g. {conflicts[:5]}")
+    print(f"[INFO] Dedup report saved: {report_path}")
+    return report
 
 
 # -------------------- IMAGEFOLDER CLASSIFIER --------------------
 
-def split_imagefolder(dataset: datasets.ImageFolder, val_split: float) -> Tuple[Dataset, Dataset]:
-    n_total = len(dataset)
-    n_val = max(1, int(n_total * val_split))
-    n_train = n_total - n_val
-    return random_split(dataset, [n_train, n_val], generator=torch.Generator().manual_seed(SEED))
+def split_imagefolder(dataset: IndexedImageFolder, val_split: float) -> Tuple[Subset, Subset]:
+    train_idx, val_idx = dataset.index.split_indices(val_split)
+    return Subset(dataset, train_idx), Subset(dataset, val_idx)
 
 
 def train_classifier_imagefolder(
@@ -217,98 +1629,67 @@ def train_classifier_imagefolder(
     val_split: float = 0.1,
     freeze_epochs: int = 3,
     num_workers: int = 4,
-):
+    batch_aug: bool = False,
+    profile_trace: Optional[str] = None,
+    progressive_sizes: Optional[List[int]] = None,
+    max_batch_size: int = 256,
+    refresh_index: bool = False,
+    resume: bool = False,
+    patience: int = 0,
+    min_delta: float = 0.0,
+    time_budget: float = 0.0,
+) -> List[Dict[str, Any]]:
     device = get_device()
     os.makedirs(output_dir, exist_ok=True)
 
-    train_tf, val_tf = get_classification_transforms(img_size)
-    full_dataset = datasets.ImageFolder(root=data_dir, transform=train_tf)
+    _, val_tf = get_classification_transforms(img_size)
+    full_dataset = IndexedImageFolder(load_dataset_index('imagefolder', data_dir, refresh=refresh_index, val_split=val_split))
     class_to_idx = full_dataset.class_to_idx
     idx_to_class = {v: k for k, v in class_to_idx.items()}
 
     train_subset, val_subset = split_imagefolder(full_dataset, val_split)
-    val_subset.dataset.transform = val_tf
+    # Separate dataset object so the validation transform does not leak into training
+    val_dataset = copy.copy(full_dataset)
+    val_dataset.transform = val_tf
+    val_subset = Subset(val_dataset, val_subset.indices)
 
-    train_loader = DataLoader(train_subset, batch_size=batch_size, shuffle=True, num_workers=num_workers, pin_memory=True)
-    val_loader = DataLoader(val_subset, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=True)
-
-    model = build_classifier(backbone, num_classes=len(class_to_idx)).to(device)
+    collate_fn = collate_presized if batch_aug else None
 
-    # Warmup: freeze backbone
-    for p in model.parameters():
-        p.requires_grad = False
-    if hasattr(model, 'classifier'):
-        for p in model.classifier.parameters():
-            p.requires_grad = True
+    def build_train_loader(size: int, bs: int):
+        full_dataset.transform, _ = get_classification_transforms(size, batch_aug=batch_aug)
+        loader = make_loader(train_subset, bs, shuffle=True, num_workers=num_workers, collate_fn=collate_fn)
+        return loader, (BatchAugment(size) if batch_aug else None)
 
-    criterion = nn.CrossEntropyLoss()
-    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=lr)
-    scaler = torch.cuda.amp.GradScaler(enabled=torch.cuda.is_available())
+    val_loader = make_loader(val_subset, batch_size, shuffle=False, num_workers=num_workers)
 
-    best_acc = 0.0
+    model = build_classifier(backbone, num_classes=len(class_to_idx)).to(device)
+    ckpt_meta = {'backbone': backbone, 'class_to_idx': class_to_idx, 'img_size': img_size, 'split': full_dataset.index.split_identity()}
     best_path = os.path.join(output_dir, 'best.pth')
-
-    for epoch in range(freeze_epochs):
-        train_one_epoch(model, train_loader, criterion, optimizer, scaler, device, epoch, note='(head-only)')
-        val_acc, val_loss = eval_classifier(model, val_loader, criterion, device)
-        print(f"[WARMUP] Epoch {epoch+1}/{freeze_epochs} - val_acc={val_acc:.4f} val_loss={val_loss:.4f}")
-        if val_acc > best_acc:
-            best_acc = val_acc
-            torch.save({'model_state': model.state_dict(), 'backbone': backbone, 'class_to_idx': class_to_idx, 'img_size': img_size}, best_path)
-
-    # Fine-tune: unfreeze
-    for p in model.parameters():
-        p.requires_grad = True
-    optimizer = optim.AdamW(model.parameters(), lr=lr * 0.1)
-
-    for epoch in range(epochs):
-        train_one_epoch(model, train_loader, criterion, optimizer, scaler, device, epoch)
-        val_acc, val_loss = eval_classifier(model, val_loader, criterion, device)
-        print(f"[FT] Epoch {epoch+1}/{epochs} - val_acc={val_acc:.4f} val_loss={val_loss:.4f}")
-        if val_acc > best_acc:
-            best_acc = val_acc
-            torch.save({'model_state': model.state_dict(), 'backbone': backbone, 'class_to_idx': class_to_idx, 'img_size': img_size}, best_path)
-            print(f"[INFO] Saved new best checkpoint: {best_path}")
-
-    export_dir = os.path.join(output_dir, 'export')
-    os.makedirs(export_dir, exist_ok=True)
-    export_torchscript_classifier(best_path, export_dir)
-    labels_path = os.path.join(export_dir, 'labels.json')
-    with open(labels_path, 'w', encoding='utf-8') as f:
-        json.dump({str(i): idx_to_class[i] for i in range(len(idx_to_class))}, f, ensure_ascii=False, indent=2)
-    print(f"[INFO] Export complete: {export_dir}")
+    plan = progressive_plan(progressive_sizes or [], img_size, batch_size, freeze_epochs + epochs, max_batch_size)
+    profiler = TrainProfiler(profile_trace)
+    _, history = fit_classifier(model, PhasedLoader(plan, build_train_loader), val_loader, device, best_path, ckpt_meta, lr, epochs, freeze_epochs, profiler,
+                                resume=resume, patience=patience, min_delta=min_delta, time_budget=time_budget)
+    profiler.save(os.path.join(output_dir, 'train_profile.json'))
+    export_classifier_bundle(best_path, output_dir, idx_to_class)
+    return history
 
 
 # -------------------- CSV CLASSIFIER (PADDY) --------------------
 
 class ClassifierCSVDataset(Dataset):
-    def __init__(self, images_dir: str, labels_csv: str, img_size: int, label_to_idx: Dict[str, int] = None):
+    def __init__(self, images_dir: str, labels_csv: str, img_size: int, label_to_idx: Dict[str, int] = None, batch_aug: bool = False,
+                 refresh_index: bool = False, val_split: Optional[float] = None):
         self.images_dir = images_dir
-        self.samples: List[Tuple[str, str]] = []
-        with open(labels_csv, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f.readlines() if line.strip()]
-        header = [h.strip() for h in lines[0].split(',')]
-        # Expect columns containing at least image_id and label
-        try:
-            image_idx = header.index('image_id')
-            label_idx = header.index('label')
-        except ValueError:
-            raise ValueError("CSV must contain 'image_id' and 'label' columns.")
-        for row in lines[1:]:
-            parts = [p.strip() for p in row.split(',')]
-            if len(parts) <= max(image_idx, label_idx):
-                continue
-            image_id = parts[image_idx]
-            label = parts[label_idx]
-            self.samples.append((image_id, label))
+        # Paths were resolved (label subfolder or flat) and validated when the index was built
+        self.index = load_dataset_index('csv', images_dir, labels_csv, refresh=refresh_index, val_split=val_split)
+        self.samples: List[Tuple[str, str]] = list(zip(self.index.paths(), self.index.labels()))
         # Build label map if not provided
         if label_to_idx is None:
-            classes = sorted(list({lbl for _, lbl in self.samples}))
-            self.label_to_idx = {c: i for i, c in enumerate(classes)}
+            self.label_to_idx = {c: i for i, c in enumerate(self.index.classes())}
         else:
             self.label_to_idx = label_to_idx
         self.idx_to_label = {v: k for k, v in self.label_to_idx.items()}
-        self.tf_train, self.tf_val = get_classification_transforms(img_size)
+        self.tf_train, self.tf_val = get_classification_transforms(img_size, batch_aug=batch_aug)
         self.use_train_tf = True
 
     def set_train(self, is_train: bool):
@@ -317,32 +1698,25 @@ class ClassifierCSVDataset(Dataset):
     def __len__(self):
         return len(self.samples)
 
+    def image_path(self, idx: int) -> str:
+        return self.samples[idx][0]
+
     def __getitem__(self, idx):
-        image_id, label = self.samples[idx]
-        # Paddy dataset stores images in label subfolders: <images_dir>/<label>/<image_id>
-        img_path = os.path.join(self.images_dir, label, image_id)
-        if not os.path.isfile(img_path):
-            # fallback if images are not nested by label
-            fallback = os.path.join(self.images_dir, image_id)
-            if os.path.isfile(fallback):
-                img_path = fallback
-            else:
-                raise FileNotFoundError(f"Image not found: {img_path} or {fallback}")
+        img_path, label = self.samples[idx]
         img = Image.open(img_path).convert('RGB')
         x = (self.tf_train if self.use_train_tf else self.tf_val)(img)
         y = torch.tensor(self.label_to_idx[label], dtype=torch.long)
         return x, y
 
 
-def split_csv_dataset(ds: ClassifierCSVDataset, val_split: float) -> Tuple[Dataset, Dataset]:
-    n_total = len(ds)
-    n_val = max(1, int(n_total * val_split))
-    n_train = n_total - n_val
-    train_ds, val_ds = random_split(ds, [n_train, n_val], generator=torch.Generator().manual_seed(SEED))
-    # Switch transforms per subset
-    train_ds.dataset.set_train(True)
-    val_ds.dataset.set_train(False)
-    return train_ds, val_ds
+def split_csv_dataset(ds: ClassifierCSVDataset, val_split: float) -> Tuple[Subset, Subset]:
+    train_idx, val_idx = ds.index.split_indices(val_split)
+    # Switch transforms per subset; the val subset gets its own copy of the
+    # dataset so both subsets do not end up sharing the last transform set.
+    ds.set_train(True)
+    val_ds = copy.copy(ds)
+    val_ds.set_train(False)
+    return Subset(ds, train_idx), Subset(val_ds, val_idx)
 
 
 def train_classifier_csv(
@@ -357,100 +1731,67 @@ def train_classifier_csv(
     val_split: float = 0.1,
     freeze_epochs: int = 3,
     num_workers: int = 4,
-):
+    batch_aug: bool = False,
+    profile_trace: Optional[str] = None,
+    progressive_sizes: Optional[List[int]] = None,
+    max_batch_size: int = 256,
+    refresh_index: bool = False,
+    resume: bool = False,
+    patience: int = 0,
+    min_delta: float = 0.0,
+    time_budget: float = 0.0,
+) -> List[Dict[str, Any]]:
     device = get_device()
     os.makedirs(output_dir, exist_ok=True)
 
-    base_ds = ClassifierCSVDataset(images_dir=images_dir, labels_csv=labels_csv, img_size=img_size)
+    base_ds = ClassifierCSVDataset(images_dir=images_dir, labels_csv=labels_csv, img_size=img_size, batch_aug=batch_aug,
+                                   refresh_index=refresh_index, val_split=val_split)
     label_to_idx = base_ds.label_to_idx
     idx_to_class = {v: k for k, v in label_to_idx.items()}
 
     train_ds, val_ds = split_csv_dataset(base_ds, val_split)
 
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True, num_workers=num_workers, pin_memory=True)
-    val_loader = DataLoader(val_ds, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=True)
+    collate_fn = collate_presized if batch_aug else None
 
-    model = build_classifier(backbone, num_classes=len(label_to_idx)).to(device)
+    def build_train_loader(size: int, bs: int):
+        # train_ds wraps base_ds; the val split has its own copy
+        base_ds.tf_train, _ = get_classification_transforms(size, batch_aug=batch_aug)
+        loader = make_loader(train_ds, bs, shuffle=True, num_workers=num_workers, collate_fn=collate_fn)
+        return loader, (BatchAugment(size) if batch_aug else None)
 
-    # Warmup: freeze backbone
-    for p in model.parameters():
-        p.requires_grad = False
-    if hasattr(model, 'classifier'):
-        for p in model.classifier.parameters():
-            p.requires_grad = True
+    val_loader = make_loader(val_ds, batch_size, shuffle=False, num_workers=num_workers)
 
-    criterion = nn.CrossEntropyLoss()
-    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()), lr=lr)
-    scaler = torch.cuda.amp.GradScaler(enabled=torch.cuda.is_available())
-
-    best_acc = 0.0
+    model = build_classifier(backbone, num_classes=len(label_to_idx)).to(device)
+    ckpt_meta = {'backbone': backbone, 'class_to_idx': label_to_idx, 'img_size': img_size, 'split': base_ds.index.split_identity()}
     best_path = os.path.join(output_dir, 'best.pth')
-
-    for epoch in range(freeze_epochs):
-        train_one_epoch(model, train_loader, criterion, optimizer, scaler, device, epoch, note='(head-only)')
-        val_acc, val_loss = eval_classifier(model, val_loader, criterion, device)
-        print(f"[WARMUP] Epoch {epoch+1}/{freeze_epochs} - val_acc={val_acc:.4f} val_loss={val_loss:.4f}")
-        if val_acc > best_acc:
-            best_acc = val_acc
-            torch.save({'model_state': model.state_dict(), 'backbone': backbone, 'class_to_idx': label_to_idx, 'img_size': img_size}, best_path)
-
-    for p in model.parameters():
-        p.requires_grad = True
-    optimizer = optim.AdamW(model.parameters(), lr=lr * 0.1)
-
-    for epoch in range(epochs):
-        train_one_epoch(model, train_loader, criterion, optimizer, scaler, device, epoch)
-        val_acc, val_loss = eval_classifier(model, val_loader, criterion, device)
-        print(f"[FT] Epoch {epoch+1}/{epochs} - val_acc={val_acc:.4f} val_loss={val_loss:.4f}")
-        if val_acc > best_acc:
-            best_acc = val_acc
-            torch.save({'model_state': model.state_dict(), 'backbone': backbone, 'class_to_idx': label_to_idx, 'img_size': img_size}, best_path)
-            print(f"[INFO] Saved new best checkpoint: {best_path}")
-
-    export_dir = os.path.join(output_dir, 'export')
-    os.makedirs(export_dir, exist_ok=True)
-    export_torchscript_classifier(best_path, export_dir)
-    labels_path = os.path.join(export_dir, 'labels.json')
-    with open(labels_path, 'w', encoding='utf-8') as f:
-        json.dump({str(i): idx_to_class[i] for i in range(len(idx_to_class))}, f, ensure_ascii=False, indent=2)
-    print(f"[INFO] Export complete: {export_dir}")
+    plan = progressive_plan(progressive_sizes or [], img_size, batch_size, freeze_epochs + epochs, max_batch_size)
+    profiler = TrainProfiler(profile_trace)
+    _, history = fit_classifier(model, PhasedLoader(plan, build_train_loader), val_loader, device, best_path, ckpt_meta, lr, epochs, freeze_epochs, profiler,
+                                resume=resume, patience=patience, min_delta=min_delta, time_budget=time_budget)
+    profiler.save(os.path.join(output_dir, 'train_profile.json'))
+    export_classifier_bundle(best_path, output_dir, idx_to_class)
+    return history
 
 
 # -------------------- SEVERITY REGRESSION --------------------
 
 class SeverityDataset(Dataset):
-    def __init__(self, images_dir: str, labels_csv: str, img_size: int):
+    def __init__(self, images_dir: str, labels_csv: str, img_size: int, refresh_index: bool = False, val_split: Optional[float] = None):
         self.images_dir = images_dir
-        self.samples: List[Tuple[str, float]] = []
-        with open(labels_csv, 'r', encoding='utf-8') as f:
-            lines = [line.strip() for line in f.readlines() if line.strip()]
-        header = [h.strip() for h in lines[0].split(',')]
-        try:
-            file_idx = header.index('filename')
-            sev_idx = header.index('severity')
-        except ValueError:
-            # fallback: assume 2 columns filename,severity
-            file_idx, sev_idx = 0, 1
-        for row in lines[1:]:
-            parts = [p.strip() for p in row.split(',')]
-            if len(parts) <= max(file_idx, sev_idx):
-                continue
-            fname = parts[file_idx]
-            sev = float(parts[sev_idx])
-            self.samples.append((fname, sev))
+        self.index = load_dataset_index('severity', images_dir, labels_csv, refresh=refresh_index, val_split=val_split)
+        self.samples: List[Tuple[str, float]] = list(zip(self.index.paths(), self.index.labels()))
         self.tf = transforms.Compose([
-            transforms.Resize(int(img_size * 1.15)),
+            transforms.Resize(int(img_size * RESIZE_RATIO)),
             transforms.CenterCrop(img_size),
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+            transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD)
         ])
 
     def __len__(self):
         return len(self.samples)
 
     def __getitem__(self, idx):
-        fname, sev = self.samples[idx]
-        img_path = os.path.join(self.images_dir, fname)
+        img_path, sev = self.samples[idx]
         img = Image.open(img_path).convert('RGB')
         x = self.tf(img)
         y = torch.tensor([sev], dtype=torch.float32)
@@ -468,97 +1809,1342 @@ def train_severity_regression(
     lr: float = 1e-3,
     val_split: float = 0.1,
     num_workers: int = 4,
+    profile_trace: Optional[str] = None,
+    refresh_index: bool = False,
+    resume: bool = False,
+    patience: int = 0,
+    min_delta: float = 0.0,
+    time_budget: float = 0.0,
 ):
     device = get_device()
     os.makedirs(output_dir, exist_ok=True)
 
-    full_ds = SeverityDataset(images_dir, labels_csv, img_size)
-    n_total = len(full_ds)
-    n_val = max(1, int(n_total * val_split))
-    n_train = n_total - n_val
-    train_ds, val_ds = random_split(full_ds, [n_train, n_val], generator=torch.Generator().manual_seed(SEED))
+    full_ds = SeverityDataset(images_dir, labels_csv, img_size, refresh_index=refresh_index, val_split=val_split)
+    train_idx, val_idx = full_ds.index.split_indices(val_split)
+    train_ds, val_ds = Subset(full_ds, train_idx), Subset(full_ds, val_idx)
 
-    train_loader = DataLoader(train_ds, batch_size=batch_size, shuffle=True, num_workers=num_workers, pin_memory=True)
-    val_loader = DataLoader(val_ds, batch_size=batch_size, shuffle=False, num_workers=num_workers, pin_memory=True)
+    train_loader = make_loader(train_ds, batch_size, shuffle=True, num_workers=num_workers)
+    val_loader = make_loader(val_ds, batch_size, shuffle=False, num_workers=num_workers)
 
     model = build_regression_model(backbone).to(device)
+    train_model = wrap_ddp(model)
     optimizer = optim.AdamW(model.parameters(), lr=lr)
     scaler = torch.cuda.amp.GradScaler(enabled=torch.cuda.is_available())
 
     best_mae = float('inf')
     best_path = os.path.join(output_dir, 'best_regression.pth')
-
-    for epoch in range(epochs):
-        train_one_epoch(model, train_loader, None, optimizer, scaler, device, epoch)
+    last_path = os.path.join(output_dir, 'last_regression.pth')
+    profiler = TrainProfiler(profile_trace)
+    stopper = EarlyStopping(patience, mode='min', min_delta=min_delta)
+    budget = TimeBudget(time_budget)
+    start_epoch = 0
+
+    state = load_training_state(last_path) if resume else None
+    if state is not None:
+        model.load_state_dict(state['model_state'])
+        optimizer.load_state_dict(state['optimizer_state'])
+        scaler.load_state_dict(state['scaler_state'])
+        stopper.load_state_dict(state['early_stopping'])
+        best_mae, start_epoch = state['best_mae'], state['epoch']
+
+    for epoch in range(start_epoch, epochs):
+        set_sampler_epoch(train_loader, epoch)
+        train_one_epoch(train_model, train_loader, None, optimizer, scaler, device, epoch, profiler=profiler)
+        start = time.perf_counter()
         mae, mse = eval_regression(model, val_loader, device)
-        print(f"[REG] Epoch {epoch+1}/{epochs} - val_mae={mae:.2f} val_mse={mse:.2f}")
+        profiler.add('eval_s', time.perf_counter() - start)
+        log(f"[REG] Epoch {epoch+1}/{epochs} - val_mae={mae:.2f} val_mse={mse:.2f}")
         if mae < best_mae:
             best_mae = mae
-            torch.save({'model_state': model.state_dict(), 'backbone': backbone, 'img_size': img_size}, best_path)
-            print(f"[INFO] Saved new best regression checkpoint: {best_path}")
+            if is_main_process():
+                save_checkpoint({'model_state': model.state_dict(), 'backbone': backbone, 'img_size': img_size,
+                                 'split': full_ds.index.split_identity()}, best_path, profiler)
+                print(f"[INFO] Saved new best regression checkpoint: {best_path}")
+        stop = stopper.step(mae)
+        save_training_state(last_path, {
+            'model_state': model.state_dict(), 'optimizer_state': optimizer.state_dict(), 'scaler_state': scaler.state_dict(),
+            'epoch': epoch + 1, 'best_mae': best_mae, 'early_stopping': stopper.state_dict(),
+            'backbone': backbone, 'img_size': img_size,
+        }, profiler)
+        budget.epoch_done()
+        if stop:
+            log(f"[INFO] Early stopping: val_mae has not improved for {patience} epochs (best {best_mae:.2f})")
+            break
+        if epoch + 1 < epochs and budget.exhausted():
+            log(f"[INFO] Time budget of {time_budget:.0f}s reached after epoch {epoch+1}/{epochs}; exporting best (val_mae={best_mae:.2f})")
+            break
+
+    profiler.save(os.path.join(output_dir, 'train_profile.json'))
+    barrier()
+    if is_main_process():
+        export_dir = os.path.join(output_dir, 'export')
+        os.makedirs(export_dir, exist_ok=True)
+        export_torchscript_regression(best_path, export_dir)
+
+
+# -------------------- INCREMENTAL FINE-TUNING --------------------
+# Expert corrections from the review queue: fine-tune an existing best.pth on the
+# newly labeled images plus a class-balanced replay sample of the original
+# training split (so old classes are not forgotten), growing the label map when
+# a correction introduces a new class.
+
+class ImageListDataset(Dataset):
+    def __init__(self, samples: List[Tuple[str, int]], transform):
+        self.samples = samples
+        self.transform = transform
 
-    export_dir = os.path.join(output_dir, 'export')
-    os.makedirs(export_dir, exist_ok=True)
-    export_torchscript_regression(best_path, export_dir)
+    def __len__(self):
+        return len(self.samples)
+
+    def __getitem__(self, idx):
+        path, target = self.samples[idx]
+        img = Image.open(path).convert('RGB')
+        return self.transform(img), torch.tensor(target, dtype=torch.long)
+
+
+def load_corrections(manifest: str, image_dir: str, workers: int = 8) -> List[Tuple[str, str]]:
+    """(image path, label) from a CSV with image,label columns or a JSONL export of
+    review-queue records (image / imageUrl, label / correctLabel / expertLabel).
+    Data URIs are decoded into image_dir; relative paths resolve against the manifest.
+    Rows whose image is missing or does not fully decode are skipped and reported."""
+    root = os.path.dirname(os.path.abspath(manifest))
+    if manifest.endswith('.csv'):
+        with open(manifest, 'r', encoding='utf-8', newline='') as f:
+            records = list(csv.DictReader(f))
+    else:
+        with open(manifest, 'r', encoding='utf-8') as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    rows: List[Tuple[int, str, str]] = []
+    invalid: Dict[str, str] = {}
+    for i, rec in enumerate(records):
+        image = rec.get('image') or rec.get('imageUrl')
+        label = rec.get('label') or rec.get('correctLabel') or rec.get('expertLabel')
+        if not image or not label:
+            print(f"[WARN] Skipping manifest row {i + 1}: needs an image and a label")
+            continue
+        if image.startswith('data:'):
+            os.makedirs(image_dir, exist_ok=True)
+            try:
+                data = base64.b64decode(image.split(',', 1)[1])
+                # Row + content: re-labelled copies of one analysis must not share a file
+                path = os.path.join(image_dir, f"{i:06d}_{hashlib.sha1(data).hexdigest()[:16]}.png")
+                Image.open(BytesIO(data)).convert('RGB').save(path)
+            except Exception as e:
+                invalid[f"row {i + 1} (data URI)"] = f"{type(e).__name__}: {e}"
+                continue
+            image = path
+        elif not os.path.isabs(image):
+            image = os.path.join(root, image)
+        rows.append((i, image, label.strip()))
+
+    def probe(path: str) -> Optional[str]:
+        try:
+            probe_image(path)
+            return None
+        except Exception as e:  # missing, unreadable or undecodable
+            return f"{type(e).__name__}: {e}"
+
+    # Check every image up front, as the dataset index does, instead of failing mid-epoch
+    out: List[Tuple[str, str]] = []
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for (i, image, label), err in zip(rows, pool.map(probe, [image for _, image, _ in rows])):
+            if err:
+                invalid[f"row {i + 1} ({image})"] = err
+            else:
+                out.append((image, label))
+    if invalid:
+        print(f"[WARN] {len(invalid)} of {len(records)} manifest rows have a missing or undecodable image")
+    for row, err in list(invalid.items())[:10]:
+        print(f"[WARN] Skipping manifest {row}: {err}")
+    return out
+
+
+def recorded_splits(ckpt: Dict[str, Any], data_dir: Optional[str], images_dir: Optional[str],
+                    labels_csv: Optional[str]) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """(path, label) train/val lists of the split the checkpoint was trained on, read from
+    the index read-only; fails if the given dataset or its index no longer match it."""
+    if data_dir:
+        index_path = index_path_for('imagefolder', data_dir)
+    elif images_dir and labels_csv:
+        index_path = index_path_for('csv', images_dir, labels_csv)
+    else:
+        raise ValueError("Pass --data_dir (ImageFolder) or --images_dir/--labels_csv for the original data.")
+    index, train_idx, val_idx = load_recorded_split(ckpt.get('split'), index_path)
+    samples = list(zip(index.paths(), index.labels()))
+    return [samples[i] for i in train_idx], [samples[i] for i in val_idx]
+
+
+def replay_sample(samples: List[Tuple[str, str]], size: int, rng: random.Random) -> List[Tuple[str, str]]:
+    """Class-balanced sample: round-robin over shuffled per-class lists."""
+    by_label: Dict[str, List[Tuple[str, str]]] = {}
+    for s in samples:
+        by_label.setdefault(s[1], []).append(s)
+    pools = []
+    for label in sorted(by_label):
+        rng.shuffle(by_label[label])
+        pools.append(by_label[label])
+    size = min(size, len(samples))
+    out: List[Tuple[str, str]] = []
+    i = 0
+    while len(out) < size:
+        for pool in pools:
+            if i < len(pool) and len(out) < size:
+                out.append(pool[i])
+        i += 1
+    return out
+
+
+def expand_classifier_head(model: nn.Module, num_classes: int):
+    """Grow the final Linear to num_classes, keeping the trained rows."""
+    head = model.classifier[1]
+    if head.out_features == num_classes:
+        return
+    new_head = nn.Linear(head.in_features, num_classes)
+    with torch.no_grad():
+        new_head.weight[:head.out_features] = head.weight
+        new_head.bias[:head.out_features] = head.bias
+        new_head.bias[head.out_features:] = head.bias.mean()
+    model.classifier[1] = new_head.to(head.weight.device)
+
+
+def top1_accuracy(model: nn.Module, loader: DataLoader, device: torch.device) -> float:
+    model.eval()
+    correct = torch.zeros((), dtype=torch.long, device=device)
+    total = 0
+    with torch.no_grad():
+        for images, targets in loader:
+            targets = targets.to(device, non_blocking=True)
+            correct += (model(images.to(device, non_blocking=True)).argmax(1) == targets).sum()
+            total += targets.size(0)
+    return correct.item() / max(1, total)
+
+
+def train_incremental(
+    ckpt_path: str,
+    manifest: str,
+    output_dir: str,
+    data_dir: Optional[str] = None,
+    images_dir: Optional[str] = None,
+    labels_csv: Optional[str] = None,
+    replay_per_new: float = 4.0,
+    new_val_split: float = 0.2,
+    batch_size: int = 32,
+    epochs: int = 3,
+    freeze_epochs: int = 1,
+    lr: float = 1e-3,
+    num_workers: int = 4,
+    max_old_val_drop: float = 0.01,
+    force: bool = False,
+) -> Dict[str, Any]:
+    device = get_device()
+    os.makedirs(output_dir, exist_ok=True)
+    start_time = time.perf_counter()
+    rng = random.Random(SEED)
+
+    ckpt = torch.load(ckpt_path, map_location='cpu')
+    backbone, img_size = ckpt['backbone'], ckpt.get('img_size', 256)
+    old_classes = dict(ckpt['class_to_idx'])
+    class_to_idx = dict(old_classes)
+
+    corrections = load_corrections(manifest, os.path.join(output_dir, 'corrections'))
+    if not corrections:
+        raise ValueError(f"No usable rows in manifest: {manifest}")
+    added = sorted({label for _, label in corrections} - set(class_to_idx))
+    for label in added:
+        class_to_idx[label] = len(class_to_idx)
+    if added:
+        print(f"[INFO] New classes: {added}")
+    rng.shuffle(corrections)
+    n_new_val = int(len(corrections) * new_val_split)
+    new_val, new_train = corrections[:n_new_val], corrections[n_new_val:]
+
+    # The previous model's own split: any other "old val" could contain its training images
+    old_train, old_val = recorded_splits(ckpt, data_dir, images_dir, labels_csv)
+    unknown = {label for _, label in old_train + old_val} - set(old_classes)
+    if unknown:
+        raise ValueError(f"Original data has labels the checkpoint does not know: {sorted(unknown)}")
+    replay = replay_sample(old_train, int(len(new_train) * replay_per_new), rng)
+    print(f"[INFO] Incremental: {len(new_train)} corrections (+{n_new_val} held out), {len(replay)} replay samples, {len(old_val)} old val")
+
+    train_tf, val_tf = get_classification_transforms(img_size)
+    encode = lambda items: [(path, class_to_idx[label]) for path, label in items]
+    train_set = ImageListDataset(encode(new_train + replay), train_tf)
+    old_val_loader = make_loader(ImageListDataset(encode(old_val), val_tf), batch_size, shuffle=False, num_workers=num_workers)
+    new_val_loader = make_loader(ImageListDataset(encode(new_val), val_tf), batch_size, shuffle=False, num_workers=num_workers) if new_val else None
+    # Checkpoint selection on old val + held-out corrections so neither side is ignored
+    val_loader = make_loader(ImageListDataset(encode(old_val + new_val), val_tf), batch_size, shuffle=False, num_workers=num_workers)
+
+    previous = build_classifier(backbone, num_classes=len(old_classes), pretrained=False)
+    previous.load_state_dict(ckpt['model_state'])
+    previous.to(device)
+    report: Dict[str, Any] = {'checkpoint': ckpt_path, 'manifest': manifest, 'new_classes': added,
+                              'corrections': len(new_train), 'held_out': n_new_val, 'replay': len(replay)}
+    report['previous_old_val_acc'] = top1_accuracy(previous, old_val_loader, device)
+    if new_val_loader is not None:
+        report['previous_new_val_acc'] = top1_accuracy(previous, new_val_loader, device)
+
+    model = previous
+    expand_classifier_head(model, len(class_to_idx))
+    build = lambda size, bs: (make_loader(train_set, bs, shuffle=True, num_workers=num_workers), None)
+    best_path = os.path.join(output_dir, 'best.pth')
+    ckpt_meta = {'backbone': backbone, 'class_to_idx': class_to_idx, 'img_size': img_size, 'split': ckpt['split']}
+    fit_classifier(model, PhasedLoader([(img_size, batch_size)], build), val_loader, device, best_path, ckpt_meta, lr, epochs, freeze_epochs)
+
+    model.load_state_dict(torch.load(best_path, map_location='cpu')['model_state'])
+    report['new_old_val_acc'] = top1_accuracy(model, old_val_loader, device)
+    if new_val_loader is not None:
+        report['new_new_val_acc'] = top1_accuracy(model, new_val_loader, device)
+    report['elapsed_s'] = time.perf_counter() - start_time
+
+    delta = report['new_old_val_acc'] - report['previous_old_val_acc']
+    print(f"[INC] Old val acc: previous={report['previous_old_val_acc']:.4f} new={report['new_old_val_acc']:.4f} ({delta:+.4f})")
+    if new_val_loader is not None:
+        print(f"[INC] Held-out corrections acc: previous={report['previous_new_val_acc']:.4f} new={report['new_new_val_acc']:.4f}")
+    # A correction batch that costs accuracy on the original classes must not replace the export
+    report['exported'] = force or delta >= -max_old_val_drop
+    if report['exported']:
+        export_classifier_bundle(best_path, output_dir, {v: k for k, v in class_to_idx.items()})
+    else:
+        print(f"[WARN] Old val acc dropped by {-delta:.4f} > {max_old_val_drop}; not exporting (best.pth kept, --force to export anyway)")
+    path = os.path.join(output_dir, 'incremental_report.json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"[INFO] Incremental report saved: {path} ({report['elapsed_s']:.0f}s)")
+    return report
 
 
 # -------------------- GRAD-CAM --------------------
+# The batched engine lives in gradcam_engine.py (shared with infer_server.py).
+
+def load_gradcam_model(ckpt_path: str) -> Tuple[nn.Module, Dict[str, int], int]:
+    ckpt = torch.load(ckpt_path, map_location='cpu')
+    model = build_classifier(ckpt['backbone'], num_classes=len(ckpt['class_to_idx']), pretrained=False)
+    model.load_state_dict(ckpt['model_state'])
+    model.eval()
+    return model.to(get_device()), ckpt['class_to_idx'], ckpt.get('img_size', 256)
+
+
+def resolve_target_labels(target_labels: Optional[List[str]], class_to_idx: Dict[str, int]) -> List[int]:
+    unknown = [t for t in target_labels or [] if t not in class_to_idx]
+    if unknown:
+        raise ValueError(f"target_label {unknown} not in class_to_idx. Available: {list(class_to_idx.keys())}")
+    return [class_to_idx[t] for t in target_labels or []]
+
+
+def gradcam_batch(
+    ckpt_path: str,
+    image_paths: List[str],
+    target_labels: Optional[List[str]] = None,
+    alpha: float = 0.45,
+) -> List[Dict[str, Any]]:
+    """Heatmaps for every image x target label (top-1 prediction when no labels are given)."""
+    if GradCAM is None:
+        raise RuntimeError("pytorch-grad-cam not installed. Please install it to use Grad-CAM.")
+    model, class_to_idx, img_size = load_gradcam_model(ckpt_path)
+    idx_to_class = {v: k for k, v in class_to_idx.items()}
+    wanted = resolve_target_labels(target_labels, class_to_idx)
+    _, val_tf = get_classification_transforms(img_size)
+    pils = [Image.open(p).convert('RGB') for p in image_paths]
+    images = torch.stack([val_tf(pil) for pil in pils]).to(module_device(model))
+    logits, targets, cams = batched_gradcam(model, gradcam_target_layer(model), images, [wanted] * len(pils))
+    probs = torch.softmax(logits.float(), dim=1).cpu()
+    return [{
+        'image': path,
+        'predicted': idx_to_class[int(probs[n].argmax())],
+        'heatmaps': [{'label': idx_to_class[t], 'prob': float(probs[n, t]), 'dataUri': gradcam_overlay_uri(pils[n], cam, img_size, RESIZE_RATIO, alpha)}
+                     for t, cam in zip(targets[n], cams[n])],
+    } for n, path in enumerate(image_paths)]
+
 
 def gradcam_data_uri(
     ckpt_path: str,
     image_path: str,
-    target_label: str,
+    target_label: Optional[str] = None,
     alpha: float = 0.45,
 ) -> str:
+    result = gradcam_batch(ckpt_path, [image_path], [target_label] if target_label else None, alpha)
+    return result[0]['heatmaps'][0]['dataUri']
+
+
+def benchmark_gradcam(ckpt_path: str, image_paths: List[str], target_labels: Optional[List[str]] = None, repeats: int = 3) -> Dict[str, Any]:
+    """ms per heatmap: pytorch_grad_cam called once per (image, target) vs the batched engine."""
     if GradCAM is None:
         raise RuntimeError("pytorch-grad-cam not installed. Please install it to use Grad-CAM.")
+    from pytorch_grad_cam.utils.model_targets import ClassifierOutputTarget
+    model, class_to_idx, img_size = load_gradcam_model(ckpt_path)
+    wanted = resolve_target_labels(target_labels, class_to_idx) or list(range(min(3, len(class_to_idx))))
+    _, val_tf = get_classification_transforms(img_size)
+    images = torch.stack([val_tf(Image.open(p).convert('RGB')) for p in image_paths]).to(module_device(model))
+    layer = gradcam_target_layer(model)
+    n_maps = len(image_paths) * len(wanted)
+
+    def one_at_a_time():
+        out = []
+        with GradCAM(model=model, target_layers=[layer]) as cam:
+            for n in range(images.size(0)):
+                out.append([cam(input_tensor=images[n:n + 1], targets=[ClassifierOutputTarget(t)])[0] for t in wanted])
+        return out
+
+    def batched():
+        return batched_gradcam(model, layer, images, [wanted] * images.size(0))[2]
+
+    report = {'images': len(image_paths), 'targets': len(wanted), 'heatmaps': n_maps}
+    results = {}
+    for name, fn in (('one_at_a_time', one_at_a_time), ('batched', batched)):
+        fn()  # warmup
+        start = time.perf_counter()
+        for _ in range(repeats):
+            results[name] = fn()
+        report[f"{name}_ms_per_heatmap"] = (time.perf_counter() - start) * 1000.0 / (repeats * n_maps)
+    report['speedup'] = report['one_at_a_time_ms_per_heatmap'] / max(report['batched_ms_per_heatmap'], 1e-9)
+    report['max_abs_diff'] = float(max(np.abs(a - b).max() for ra, rb in zip(results['one_at_a_time'], results['batched']) for a, b in zip(ra, rb)))
+    print(f"[INFO] Grad-CAM {n_maps} heatmaps ({len(image_paths)} images x {len(wanted)} targets): "
+          f"one-at-a-time {report['one_at_a_time_ms_per_heatmap']:.1f} ms/heatmap, batched {report['batched_ms_per_heatmap']:.1f} ms/heatmap "
+          f"({report['speedup']:.1f}x), max heatmap difference {report['max_abs_diff']:.3f}")
+    return report
+
+
+# -------------------- SCALING BENCHMARK --------------------
+
+def _scaling_worker(rank: int, world_size: int, port: int, cfg: Dict[str, Any], results):
+    os.environ.update({
+        'MASTER_ADDR': '127.0.0.1', 'MASTER_PORT': str(port),
+        'RANK': str(rank), 'WORLD_SIZE': str(world_size),
+        'LOCAL_RANK': str(rank), 'LOCAL_WORLD_SIZE': str(world_size),
+    })
+    init_distributed('gloo')
+    train_tf, _ = get_classification_transforms(cfg['img_size'])
+    ds = datasets.ImageFolder(root=cfg['data_dir'], transform=train_tf)
+    loader = make_loader(ds, cfg['batch_size'], shuffle=True, num_workers=cfg['num_workers'])
+    model = wrap_ddp(build_classifier(cfg['backbone'], num_classes=len(ds.classes), pretrained=False))
+    optimizer = optim.AdamW(model.parameters(), lr=1e-3)
+    criterion = nn.CrossEntropyLoss()
+    model.train()
 
-    ckpt = torch.load(ckpt_path, map_location='cpu')
-    backbone = ckpt['backbone']
-    class_to_idx = ckpt['class_to_idx']
+    step, n, start = 0, 0, time.perf_counter()
+    while step <= cfg['steps']:
+        if isinstance(loader.sampler, DistributedSampler):
+            loader.sampler.set_epoch(step)
+        for images, targets in loader:
+            if step == 1:
+                start = time.perf_counter()  # step 0 is warmup
+                n = 0
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(model(images), targets)
+            loss.backward()
+            optimizer.step()
+            n += images.size(0)
+            step += 1
+            if step > cfg['steps']:
+                break
+    elapsed = time.perf_counter() - start
+    (total,) = reduce_sums(n)
+    if is_main_process():
+        results.put(total / max(elapsed, 1e-9))
+    cleanup_distributed()
+
+
+def benchmark_scaling(
+    data_dir: str,
+    backbone: str = 'mobilenet_v2',
+    img_size: int = 256,
+    batch_size: int = 32,
+    max_procs: int = 4,
+    steps: int = 20,
+    num_workers: int = 2,
+    output: str = 'ml/runs/dist_scaling.json',
+) -> List[Dict[str, float]]:
+    """Train for a fixed number of steps with 1..max_procs gloo processes on this
+    host and report global samples/s and efficiency = tput(N) / (N * tput(1))."""
+    import socket
+    cfg = {'data_dir': data_dir, 'backbone': backbone, 'img_size': img_size,
+           'batch_size': batch_size, 'steps': steps, 'num_workers': num_workers}
+    ctx = mp.get_context('spawn')
+    rows: List[Dict[str, float]] = []
+    for world_size in range(1, max_procs + 1):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        results = ctx.SimpleQueue()
+        mp.spawn(_scaling_worker, args=(world_size, port, cfg, results), nprocs=world_size, join=True)
+        throughput = results.get()
+        base = rows[0]['samples_per_s'] if rows else throughput
+        rows.append({
+            'processes': world_size,
+            'samples_per_s': throughput,
+            'speedup': throughput / base,
+            'efficiency': throughput / (world_size * base),
+        })
+        print(f"[SCALE] procs={world_size} {throughput:.1f} samples/s speedup={rows[-1]['speedup']:.2f}x efficiency={rows[-1]['efficiency']:.2f}")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'config': cfg, 'cpu_count': os.cpu_count(), 'results': rows}, f, indent=2)
+    print(f"[INFO] Scaling report saved: {output}")
+    return rows
+
+
+# -------------------- SWEEP --------------------
+# Hyperparameter search over a JSON spec, e.g.
+#   {"search": "grid", "params": {"backbone": ["mobilenet_v2", "efficientnet_b0"], "lr": [1e-3, 3e-4]}}
+#   {"search": "random", "trials": 16, "params": {"lr": {"loguniform": [1e-4, 3e-3]}, "img_size": [192, 224, 256]}}
+# The dataset is decoded once into a uint8 tensor file that every trial memory-maps,
+# trials run in a spawn process pool and successive halving prunes the weak ones.
+
+SWEEP_DEFAULTS = {'backbone': 'mobilenet_v2', 'lr': 1e-3, 'freeze_epochs': 3, 'img_size': 256, 'batch_size': 32}
+
+
+def sample_param(rng: random.Random, spec: Any) -> Any:
+    if isinstance(spec, list):
+        return rng.choice(spec)
+    if isinstance(spec, dict) and len(spec) == 1:
+        kind, (low, high) = next(iter(spec.items()))
+        if kind == 'loguniform':
+            return math.exp(rng.uniform(math.log(low), math.log(high)))
+        if kind == 'uniform':
+            return rng.uniform(low, high)
+        if kind == 'int':
+            return rng.randint(low, high)
+    return spec
+
+
+def sweep_trials(spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    params = spec.get('params', {})
+    unknown = set(params) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unsupported sweep params: {sorted(unknown)}. Available: {list(SWEEP_DEFAULTS)}")
+    search = spec.get('search', 'grid')
+    if search == 'grid':
+        if any(isinstance(v, dict) for v in params.values()):
+            raise ValueError("Grid search takes lists of values; use \"search\": \"random\" for distributions.")
+        keys = list(params)
+        values = [v if isinstance(v, list) else [v] for v in params.values()]
+        combos = [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    elif search == 'random':
+        rng = random.Random(spec.get('seed', SEED))
+        combos = [{k: sample_param(rng, v) for k, v in params.items()} for _ in range(int(spec.get('trials', 10)))]
+    else:
+        raise ValueError(f"Unknown search '{search}', expected 'grid' or 'random'")
+    return [{'id': i, 'params': {**SWEEP_DEFAULTS, **combo}} for i, combo in enumerate(combos)]
+
+
+def halving_rungs(min_epochs: int, max_epochs: int, eta: int) -> List[int]:
+    """Epoch budgets at which trials are compared: min_epochs * eta^k, ending at max_epochs."""
+    rungs = []
+    epochs = max(1, min_epochs)
+    while epochs < max_epochs:
+        rungs.append(epochs)
+        epochs *= eta
+    return rungs + [max_epochs]
+
+
+def decoded_images_path(cache_path: str) -> str:
+    return os.path.splitext(cache_path)[0] + '.uint8'
+
+
+def load_decoded_cache(cache_path: str) -> Dict[str, Any]:
+    """Cache metadata plus 'images', a read-only memory map of the raw uint8 file."""
+    cache = torch.load(cache_path)
+    n_bytes = int(np.prod(cache['shape']))
+    cache['images'] = torch.from_file(decoded_images_path(cache_path), shared=False, size=n_bytes, dtype=torch.uint8).view(cache['shape'])
+    return cache
+
+
+def build_decoded_cache(data_dir: str, size: int, cache_path: str, val_split: float, num_workers: int):
+    """Decode every indexed ImageFolder image once into uint8 squares of `size` (plus the
+    original h/w so crops keep their aspect). Batches are written straight into a
+    preallocated memory-mapped file next to cache_path, which holds the metadata."""
+    ds = IndexedImageFolder(load_dataset_index('imagefolder', data_dir, val_split=val_split), transform=PresizeToUint8(size))
+    train_idx, val_idx = ds.index.split_indices(val_split)
+    split = ds.index.split_identity()
+    shape = [len(ds), 3, size, size]
+    images_path = decoded_images_path(cache_path)
+    if os.path.isfile(cache_path) and os.path.isfile(images_path):
+        cache = torch.load(cache_path)
+        if (cache.get('shape') == shape and os.path.getsize(images_path) == int(np.prod(shape))
+                and cache['samples'] == [p for p, _ in ds.samples] and cache.get('split') == split):
+            print(f"[INFO] Reusing decoded cache: {cache_path}")
+            return
+    loader = DataLoader(ds, batch_size=64, shuffle=False, num_workers=num_workers, collate_fn=collate_presized)
+    tmp_path = f"{images_path}.{os.getpid()}.tmp"
+    images = torch.from_file(tmp_path, shared=True, size=int(np.prod(shape)), dtype=torch.uint8).view(shape)
+    sizes = torch.empty(len(ds), 2)
+    targets = torch.empty(len(ds), dtype=torch.long)
+    start = time.perf_counter()
+    pos = 0
+    for (x, hw), y in loader:
+        images[pos:pos + len(y)] = x
+        sizes[pos:pos + len(y)] = hw
+        targets[pos:pos + len(y)] = y
+        pos += len(y)
+    del images  # unmaps and flushes the file
+    os.replace(tmp_path, images_path)
+    torch.save({
+        'shape': shape, 'sizes': sizes, 'targets': targets,
+        'class_to_idx': ds.class_to_idx, 'samples': [p for p, _ in ds.samples],
+        'train_idx': torch.tensor(train_idx), 'val_idx': torch.tensor(val_idx), 'split': split,
+    }, cache_path)
+    mb = os.path.getsize(images_path) / (1024 * 1024)
+    print(f"[INFO] Decoded {len(ds)} images in {time.perf_counter() - start:.1f}s -> {images_path} ({mb:.0f} MB)")
+
+
+def center_crop_batch(images: torch.Tensor, sizes: torch.Tensor, img_size: int) -> torch.Tensor:
+    """Validation transform (resize shorter side to img_size * RESIZE_RATIO, center
+    crop, normalize) applied to presized uint8 squares in one grid_sample."""
+    x = images.float().div_(255.0)
+    h, w = sizes[:, 0], sizes[:, 1]
+    crop = img_size * torch.minimum(h, w) / int(img_size * RESIZE_RATIO)  # crop side in original pixels
+    theta = torch.zeros(x.size(0), 2, 3, device=x.device)
+    theta[:, 0, 0] = crop / w
+    theta[:, 1, 1] = crop / h
+    grid = F.affine_grid(theta, [x.size(0), 3, img_size, img_size], align_corners=False)
+    x = F.grid_sample(x, grid, mode='bilinear', padding_mode='border', align_corners=False)
+    mean = torch.tensor(IMAGENET_MEAN, device=x.device).view(1, 3, 1, 1)
+    std = torch.tensor(IMAGENET_STD, device=x.device).view(1, 3, 1, 1)
+    return (x - mean) / std
+
+
+def _sweep_trial(trial: Dict[str, Any], cache_path: str, end_epoch: int, threads: int, device_name: str) -> Dict[str, Any]:
+    """Train one trial from its saved state up to end_epoch (runs in a pool worker)."""
+    torch.set_num_threads(threads)
+    device = torch.device(device_name)
+    p = trial['params']
+    cache = load_decoded_cache(cache_path)
+    images, sizes, targets = cache['images'], cache['sizes'], cache['targets']
+    state_path = os.path.join(trial['dir'], 'state.pt')
+    state = torch.load(state_path, map_location='cpu') if os.path.isfile(state_path) else None
+    start_epoch = state['epoch'] if state else 0
+    torch.manual_seed(SEED + trial['id'] * 1000 + start_epoch)
+
+    model = build_classifier(p['backbone'], num_classes=len(cache['class_to_idx']), pretrained=state is None)
+    if state:
+        model.load_state_dict(state['model_state'])
+    model.to(device)
+    criterion = nn.CrossEntropyLoss()
+    augment = BatchAugment(p['img_size'])
+    best_acc = state['best_acc'] if state else 0.0
+    train_s = state['train_s'] if state else 0.0
+    ckpt_meta = {'backbone': p['backbone'], 'class_to_idx': cache['class_to_idx'], 'img_size': p['img_size'], 'split': cache['split']}
+
+    frozen = None
+    optimizer = None
+    for epoch in range(start_epoch, end_epoch):
+        if (epoch < p['freeze_epochs']) != frozen:
+            # Same recipe as fit_classifier: head-only warmup, then everything at lr * 0.1
+            frozen = epoch < p['freeze_epochs']
+            freeze_backbone(model, frozen)
+            optimizer = optim.AdamW(filter(lambda q: q.requires_grad, model.parameters()), lr=p['lr'] if frozen else p['lr'] * 0.1)
+            if state and epoch == start_epoch and state['frozen'] == frozen:
+                optimizer.load_state_dict(state['optimizer_state'])
+        start = time.perf_counter()
+        model.train()
+        order = cache['train_idx'][torch.randperm(len(cache['train_idx']))]
+        for i in range(0, len(order), p['batch_size']):
+            idx = order[i:i + p['batch_size']]
+            x = augment(images[idx].to(device), sizes[idx].to(device))
+            optimizer.zero_grad(set_to_none=True)
+            loss = criterion(model(x), targets[idx].to(device))
+            loss.backward()
+            optimizer.step()
+        train_s += time.perf_counter() - start
+
+        model.eval()
+        correct = torch.zeros((), dtype=torch.long, device=device)
+        with torch.no_grad():
+            for i in range(0, len(cache['val_idx']), 64):
+                idx = cache['val_idx'][i:i + 64]
+                x = center_crop_batch(images[idx].to(device), sizes[idx].to(device), p['img_size'])
+                correct += (model(x).argmax(1) == targets[idx].to(device)).sum()
+        val_acc = correct.item() / max(1, len(cache['val_idx']))
+        if val_acc > best_acc:
+            best_acc = val_acc
+            torch.save({'model_state': model.state_dict(), **ckpt_meta}, os.path.join(trial['dir'], 'best.pth'))
+
+    torch.save({
+        'epoch': end_epoch, 'model_state': model.state_dict(), 'optimizer_state': optimizer.state_dict(),
+        'frozen': frozen, 'best_acc': best_acc, 'train_s': train_s,
+    }, state_path)
+    return {'id': trial['id'], 'epochs': end_epoch, 'best_val_acc': best_acc, 'train_s': train_s}
+
+
+def sweep_rung(trials: List[Dict[str, Any]], cache_path: str, rung: int, threads: int, devices: List[str], workers: int) -> Dict[int, Any]:
+    """Run every trial up to `rung` epochs; maps trial id to its result, or to the
+    exception it failed with so one bad trial does not end the sweep."""
+    outcomes: Dict[int, Any] = {}
+    broken = []
+    ctx = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = [(t, pool.submit(_sweep_trial, t, cache_path, rung, threads, devices[t['id'] % len(devices)])) for t in trials]
+        for t, fut in futures:
+            try:
+                outcomes[t['id']] = fut.result()
+            except BrokenProcessPool:
+                broken.append(t)
+            except Exception as e:
+                outcomes[t['id']] = e
+    # A worker that dies (e.g. OOM-killed) breaks every unfinished future in the
+    # pool; rerun those one process each so only the trial that died fails.
+    for t in broken:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            try:
+                outcomes[t['id']] = pool.submit(_sweep_trial, t, cache_path, rung, threads, devices[t['id'] % len(devices)]).result()
+            except Exception as e:
+                outcomes[t['id']] = e
+    return outcomes
+
+
+def sweep_score(row: Dict[str, Any]) -> float:
+    # Failed trials rank below every finished one (the sweep maximizes val acc)
+    return float('-inf') if row['status'].startswith('failed') else row['best_val_acc']
+
+
+def export_latency_ms(ts_path: str, img_size: int, runs: int = 30) -> float:
+    model = torch.jit.load(ts_path, map_location='cpu').eval()
+    x = torch.randn(1, 3, img_size, img_size)
+    times = []
+    with torch.no_grad():
+        for i in range(runs + 5):
+            start = time.perf_counter()
+            model(x)
+            if i >= 5:  # warmup
+                times.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(times))
+
+
+def run_sweep(
+    data_dir: str,
+    spec_path: str,
+    output_dir: str = 'ml/runs/sweep',
+    min_epochs: int = 1,
+    max_epochs: int = 9,
+    eta: int = 3,
+    val_split: float = 0.1,
+    workers: int = 0,
+    num_workers: int = 4,
+) -> List[Dict[str, Any]]:
+    with open(spec_path, 'r', encoding='utf-8') as f:
+        spec = json.load(f)
+    trials = sweep_trials(spec)
+    os.makedirs(output_dir, exist_ok=True)
+    for t in trials:
+        t['dir'] = os.path.join(output_dir, 'trials', f"trial_{t['id']:03d}")
+        os.makedirs(t['dir'], exist_ok=True)
+        state_path = os.path.join(t['dir'], 'state.pt')
+        if os.path.isfile(state_path):
+            os.remove(state_path)  # fresh sweep; old trial state would be resumed otherwise
+
+    cache_size = int(max(t['params']['img_size'] for t in trials) * RESIZE_RATIO)
+    cache_path = os.path.join(output_dir, f"decoded_{cache_size}.pt")
+    build_decoded_cache(data_dir, cache_size, cache_path, val_split, num_workers)
+
+    cpus = os.cpu_count() or 1
+    if torch.cuda.is_available():
+        devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+        workers = workers or len(devices)
+    else:
+        devices = ['cpu']
+        workers = workers or max(1, min(len(trials), cpus // 2))
+    threads = max(1, cpus // workers)
+    rungs = halving_rungs(min_epochs, max_epochs, eta)
+    print(f"[INFO] Sweep: {len(trials)} trials, rungs at {rungs} epochs, {workers} workers x {threads} threads")
+
+    results = {t['id']: {'id': t['id'], 'params': t['params'], 'status': 'complete', 'epochs': 0, 'best_val_acc': 0.0, 'train_s': 0.0} for t in trials}
+    alive = trials
+    start = time.perf_counter()
+    for r, rung in enumerate(rungs):
+        outcomes = sweep_rung(alive, cache_path, rung, threads, devices, workers)
+        for t in alive:
+            res = outcomes[t['id']]
+            if isinstance(res, Exception):
+                results[t['id']].update({'status': f"failed@{rung}", 'error': f"{type(res).__name__}: {res}"})
+                print(f"[WARN] trial {t['id']:03d} failed at epochs={rung}: {results[t['id']]['error']}")
+                continue
+            results[t['id']].update(res)
+            print(f"[SWEEP] trial {res['id']:03d} epochs={rung} best_val_acc={res['best_val_acc']:.4f} train_s={res['train_s']:.1f}")
+        ran = len(alive)
+        alive = [t for t in alive if not results[t['id']]['status'].startswith('failed')]
+        if not alive:
+            print(f"[WARN] Every remaining trial failed at epochs={rung}; stopping the sweep")
+            break
+        if r == len(rungs) - 1:
+            break
+        alive = sorted(alive, key=lambda t: results[t['id']]['best_val_acc'], reverse=True)
+        keep = min(len(alive), max(1, ran // eta))
+        for t in alive[keep:]:
+            results[t['id']]['status'] = f"pruned@{rung}"
+        print(f"[SWEEP] Rung {r+1}: kept {keep}, pruned {len(alive) - keep}, failed {ran - len(alive)}")
+        alive = alive[:keep]
+    wall = time.perf_counter() - start
+
+    for t in trials:
+        row = results[t['id']]
+        best_path = os.path.join(t['dir'], 'best.pth')
+        row['latency_ms'] = None
+        if os.path.isfile(best_path):
+            export_dir = os.path.join(t['dir'], 'export')
+            os.makedirs(export_dir, exist_ok=True)
+            export_torchscript_classifier(best_path, export_dir)
+            row['export'] = export_dir
+            row['latency_ms'] = export_latency_ms(os.path.join(export_dir, 'model.ts.pt'), t['params']['img_size'])
+
+    board = sorted(results.values(), key=lambda row: (sweep_score(row), row['epochs'], -row['train_s']), reverse=True)
+    with open(os.path.join(output_dir, 'leaderboard.json'), 'w', encoding='utf-8') as f:
+        json.dump({'spec': spec, 'rungs': rungs, 'workers': workers, 'threads_per_trial': threads, 'wall_s': wall, 'trials': board}, f, indent=2)
+    print(f"[SWEEP] Leaderboard ({wall:.1f}s wall):")
+    print(f"  {'trial':>5} {'val_acc':>8} {'train_s':>8} {'lat_ms':>7}  {'status':<10} params")
+    for row in board:
+        lat = f"{row['latency_ms']:.1f}" if row['latency_ms'] is not None else '-'
+        params = ' '.join(f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}" for k, v in row['params'].items())
+        print(f"  {row['id']:>5} {row['best_val_acc']:>8.4f} {row['train_s']:>8.1f} {lat:>7}  {row['status']:<10} {params}")
+    print(f"[INFO] Leaderboard saved: {os.path.join(output_dir, 'leaderboard.json')}")
+    return board
+
+
+# -------------------- LOADER TUNING --------------------
+# `tune` times short training runs over batch size, DataLoader workers, prefetch
+# factor and torch threads (coordinate descent, each trial in a fresh process so
+# its peak memory is its own) and stores the fastest config that fits the memory
+# limit in TUNE_FILE, keyed by host, device, backbone and img_size. Training tasks
+# use it for any of --batch_size/--num_workers/--prefetch_factor left unset.
+
+TUNE_FILE = os.environ.get('AGRI_TUNE_FILE', 'ml/runs/tuned_config.json')
+LOADER_FALLBACK = {'batch_size': 32, 'num_workers': 4, 'prefetch_factor': 2}
+
+
+def tune_key(backbone: str, img_size: int) -> str:
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    return f"{platform.node()}|{device}|{backbone}|{img_size}"
+
+
+def load_tuned_config(backbone: str, img_size: int, path: str = TUNE_FILE) -> Optional[Dict[str, Any]]:
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f).get(tune_key(backbone, img_size))
+
+
+def apply_tuned_config(args: argparse.Namespace):
+    """Fill unset loader args from the tuned config (or the old fixed defaults)."""
+    tuned = load_tuned_config(args.backbone, args.img_size) or {}
+    if tuned:
+        log(f"[INFO] Tuned loader config from {TUNE_FILE}: batch_size={tuned['batch_size']} num_workers={tuned['num_workers']} "
+            f"prefetch_factor={tuned['prefetch_factor']} threads={tuned['threads']}")
+    for key, default in LOADER_FALLBACK.items():
+        if getattr(args, key) is None:
+            setattr(args, key, tuned.get(key, default))
+    LOADER_SETTINGS['prefetch_factor'] = args.prefetch_factor
+    if tuned and not dist_is_initialized():
+        torch.set_num_threads(tuned['threads'])
+
+
+def memory_limit_default_mb() -> Optional[float]:
+    if torch.cuda.is_available():
+        return torch.cuda.get_device_properties(0).total_memory / (1024 * 1024) * 0.9
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / (1024 * 1024) * 0.8
+    except (AttributeError, ValueError, OSError):
+        pass
+    try:
+        import psutil
+        return psutil.virtual_memory().total / (1024 * 1024) * 0.8
+    except ImportError:
+        return None
+
+
+def proc_pss_mb(pid: int) -> Optional[float]:
+    """Proportional set size (shared pages split between sharers); Linux only."""
+    try:
+        with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _tune_trial(cfg: Dict[str, Any], results):
+    """One timed config in a fresh process; puts samples/s and peak memory (MB)."""
+    try:
+        torch.set_num_threads(cfg['threads'])
+        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        train_tf, _ = get_classification_transforms(cfg['img_size'])
+        if cfg['data_dir']:
+            ds = IndexedImageFolder(load_dataset_index('imagefolder', cfg['data_dir']), transform=train_tf)
+            num_classes = len(ds.classes)
+        else:
+            ds = ClassifierCSVDataset(cfg['images_dir'], cfg['labels_csv'], cfg['img_size'])
+            num_classes = len(ds.label_to_idx)
+        workers = cfg['num_workers']
+        loader = DataLoader(
+            ds, batch_size=cfg['batch_size'], shuffle=True, drop_last=True, num_workers=workers,
+            pin_memory=device.type == 'cuda', prefetch_factor=cfg['prefetch_factor'] if workers > 0 else None,
+        )
+        # Weights do not change the speed; skip the download
+        model = build_classifier(cfg['backbone'], num_classes=num_classes, pretrained=False).to(device)
+        criterion = nn.CrossEntropyLoss()
+        optimizer = optim.AdamW(model.parameters(), lr=1e-3)
+        scaler = torch.cuda.amp.GradScaler(enabled=device.type == 'cuda')
+        model.train()
+        step, n, start = 0, 0, 0.0
+        it = iter(loader)
+        while step < cfg['warmup'] + cfg['steps']:
+            try:
+                images, targets = next(it)
+            except StopIteration:
+                it = iter(loader)
+                continue
+            if step == cfg['warmup']:
+                if device.type == 'cuda':
+                    torch.cuda.synchronize()
+                start = time.perf_counter()
+            images, targets = images.to(device, non_blocking=True), targets.to(device, non_blocking=True)
+            optimizer.zero_grad(set_to_none=True)
+            with torch.cuda.amp.autocast(enabled=device.type == 'cuda'):
+                loss = criterion(model(images), targets)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            if step >= cfg['warmup']:
+                n += images.size(0)
+            step += 1
+        if device.type == 'cuda':
+            torch.cuda.synchronize()
+        elapsed = time.perf_counter() - start
+        # Forked workers share most pages with the parent, so count their PSS
+        worker_pss = [proc_pss_mb(w.pid) for w in getattr(it, '_workers', [])]
+        del it  # shuts the workers down so their usage is reported below
+        if device.type == 'cuda':
+            peak = torch.cuda.max_memory_allocated() / (1024 * 1024)
+        else:
+            peak = peak_rss_mb() or 0.0
+            if all(m is not None for m in worker_pss):
+                peak += sum(worker_pss)
+            else:
+                try:
+                    import resource
+                    # largest finished worker, counted once per worker (overestimates shared pages)
+                    child = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+                    peak += workers * (child / (1024 * 1024) if sys.platform == 'darwin' else child / 1024)
+                except ImportError:
+                    pass
+        results.put({'samples_per_s': n / max(elapsed, 1e-9), 'peak_mem_mb': peak})
+    except RuntimeError as e:  # CUDA OOM and friends
+        results.put({'error': str(e).splitlines()[0]})
+
+
+def tune_loader(
+    backbone: str = 'mobilenet_v2',
+    img_size: int = 256,
+    data_dir: Optional[str] = None,
+    images_dir: Optional[str] = None,
+    labels_csv: Optional[str] = None,
+    memory_limit_mb: Optional[float] = None,
+    batch_sizes: Optional[List[int]] = None,
+    workers: Optional[List[int]] = None,
+    prefetch_factors: Optional[List[int]] = None,
+    threads: Optional[List[int]] = None,
+    steps: int = 10,
+    output: str = TUNE_FILE,
+) -> Dict[str, Any]:
+    cpus = os.cpu_count() or 1
+    batch_sizes = batch_sizes or [8, 16, 32, 64, 128, 256]
+    workers = workers or sorted({0, 2, 4, cpus // 2, cpus} & set(range(cpus + 1)))
+    prefetch_factors = prefetch_factors or [2, 4]
+    threads = threads or sorted({1, max(1, cpus // 2), cpus})
+    memory_limit_mb = memory_limit_mb or memory_limit_default_mb()
+    base = {'backbone': backbone, 'img_size': img_size, 'data_dir': data_dir, 'images_dir': images_dir,
+            'labels_csv': labels_csv, 'steps': steps, 'warmup': 2}
+    if data_dir:
+        load_dataset_index('imagefolder', data_dir)  # build once here, not in every trial
+    else:
+        load_dataset_index('csv', images_dir, labels_csv)
+    ctx = mp.get_context('spawn')
+    trials: List[Dict[str, Any]] = []
+
+    def run(batch_size: int, num_workers: int, prefetch_factor: int, threads: int) -> Dict[str, Any]:
+        cfg = {'batch_size': batch_size, 'num_workers': num_workers, 'prefetch_factor': prefetch_factor, 'threads': threads}
+        for t in trials:
+            if all(t[k] == v for k, v in cfg.items()):
+                return t
+        results = ctx.SimpleQueue()
+        proc = ctx.Process(target=_tune_trial, args=({**base, **cfg}, results))
+        proc.start()
+        proc.join()
+        res = results.get() if not results.empty() else {'error': f"trial exited with code {proc.exitcode}"}
+        row = {**cfg, 'samples_per_s': res.get('samples_per_s', 0.0), 'peak_mem_mb': res.get('peak_mem_mb')}
+        if 'error' in res:
+            row['rejected'] = res['error']
+        elif memory_limit_mb is not None and row['peak_mem_mb'] is not None and row['peak_mem_mb'] > memory_limit_mb:
+            row['rejected'] = f"peak {row['peak_mem_mb']:.0f} MB > limit {memory_limit_mb:.0f} MB"
+        trials.append(row)
+        mem = f"{row['peak_mem_mb']:.0f}MB" if row['peak_mem_mb'] is not None else '?'
+        status = f" REJECTED ({row['rejected']})" if 'rejected' in row else ''
+        print(f"[TUNE] bs={batch_size} workers={num_workers} prefetch={prefetch_factor} threads={threads}: "
+              f"{row['samples_per_s']:.1f} samples/s peak={mem}{status}")
+        return row
+
+    def best(rows: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        ok = [r for r in rows if 'rejected' not in r]
+        return max(ok, key=lambda r: r['samples_per_s']) if ok else None
+
+    # 1) batch size at middling loader settings; stop growing once memory runs out
+    cur = {'num_workers': min(4, cpus), 'prefetch_factor': 2, 'threads': cpus}
+    rows = []
+    for bs in sorted(batch_sizes):
+        rows.append(run(bs, **cur))
+        if 'rejected' in rows[-1]:
+            break
+    pick = best(rows)
+    if pick is None:
+        raise RuntimeError(f"No batch size in {batch_sizes} fits in {memory_limit_mb:.0f} MB")
+    # 2) workers x prefetch (prefetch only matters with workers)
+    rows = [pick]
+    for w in workers:
+        for pf in (prefetch_factors if w > 0 else prefetch_factors[:1]):
+            rows.append(run(pick['batch_size'], w, pf, pick['threads']))
+    pick = best(rows)
+    # 3) intra-op threads
+    rows = [pick] + [run(pick['batch_size'], pick['num_workers'], pick['prefetch_factor'], t) for t in threads]
+    pick = best(rows)
+
+    config = {k: pick[k] for k in ('batch_size', 'num_workers', 'prefetch_factor', 'threads', 'samples_per_s', 'peak_mem_mb')}
+    config.update({'memory_limit_mb': memory_limit_mb, 'cpu_count': cpus, 'tuned_at': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    baseline = next((t for t in trials if t['batch_size'] == 32 and t['num_workers'] == min(4, cpus) and t['threads'] == cpus), None)
+    speedup = f" ({pick['samples_per_s'] / baseline['samples_per_s']:.2f}x vs bs=32/workers={min(4, cpus)})" if baseline and 'rejected' not in baseline else ''
+    print(f"[TUNE] Best: batch_size={pick['batch_size']} num_workers={pick['num_workers']} prefetch_factor={pick['prefetch_factor']} "
+          f"threads={pick['threads']} -> {pick['samples_per_s']:.1f} samples/s{speedup}")
+
+    saved: Dict[str, Any] = {}
+    if os.path.isfile(output):
+        with open(output, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    saved[tune_key(backbone, img_size)] = {**config, 'trials': trials}
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(saved, f, indent=2)
+    print(f"[INFO] Tuned config saved: {output} (used by classifier/classifier_csv/severity with --backbone {backbone} --img_size {img_size})")
+    return config
+
+
+# -------------------- EXPORT EVALUATION --------------------
+# `evaluate_exports` runs every artifact of a classifier run (best.pth in eager
+# mode, each export/*.ts.pt and the reduced-precision modes infer_server.py can
+# select for them) over the same held-out images and synthetic latency batches.
+# Logits are compared with best.pth: model.ts.pt is a plain trace and must match
+# within a small tolerance; for the other variants top-1 agreement is reported and
+# only checked against a stored baseline. Later evaluations exit non-zero on
+# parity, accuracy, agreement or latency regressions.
+
+MODEL_KEY_RUNS = {'plantvillage': 'ml/runs/classifier', 'paddy': 'ml/runs/classifier_paddy'}
+EVAL_PRECISION_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def eval_transform_from_meta(meta: Dict[str, Any]) -> transforms.Compose:
+    img_size = int(meta['img_size'])
+    return transforms.Compose([
+        transforms.Resize(int(img_size * float(meta.get('resize_ratio', RESIZE_RATIO)))),
+        transforms.CenterCrop(img_size),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=meta.get('mean', IMAGENET_MEAN), std=meta.get('std', IMAGENET_STD)),
+    ])
 
-    img_size = ckpt.get('img_size', 256)
-    _, val_tf = get_classification_transforms(img_size)
-    pil = Image.open(image_path).convert('RGB')
-    input_tensor = val_tf(pil).unsqueeze(0)
 
-    model = build_classifier(backbone, num_classes=len(class_to_idx))
+def precision_forward(model, precision: str):
+    """Same forward as run_model in infer_server.py; always returns fp32 logits."""
+    def forward(x: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            if precision == 'bf16_autocast':
+                with torch.autocast('cpu', dtype=torch.bfloat16):
+                    out = model(x)
+            elif precision in EVAL_PRECISION_DTYPES:
+                out = model(x.to(EVAL_PRECISION_DTYPES[precision]))
+            else:
+                out = model(x)
+        return out.float()
+    return forward
+
+
+def load_export_variants(run_dir: str, precisions: List[str]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """best.pth first (the parity reference), then every classifier TorchScript in
+    export/ in fp32 and each requested precision. Load failures are kept as rows."""
+    best_path = os.path.join(run_dir, 'best.pth')
+    if not os.path.isfile(best_path):
+        raise FileNotFoundError(f"No best.pth in {run_dir}")
+    t0 = time.perf_counter()
+    ckpt = torch.load(best_path, map_location='cpu')
+    model = build_classifier(ckpt['backbone'], num_classes=len(ckpt['class_to_idx']), pretrained=False)
     model.load_state_dict(ckpt['model_state'])
     model.eval()
-
-    target_layer = None
-    if hasattr(model, 'features') and isinstance(model.features, nn.Sequential):
-        target_layer = list(model.features.modules())[-1]
+    variants = [{'name': 'best.pth', 'path': best_path, 'precision': 'fp32', 'model': model, 'load_s': time.perf_counter() - t0}]
+
+    export_dir = os.path.join(run_dir, 'export')
+    ts_files = sorted(f for f in os.listdir(export_dir) if f.endswith('.ts.pt') and not f.startswith('severity')) if os.path.isdir(export_dir) else []
+    if 'model.ts.pt' not in ts_files:
+        print(f"[WARN] No model.ts.pt in {export_dir}; only best.pth will be evaluated")
+    for fname in ts_files:
+        path = os.path.join(export_dir, fname)
+        for precision in ['fp32'] + precisions:
+            row = {'name': fname if precision == 'fp32' else f"{fname}:{precision}", 'path': path, 'precision': precision}
+            try:
+                t0 = time.perf_counter()
+                ts = torch.jit.load(path, map_location='cpu')
+                if precision in EVAL_PRECISION_DTYPES:
+                    ts = ts.to(EVAL_PRECISION_DTYPES[precision])
+                row['model'] = ts.eval()
+                row['load_s'] = time.perf_counter() - t0
+            except Exception as e:
+                print(f"[WARN] Could not load {row['name']}: {e}")
+                row['error'] = str(e)
+            variants.append(row)
+    return ckpt, variants
+
+
+def heldout_samples(ckpt: Dict[str, Any], manifest: Optional[str], data_dir: Optional[str], images_dir: Optional[str],
+                    labels_csv: Optional[str], max_images: int, decode_dir: str) -> List[Tuple[str, int]]:
+    """The manifest, or else the val split recorded in the checkpoint (read-only; the index
+    is never written). Data URIs in a JSONL manifest are decoded into decode_dir."""
+    class_to_idx = ckpt['class_to_idx']
+    if manifest:
+        samples = load_corrections(manifest, decode_dir)
+    else:
+        samples = recorded_splits(ckpt, data_dir, images_dir, labels_csv)[1]
+    out = [(path, class_to_idx[label]) for path, label in samples if label in class_to_idx]
+    if len(out) < len(samples):
+        print(f"[WARN] Skipping {len(samples) - len(out)} held-out images with labels the model does not know")
+    if max_images and len(out) > max_images:
+        out = random.Random(SEED).sample(out, max_images)
+    return out
+
+
+def per_class_metrics(confusion: np.ndarray, idx_to_class: Dict[int, str]) -> Dict[str, Dict[str, float]]:
+    """confusion[target, pred] -> precision / recall / f1 / support per class."""
+    out = {}
+    for i in range(confusion.shape[0]):
+        tp = float(confusion[i, i])
+        support = int(confusion[i].sum())
+        precision = tp / max(1.0, float(confusion[:, i].sum()))
+        recall = tp / max(1, support)
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0.0
+        out[idx_to_class[i]] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': support}
+    return out
+
+
+def latency_profile(forward, img_size: int, batch_sizes: List[int], runs: int, warmup: int = 3) -> Dict[str, Dict[str, float]]:
+    out = {}
+    for bs in batch_sizes:
+        x = torch.randn(bs, 3, img_size, img_size, generator=torch.Generator().manual_seed(0))
+        times = []
+        for i in range(warmup + runs):
+            start = time.perf_counter()
+            forward(x)
+            if i >= warmup:
+                times.append((time.perf_counter() - start) * 1000.0)
+        out[str(bs)] = {
+            'p50_ms': float(np.percentile(times, 50)),
+            'p90_ms': float(np.percentile(times, 90)),
+            'p99_ms': float(np.percentile(times, 99)),
+            'throughput_ips': bs * 1000.0 / float(np.mean(times)),
+        }
+    return out
+
+
+def score_heldout(live: List[Dict[str, Any]], loader: DataLoader, num_classes: int) -> List[Dict[str, Any]]:
+    """Accumulates accuracy, agreement and logit deviation vs best.pth (live[0]).
+    A variant failing on a batch is dropped; best.pth failing aborts the evaluation."""
+    k = min(5, num_classes)
+    for v in live:
+        v.update(correct1=0, correct5=0, agree=0, max_dev=0.0, confusion=np.zeros((num_classes, num_classes), dtype=np.int64))
+    for images, targets in loader:
+        try:
+            ref = live[0]['forward'](images)
+        except Exception as e:
+            raise RuntimeError(f"best.pth failed on the held-out set, nothing to compare against: {e}") from e
+        for v in live:
+            try:
+                logits = ref if v is live[0] else v['forward'](images)
+            except Exception as e:
+                print(f"[WARN] {v['name']} failed on the held-out set: {e}")
+                v['error'] = str(e)
+                continue
+            top = logits.topk(k, dim=1).indices
+            pred = top[:, 0]
+            v['correct1'] += int((pred == targets).sum())
+            v['correct5'] += int((top == targets[:, None]).any(dim=1).sum())
+            v['agree'] += int((pred == ref.argmax(dim=1)).sum())
+            v['max_dev'] = max(v['max_dev'], float((logits - ref).abs().max()))
+            np.add.at(v['confusion'], (targets.numpy(), pred.numpy()), 1)
+        live = [v for v in live if 'error' not in v]
+    return live
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any], max_acc_drop: float, max_agreement_drop: float,
+                          latency_tol: float) -> List[str]:
+    regressions = []
+    if baseline.get('heldout_images') != report['heldout_images']:
+        print(f"[WARN] Baseline was measured on {baseline.get('heldout_images')} held-out images, now {report['heldout_images']}")
+    if baseline.get('host') != report['host']:
+        print(f"[WARN] Baseline latency was measured on {baseline.get('host')}, this is {report['host']}")
+    current = {v['name']: v for v in report['variants']}
+    for name, base in ((v['name'], v) for v in baseline.get('variants', [])):
+        if 'error' in base or base['precision'] not in ['fp32'] + report['precisions']:
+            continue
+        cur = current.get(name)
+        if cur is None or 'error' in cur:
+            regressions.append(f"{name}: present in baseline, now missing or failing to load")
+            continue
+        if cur['top1'] < base['top1'] - max_acc_drop:
+            regressions.append(f"{name}: top-1 {cur['top1']:.4f} < baseline {base['top1']:.4f} - {max_acc_drop}")
+        if name != 'best.pth' and cur['top1_agreement'] < base['top1_agreement'] - max_agreement_drop:
+            regressions.append(f"{name}: top-1 agreement with best.pth {cur['top1_agreement']:.4f} < baseline {base['top1_agreement']:.4f} - {max_agreement_drop}")
+        for bs, lat in base['latency'].items():
+            now = cur['latency'].get(bs)
+            if now and now['p50_ms'] > lat['p50_ms'] * (1.0 + latency_tol):
+                regressions.append(f"{name}: batch {bs} p50 {now['p50_ms']:.1f} ms > baseline {lat['p50_ms']:.1f} ms + {latency_tol:.0%}")
+    return regressions
+
+
+def evaluate_exports(
+    run_dir: str,
+    manifest: Optional[str] = None,
+    data_dir: Optional[str] = None,
+    images_dir: Optional[str] = None,
+    labels_csv: Optional[str] = None,
+    max_images: int = 0,
+    precisions: Optional[List[str]] = None,
+    max_batch: int = 32,
+    latency_runs: int = 20,
+    batch_size: int = 32,
+    num_workers: int = 4,
+    logit_tol: float = 1e-3,
+    baseline_path: Optional[str] = None,
+    update_baseline: bool = False,
+    max_acc_drop: float = 0.01,
+    max_agreement_drop: float = 0.01,
+    latency_tol: float = 0.25,
+    output: Optional[str] = None,
+) -> Dict[str, Any]:
+    precisions = ['bf16_autocast', 'bf16', 'fp16'] if precisions is None else precisions
+    unknown = [p for p in precisions if p != 'bf16_autocast' and p not in EVAL_PRECISION_DTYPES]
+    if unknown:
+        raise ValueError(f"Unknown precisions {unknown}; options: bf16_autocast, {', '.join(EVAL_PRECISION_DTYPES)}")
+    ckpt, variants = load_export_variants(run_dir, precisions)
+    class_to_idx = ckpt['class_to_idx']
+    idx_to_class = {v: k for k, v in class_to_idx.items()}
+    num_classes = len(class_to_idx)
+    meta_path = os.path.join(run_dir, 'export', 'preprocess.json')
+    if os.path.isfile(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
     else:
-        last_conv = None
-        for m in model.modules():
-            if isinstance(m, nn.Conv2d):
-                last_conv = m
-        target_layer = last_conv
-    if target_layer is None:
-        raise RuntimeError("Could not find a suitable conv layer for Grad-CAM.")
+        meta = {'img_size': ckpt.get('img_size', 256)}
+    img_size = int(meta['img_size'])
+    live = [v for v in variants if 'error' not in v]
+    for v in live:
+        v['forward'] = precision_forward(v['model'], v['precision'])
+
+    with tempfile.TemporaryDirectory(prefix='heldout_') as decode_dir:
+        samples = heldout_samples(ckpt, manifest, data_dir, images_dir, labels_csv, max_images, decode_dir)
+        if not samples:
+            raise ValueError('No held-out images to evaluate on')
+        print(f"[INFO] Evaluating {len(live)} variants of {run_dir} on {len(samples)} held-out images")
+        loader = DataLoader(ImageListDataset(samples, eval_transform_from_meta(meta)), batch_size=batch_size, shuffle=False, num_workers=num_workers)
+        live = score_heldout(live, loader, num_classes)
+    k = min(5, num_classes)
+
+    batch_sizes = sorted({min(2 ** i, max_batch) for i in range(max_batch.bit_length() + 1)})
+    rows = []
+    for v in variants:
+        row = {'name': v['name'], 'precision': v['precision'], 'path': v['path'], 'file_mb': os.path.getsize(v['path']) / (1024 * 1024)}
+        if 'error' in v:
+            row['error'] = v['error']
+            rows.append(row)
+            continue
+        n = len(samples)
+        row.update({
+            'load_s': v['load_s'],
+            'weights_mb': sum(t.numel() * t.element_size() for t in itertools.chain(v['model'].parameters(), v['model'].buffers())) / (1024 * 1024),
+            'top1': v['correct1'] / n,
+            f"top{k}": v['correct5'] / n,
+            'top1_agreement': v['agree'] / n,
+            'max_logit_dev': v['max_dev'],
+            'per_class': per_class_metrics(v['confusion'], idx_to_class),
+            'latency': latency_profile(v['forward'], img_size, batch_sizes, latency_runs),
+        })
+        rows.append(row)
+
+    regressions = []
+    for row in rows:
+        if 'error' in row or row['name'] == 'best.pth':
+            continue
+        if row['name'] == 'model.ts.pt' and row['max_logit_dev'] > logit_tol:
+            regressions.append(f"{row['name']}: max logit deviation {row['max_logit_dev']:.2e} from best.pth > {logit_tol:.0e}")
+    report = {
+        'run_dir': run_dir,
+        'host': platform.node(),
+        'torch': torch.__version__,
+        'threads': torch.get_num_threads(),
+        'img_size': img_size,
+        'heldout_images': len(samples),
+        'batch_sizes': batch_sizes,
+        'precisions': precisions,
+        'variants': rows,
+    }
+    if baseline_path and os.path.isfile(baseline_path) and not update_baseline:
+        with open(baseline_path, 'r', encoding='utf-8') as f:
+            regressions += compare_with_baseline(report, json.load(f), max_acc_drop, max_agreement_drop, latency_tol)
+    elif baseline_path and not update_baseline:
+        print(f"[WARN] Baseline {baseline_path} not found; only parity with best.pth is checked (store one with --update_baseline)")
+    report['regressions'] = regressions
+
+    output = output or os.path.join(run_dir, 'export_eval.json')
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    if baseline_path and update_baseline:
+        with open(baseline_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Baseline saved: {baseline_path}")
+
+    print(f"  {'variant':<28} {'top1':>6} {f'top{k}':>6} {'agree':>6} {'max_dev':>9} {'load_s':>7} {'file_mb':>8} {'p50@1':>7} {f'ips@{batch_sizes[-1]}':>8}")
+    for row in rows:
+        if 'error' in row:
+            print(f"  {row['name']:<28} error: {row['error'][:60]}")
+            continue
+        lat = row['latency']
+        print(f"  {row['name']:<28} {row['top1']:>6.3f} {row[f'top{k}']:>6.3f} {row['top1_agreement']:>6.3f} {row['max_logit_dev']:>9.2e} "
+              f"{row['load_s']:>7.2f} {row['file_mb']:>8.1f} {lat['1']['p50_ms']:>7.1f} {lat[str(batch_sizes[-1])]['throughput_ips']:>8.1f}")
+    for r in regressions:
+        print(f"[REGRESSION] {r}")
+    print(f"[INFO] Export evaluation saved: {output}")
+    return report
 
-    device = get_device()
-    model = model.to(device)
-    input_tensor = input_tensor.to(device)
 
-    if target_label not in class_to_idx:
-        raise ValueError(f"target_label '{target_label}' not in class_to_idx. Available: {list(class_to_idx.keys())}")
-    with GradCAM(model=model, target_layers=[target_layer]) as cam:
-        grayscale_cam = cam(input_tensor=input_tensor, targets=None)[0]
+# -------------------- CLI --------------------
 
-    disp = pil.resize((img_size, img_size))
-    disp_np = np.array(disp).astype(np.float32) / 255.0
-    cam_image = show_cam_on_image(disp_np, grayscale_cam, use_rgb=True, image_weight=(1.0 - alpha))
-    out_img = Image.fromarray(cam_image)
+def add_distributed_args(p: argparse.ArgumentParser):
+    p.add_argument('--dist_backend', type=str, default='gloo', choices=['gloo', 'nccl'], help='torch.distributed backend when launched with torchrun')
+    p.add_argument('--threads_per_proc', type=int, default=0, help='torch threads per process when distributed (0 = cores / local processes)')
 
-    buf = BytesIO()
-    out_img.save(buf, format='PNG')
-    data = base64.b64encode(buf.getvalue()).decode('utf-8')
-    return f"data:image/png;base64,{data}"
 
+def add_index_args(p: argparse.ArgumentParser):
+    p.add_argument('--refresh_index', action='store_true', help='Rescan the dataset and validate new/changed files before training (the index is built automatically the first time)')
+
+
+def add_run_control_args(p: argparse.ArgumentParser):
+    p.add_argument('--resume', action='store_true', help='Continue from <output_dir>/last.pth (model, optimizer, scaler, epoch, RNG)')
+    p.add_argument('--patience', type=int, default=0, help='Stop after this many epochs without val improvement (0 = off)')
+    p.add_argument('--min_delta', type=float, default=0.0, help='Smallest val change that counts as an improvement')
+    p.add_argument('--time_budget', type=parse_duration, default=0.0, help='Wall-clock budget for this run, e.g. 5400, 90m, 2h; stops before an epoch that would overrun and exports the best model')
+
+
+def add_progressive_args(p: argparse.ArgumentParser):
+    p.add_argument('--progressive', type=str, default=None, help='Comma-separated smaller sizes to train at before --img_size, e.g. 128,192')
+    p.add_argument('--max_batch_size', type=int, default=256, help='Cap for the enlarged batch size of low-resolution phases')
+    p.add_argument('--compare_baseline', action='store_true', help='Also train at fixed --img_size (into <output_dir>/baseline) and report time-to-accuracy')
+
+
+def add_profiling_args(p: argparse.ArgumentParser):
+    p.add_argument('--profile_trace', type=str, default=None, help='Write a torch.profiler Chrome trace of steps 6-15 of the first epoch to this .json path')
 
-# -------------------- CLI --------------------
 
 def main():
     parser = argparse.ArgumentParser(description='AgriAssist ML Training / Inference Pipeline (RTX 4050 Ready)')
@@ -570,12 +3156,19 @@ def main():
     p_cls.add_argument('--output_dir', type=str, default='ml/runs/classifier')
     p_cls.add_argument('--backbone', type=str, default='mobilenet_v2', choices=['mobilenet_v2', 'efficientnet_b0', 'efficientnet_b1'])
     p_cls.add_argument('--img_size', type=int, default=256)
-    p_cls.add_argument('--batch_size', type=int, default=32)
+    p_cls.add_argument('--batch_size', type=int, default=None, help='Default: tuned value (see tune) or 32')
     p_cls.add_argument('--epochs', type=int, default=20)
     p_cls.add_argument('--lr', type=float, default=1e-3)
     p_cls.add_argument('--val_split', type=float, default=0.1)
     p_cls.add_argument('--freeze_epochs', type=int, default=3)
-    p_cls.add_argument('--num_workers', type=int, default=4)
+    p_cls.add_argument('--num_workers', type=int, default=None, help='Default: tuned value (see tune) or 4')
+    p_cls.add_argument('--batch_aug', action='store_true', help='Augment whole batches after collation instead of per-sample PIL transforms')
+    add_distributed_args(p_cls)
+    add_profiling_args(p_cls)
+    add_index_args(p_cls)
+    add_run_control_args(p_cls)
+    p_cls.add_argument('--prefetch_factor', type=int, default=None, help='Batches prefetched per worker. Default: tuned value or 2')
+    add_progressive_args(p_cls)
 
     # CSV classifier (Paddy)
     p_csv = sub.add_parser('classifier_csv', help='Train and export classifier from CSV (e.g., paddy_disease/train.csv)')
@@ -584,12 +3177,19 @@ def main():
     p_csv.add_argument('--output_dir', type=str, default='ml/runs/classifier_paddy')
     p_csv.add_argument('--backbone', type=str, default='mobilenet_v2', choices=['mobilenet_v2', 'efficientnet_b0', 'efficientnet_b1'])
     p_csv.add_argument('--img_size', type=int, default=256)
-    p_csv.add_argument('--batch_size', type=int, default=32)
+    p_csv.add_argument('--batch_size', type=int, default=None, help='Default: tuned value (see tune) or 32')
     p_csv.add_argument('--epochs', type=int, default=20)
     p_csv.add_argument('--lr', type=float, default=1e-3)
     p_csv.add_argument('--val_split', type=float, default=0.1)
     p_csv.add_argument('--freeze_epochs', type=int, default=3)
-    p_csv.add_argument('--num_workers', type=int, default=4)
+    p_csv.add_argument('--num_workers', type=int, default=None, help='Default: tuned value (see tune) or 4')
+    p_csv.add_argument('--batch_aug', action='store_true', help='Augment whole batches after collation instead of per-sample PIL transforms')
+    add_distributed_args(p_csv)
+    add_profiling_args(p_csv)
+    add_index_args(p_csv)
+    add_run_control_args(p_csv)
+    p_csv.add_argument('--prefetch_factor', type=int, default=None, help='Batches prefetched per worker. Default: tuned value or 2')
+    add_progressive_args(p_csv)
 
     # Severity regression
     p_reg = sub.add_parser('severity', help='Train and export severity regression model')
@@ -598,24 +3198,149 @@ def main():
     p_reg.add_argument('--output_dir', type=str, default='ml/runs/severity_regression')
     p_reg.add_argument('--backbone', type=str, default='mobilenet_v2', choices=['mobilenet_v2', 'efficientnet_b0', 'efficientnet_b1'])
     p_reg.add_argument('--img_size', type=int, default=256)
-    p_reg.add_argument('--batch_size', type=int, default=32)
+    p_reg.add_argument('--batch_size', type=int, default=None, help='Default: tuned value (see tune) or 32')
     p_reg.add_argument('--epochs', type=int, default=20)
     p_reg.add_argument('--lr', type=float, default=1e-3)
     p_reg.add_argument('--val_split', type=float, default=0.1)
-    p_reg.add_argument('--num_workers', type=int, default=4)
+    p_reg.add_argument('--num_workers', type=int, default=None, help='Default: tuned value (see tune) or 4')
+    add_distributed_args(p_reg)
+    add_profiling_args(p_reg)
+    add_index_args(p_reg)
+    add_run_control_args(p_reg)
+    p_reg.add_argument('--prefetch_factor', type=int, default=None, help='Batches prefetched per worker. Default: tuned value or 2')
 
     # Grad-CAM
-    p_cam = sub.add_parser('gradcam', help='Generate Grad-CAM heatmap data URI')
+    p_cam = sub.add_parser('gradcam', help='Generate Grad-CAM heatmap data URIs for one or more images and target labels')
     p_cam.add_argument('--ckpt', type=str, required=True)
-    p_cam.add_argument('--image', type=str, required=True)
-    p_cam.add_argument('--target_label', type=str, required=True)
+    p_cam.add_argument('--image', type=str, nargs='+', required=True)
+    p_cam.add_argument('--target_label', type=str, nargs='+', default=None, help='One heatmap per label for every image (default: top-1 prediction)')
     p_cam.add_argument('--alpha', type=float, default=0.45)
+    p_cam.add_argument('--output_dir', type=str, default=None, help='Save <image>_<label>.png files here instead of printing data URIs')
+    p_cam.add_argument('--benchmark', action='store_true', help='Compare ms per heatmap with one pytorch_grad_cam call per image and target')
+
+    # Augmentation throughput benchmark
+    p_bench = sub.add_parser('bench_aug', help='Compare samples/s of PIL vs batched augmentation')
+    p_bench.add_argument('--data_dir', type=str, default='datasets/plantvillage')
+    p_bench.add_argument('--img_size', type=int, default=256)
+    p_bench.add_argument('--batch_size', type=int, default=32)
+    p_bench.add_argument('--num_workers', type=int, default=4)
+    p_bench.add_argument('--batches', type=int, default=20)
+
+    # Near-duplicate search benchmark
+    p_bdd = sub.add_parser('bench_dedup', help='Time the near-duplicate search on synthetic skewed hashes with planted copies')
+    p_bdd.add_argument('--images', type=int, default=300_000)
+    p_bdd.add_argument('--max_distance', type=int, default=6)
+    p_bdd.add_argument('--near_fraction', type=float, default=0.02, help='Share of images that are near copies (1..max_distance bits flipped)')
+    p_bdd.add_argument('--exact_fraction', type=float, default=0.02, help='Share of images that are exact copies')
+
+    # Data-parallel scaling benchmark
+    p_scale = sub.add_parser('dist_scaling', help='Measure data-parallel training throughput and scaling efficiency for 1..N processes')
+    p_scale.add_argument('--data_dir', type=str, default='datasets/plantvillage')
+    p_scale.add_argument('--backbone', type=str, default='mobilenet_v2', choices=['mobilenet_v2', 'efficientnet_b0', 'efficientnet_b1'])
+    p_scale.add_argument('--img_size', type=int, default=256)
+    p_scale.add_argument('--batch_size', type=int, default=32, help='Per-process batch size')
+    p_scale.add_argument('--max_procs', type=int, default=4)
+    p_scale.add_argument('--steps', type=int, default=20)
+    p_scale.add_argument('--num_workers', type=int, default=2)
+    p_scale.add_argument('--output', type=str, default='ml/runs/dist_scaling.json')
+
+    # Incremental fine-tuning from review-queue corrections
+    p_inc = sub.add_parser('incremental', help='Fine-tune an existing best.pth on newly labeled images plus a replay sample of the original data')
+    p_inc.add_argument('--ckpt', type=str, required=True, help='Previous best.pth')
+    p_inc.add_argument('--manifest', type=str, required=True, help='CSV (image,label) or JSONL review-queue export of corrections')
+    p_inc.add_argument('--output_dir', type=str, default='ml/runs/classifier_incremental')
+    p_inc.add_argument('--data_dir', type=str, default=None, help='Original ImageFolder dataset')
+    p_inc.add_argument('--images_dir', type=str, default=None, help='Original CSV dataset images (with --labels_csv)')
+    p_inc.add_argument('--labels_csv', type=str, default=None)
+    p_inc.add_argument('--replay_per_new', type=float, default=4.0, help='Replay samples from the original train split per correction')
+    p_inc.add_argument('--new_val_split', type=float, default=0.2, help='Share of corrections held out for evaluation')
+    p_inc.add_argument('--batch_size', type=int, default=32)
+    p_inc.add_argument('--epochs', type=int, default=3)
+    p_inc.add_argument('--freeze_epochs', type=int, default=1)
+    p_inc.add_argument('--lr', type=float, default=1e-3)
+    p_inc.add_argument('--num_workers', type=int, default=4)
+    p_inc.add_argument('--max_old_val_drop', type=float, default=0.01, help='Export only if accuracy on the original val split drops at most this much')
+    p_inc.add_argument('--force', action='store_true', help='Export even if old val accuracy dropped more than --max_old_val_drop')
+
+    # Dataset index
+    p_idx = sub.add_parser('index', help='Build or incrementally update the validated dataset index (<dataset>.index.json)')
+    p_idx.add_argument('--kind', type=str, default='imagefolder', choices=['imagefolder', 'csv', 'severity'])
+    p_idx.add_argument('--root', type=str, required=True, help='ImageFolder root, or images dir for csv/severity')
+    p_idx.add_argument('--labels_csv', type=str, default=None)
+    p_idx.add_argument('--val_split', type=float, default=0.1, help='Stratified split stored with the index')
+    p_idx.add_argument('--workers', type=int, default=8, help='Decode threads')
+
+    # Near-duplicate detection
+    p_dd = sub.add_parser('dedup', help='Cluster near-duplicate images, make the stored split group-aware and write a cleaned manifest')
+    p_dd.add_argument('--kind', type=str, default='imagefolder', choices=['imagefolder', 'csv', 'severity'])
+    p_dd.add_argument('--root', type=str, required=True, help='ImageFolder root, or images dir for csv/severity')
+    p_dd.add_argument('--labels_csv', type=str, default=None)
+    p_dd.add_argument('--max_distance', type=int, default=6, help='Max differing bits of the 64-bit dHash for two images to count as near-duplicates')
+    p_dd.add_argument('--val_split', type=float, default=0.1)
+    p_dd.add_argument('--workers', type=int, default=8, help='Hashing threads (only for images indexed before hashes were stored)')
+    add_index_args(p_dd)
+
+    # Loader / batch size tuning
+    p_tune = sub.add_parser('tune', help='Time short runs over batch size, workers, prefetch and threads; save the fastest config that fits in memory')
+    p_tune.add_argument('--data_dir', type=str, default=None, help='ImageFolder dataset')
+    p_tune.add_argument('--images_dir', type=str, default=None, help='CSV dataset images (with --labels_csv)')
+    p_tune.add_argument('--labels_csv', type=str, default=None)
+    p_tune.add_argument('--backbone', type=str, default='mobilenet_v2', choices=['mobilenet_v2', 'efficientnet_b0', 'efficientnet_b1'])
+    p_tune.add_argument('--img_size', type=int, default=256)
+    p_tune.add_argument('--memory_limit_mb', type=float, default=None, help='Default: 90%% of GPU memory, or 80%% of RAM')
+    p_tune.add_argument('--batch_sizes', type=str, default=None, help='Comma-separated candidates (default 8..256)')
+    p_tune.add_argument('--workers', type=str, default=None, help='Comma-separated DataLoader worker counts (default 0,2,4,cores/2,cores)')
+    p_tune.add_argument('--prefetch_factors', type=str, default=None, help='Comma-separated (default 2,4)')
+    p_tune.add_argument('--threads', type=str, default=None, help='Comma-separated torch thread counts (default 1,cores/2,cores)')
+    p_tune.add_argument('--steps', type=int, default=10, help='Timed steps per trial (after 2 warmup steps)')
+    p_tune.add_argument('--output', type=str, default=TUNE_FILE)
+
+    # Hyperparameter sweep
+    p_sweep = sub.add_parser('sweep', help='Grid/random hyperparameter search with successive halving on an ImageFolder')
+    p_sweep.add_argument('--data_dir', type=str, default='datasets/plantvillage')
+    p_sweep.add_argument('--spec', type=str, required=True, help='JSON search spec (see SWEEP section in train_pipeline.py)')
+    p_sweep.add_argument('--output_dir', type=str, default='ml/runs/sweep')
+    p_sweep.add_argument('--min_epochs', type=int, default=1, help='Epoch budget of the first halving rung')
+    p_sweep.add_argument('--max_epochs', type=int, default=9, help='Epoch budget of the surviving trials')
+    p_sweep.add_argument('--eta', type=int, default=3, help='Keep 1/eta of the trials at every rung')
+    p_sweep.add_argument('--val_split', type=float, default=0.1)
+    p_sweep.add_argument('--workers', type=int, default=0, help='Concurrent trials (0 = one per GPU, or cores / 2 on CPU)')
+    p_sweep.add_argument('--num_workers', type=int, default=4, help='DataLoader workers for the one-off decode')
+
+    # Export benchmark / parity
+    p_ev = sub.add_parser('evaluate_exports', help='Benchmark best.pth, model.ts.pt and precision variants: accuracy, logit parity, latency, load time, size')
+    p_ev.add_argument('--model_key', type=str, default='plantvillage', choices=sorted(MODEL_KEY_RUNS), help='Run directory served under this key')
+    p_ev.add_argument('--run_dir', type=str, default=None, help='Overrides --model_key; must contain best.pth and export/')
+    p_ev.add_argument('--manifest', type=str, default=None, help='Held-out CSV (image,label) or JSONL; default: the val split recorded in best.pth')
+    p_ev.add_argument('--data_dir', type=str, default=None, help='ImageFolder dataset best.pth was trained on (its recorded val split is held out)')
+    p_ev.add_argument('--images_dir', type=str, default=None, help='CSV dataset images (with --labels_csv)')
+    p_ev.add_argument('--labels_csv', type=str, default=None)
+    p_ev.add_argument('--max_images', type=int, default=0, help='Evaluate on a fixed random subset of this size (0 = all)')
+    p_ev.add_argument('--precisions', type=str, default='bf16_autocast,bf16,fp16', help='Reduced-precision modes to run every TorchScript export in ("" = fp32 only)')
+    p_ev.add_argument('--max_batch', type=int, default=32, help='Latency at batch sizes 1, 2, 4, ... up to this')
+    p_ev.add_argument('--latency_runs', type=int, default=20, help='Timed forwards per batch size (after 3 warmup)')
+    p_ev.add_argument('--batch_size', type=int, default=32, help='Batch size for the held-out pass')
+    p_ev.add_argument('--num_workers', type=int, default=4)
+    p_ev.add_argument('--logit_tol', type=float, default=1e-3, help='Max |logit| difference allowed between model.ts.pt and best.pth')
+    p_ev.add_argument('--baseline', type=str, default=None, help='Stored report to compare against (default <run_dir>/export_baseline.json)')
+    p_ev.add_argument('--update_baseline', action='store_true', help='Store this report as the baseline instead of comparing')
+    p_ev.add_argument('--max_acc_drop', type=float, default=0.01, help='Allowed top-1 drop vs the baseline')
+    p_ev.add_argument('--max_agreement_drop', type=float, default=0.01, help='Allowed drop in top-1 agreement with best.pth vs the baseline')
+    p_ev.add_argument('--latency_tol', type=float, default=0.25, help='Allowed relative p50 latency increase vs the baseline')
+    p_ev.add_argument('--output', type=str, default=None, help='Default <run_dir>/export_eval.json')
 
     args = parser.parse_args()
 
-    if args.task == 'classifier':
-        train_classifier_imagefolder(
-            data_dir=args.data_dir,
+    if args.task in ('classifier', 'classifier_csv', 'severity'):
+        init_distributed(args.dist_backend, args.threads_per_proc)
+        apply_tuned_config(args)
+
+    if args.task in ('classifier', 'classifier_csv'):
+        if args.task == 'classifier':
+            train_fn = functools.partial(train_classifier_imagefolder, data_dir=args.data_dir)
+        else:
+            train_fn = functools.partial(train_classifier_csv, images_dir=args.images_dir, labels_csv=args.labels_csv)
+        train_kwargs = dict(
             output_dir=args.output_dir,
             backbone=args.backbone,
             img_size=args.img_size,
@@ -625,9 +3350,24 @@ def main():
             val_split=args.val_split,
             freeze_epochs=args.freeze_epochs,
             num_workers=args.num_workers,
+            batch_aug=args.batch_aug,
+            profile_trace=args.profile_trace,
+            progressive_sizes=[int(v) for v in args.progressive.split(',')] if args.progressive else None,
+            max_batch_size=args.max_batch_size,
+            refresh_index=args.refresh_index,
+            resume=args.resume,
+            patience=args.patience,
+            min_delta=args.min_delta,
+            time_budget=args.time_budget,
         )
-    elif args.task == 'classifier_csv':
-        train_classifier_csv(
+        if args.compare_baseline:
+            if not args.progressive:
+                parser.error('--compare_baseline needs --progressive')
+            compare_progressive(train_fn, **train_kwargs)
+        else:
+            train_fn(**train_kwargs)
+    elif args.task == 'severity':
+        train_severity_regression(
             images_dir=args.images_dir,
             labels_csv=args.labels_csv,
             output_dir=args.output_dir,
@@ -637,33 +3377,161 @@ def main():
             epochs=args.epochs,
             lr=args.lr,
             val_split=args.val_split,
-            freeze_epochs=args.freeze_epochs,
             num_workers=args.num_workers,
+            profile_trace=args.profile_trace,
+            refresh_index=args.refresh_index,
+            resume=args.resume,
+            patience=args.patience,
+            min_delta=args.min_delta,
+            time_budget=args.time_budget,
         )
-    elif args.task == 'severity':
-        train_severity_regression(
-            images_dir=args.images_dir,
-            labels_csv=args.labels_csv,
-            output_dir=args.output_dir,
+    elif args.task == 'gradcam':
+        results = [] if args.benchmark else gradcam_batch(
+            ckpt_path=args.ckpt,
+            image_paths=args.image,
+            target_labels=args.target_label,
+            alpha=args.alpha,
+        )
+        if args.benchmark:
+            benchmark_gradcam(args.ckpt, args.image, args.target_label)
+        for res in results:
+            for cam in res['heatmaps']:
+                if args.output_dir:
+                    os.makedirs(args.output_dir, exist_ok=True)
+                    stem = os.path.splitext(os.path.basename(res['image']))[0]
+                    out_path = os.path.join(args.output_dir, f"{stem}_{cam['label']}.png")
+                    with open(out_path, 'wb') as f:
+                        f.write(base64.b64decode(cam['dataUri'].split(',', 1)[1]))
+                    print(f"[INFO] {res['image']} (predicted {res['predicted']}): {cam['label']} p={cam['prob']:.3f} -> {out_path}")
+                else:
+                    print(cam['dataUri'])
+    elif args.task == 'bench_aug':
+        benchmark_augmentation(
+            data_dir=args.data_dir,
+            img_size=args.img_size,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            batches=args.batches,
+        )
+    elif args.task == 'bench_dedup':
+        if not 0 <= args.max_distance < 64:
+            parser.error('--max_distance must be between 0 and 63 (bits of a 64-bit hash)')
+        benchmark_dedup(
+            images=args.images,
+            max_distance=args.max_distance,
+            near_fraction=args.near_fraction,
+            exact_fraction=args.exact_fraction,
+        )
+    elif args.task == 'dist_scaling':
+        benchmark_scaling(
+            data_dir=args.data_dir,
             backbone=args.backbone,
             img_size=args.img_size,
             batch_size=args.batch_size,
+            max_procs=args.max_procs,
+            steps=args.steps,
+            num_workers=args.num_workers,
+            output=args.output,
+        )
+    elif args.task == 'index':
+        if args.kind != 'imagefolder' and not args.labels_csv:
+            parser.error(f'--kind {args.kind} needs --labels_csv')
+        index = build_dataset_index(args.kind, args.root, args.labels_csv, workers=args.workers)
+        train_idx, val_idx = index.assign_split(args.val_split)
+        print(f"[INFO] Split: {len(train_idx)} train / {len(val_idx)} val (val_split={args.val_split}, stratified)")
+    elif args.task == 'dedup':
+        if args.kind != 'imagefolder' and not args.labels_csv:
+            parser.error(f'--kind {args.kind} needs --labels_csv')
+        if not 0 <= args.max_distance < 64:
+            parser.error('--max_distance must be between 0 and 63 (bits of a 64-bit hash)')
+        dedup_dataset(
+            kind=args.kind,
+            root=args.root,
+            labels_csv=args.labels_csv,
+            max_distance=args.max_distance,
+            val_split=args.val_split,
+            workers=args.workers,
+            refresh_index=args.refresh_index,
+        )
+    elif args.task == 'incremental':
+        train_incremental(
+            ckpt_path=args.ckpt,
+            manifest=args.manifest,
+            output_dir=args.output_dir,
+            data_dir=args.data_dir,
+            images_dir=args.images_dir,
+            labels_csv=args.labels_csv,
+            replay_per_new=args.replay_per_new,
+            new_val_split=args.new_val_split,
+            batch_size=args.batch_size,
             epochs=args.epochs,
+            freeze_epochs=args.freeze_epochs,
             lr=args.lr,
+            num_workers=args.num_workers,
+            max_old_val_drop=args.max_old_val_drop,
+            force=args.force,
+        )
+    elif args.task == 'tune':
+        if not args.data_dir and not (args.images_dir and args.labels_csv):
+            parser.error('tune needs --data_dir or --images_dir/--labels_csv')
+        ints = lambda v: [int(x) for x in v.split(',')] if v else None
+        tune_loader(
+            backbone=args.backbone,
+            img_size=args.img_size,
+            data_dir=args.data_dir,
+            images_dir=args.images_dir,
+            labels_csv=args.labels_csv,
+            memory_limit_mb=args.memory_limit_mb,
+            batch_sizes=ints(args.batch_sizes),
+            workers=ints(args.workers),
+            prefetch_factors=ints(args.prefetch_factors),
+            threads=ints(args.threads),
+            steps=args.steps,
+            output=args.output,
+        )
+    elif args.task == 'sweep':
+        run_sweep(
+            data_dir=args.data_dir,
+            spec_path=args.spec,
+            output_dir=args.output_dir,
+            min_epochs=args.min_epochs,
+            max_epochs=args.max_epochs,
+            eta=args.eta,
             val_split=args.val_split,
+            workers=args.workers,
             num_workers=args.num_workers,
         )
-    elif args.task == 'gradcam':
-        uri = gradcam_data_uri(
-            ckpt_path=args.ckpt,
-            image_path=args.image,
-            target_label=args.target_label,
-            alpha=args.alpha,
+    elif args.task == 'evaluate_exports':
+        if not args.manifest and not args.data_dir and not (args.images_dir and args.labels_csv):
+            parser.error('evaluate_exports needs --manifest, --data_dir or --images_dir/--labels_csv')
+        run_dir = args.run_dir or MODEL_KEY_RUNS[args.model_key]
+        report = evaluate_exports(
+            run_dir=run_dir,
+            manifest=args.manifest,
+            data_dir=args.data_dir,
+            images_dir=args.images_dir,
+            labels_csv=args.labels_csv,
+            max_images=args.max_images,
+            precisions=[p for p in args.precisions.split(',') if p],
+            max_batch=args.max_batch,
+            latency_runs=args.latency_runs,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            logit_tol=args.logit_tol,
+            baseline_path=args.baseline or os.path.join(run_dir, 'export_baseline.json'),
+            update_baseline=args.update_baseline,
+            max_acc_drop=args.max_acc_drop,
+            max_agreement_drop=args.max_agreement_drop,
+            latency_tol=args.latency_tol,
+            output=args.output,
         )
-        print(uri)
+        if report['regressions']:
+            sys.exit(1)
     else:
         raise ValueError('Unknown task')
 
+    cleanup_distributed()
+
 
 if __name__ == '__main__':
     main()